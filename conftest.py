@@ -0,0 +1,7 @@
+import os
+import tempfile
+from pysh.core import lexer_gen
+
+# Cache generated lexers on disk during tests, in a temporary directory rather than the user's.
+_cache_dir = tempfile.TemporaryDirectory()
+os.environ[lexer_gen.CACHE_DIR_ENV] = _cache_dir.name
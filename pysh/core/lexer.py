@@ -1,6 +1,10 @@
 from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from dataclasses import dataclass, field
-from typing import Iterable, Iterator, MutableSequence, Sequence, Sized
+from functools import cached_property
+import time
+from typing import Iterable, Iterator, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Sized
 from . import chars, errors, regex, tokens
 
 StateAndResult = tuple[chars.CharStream, tokens.Token]
@@ -34,6 +38,18 @@ class LexError(errors.NaryError):
 class Rule:
     name: str
     regex_: regex.Regex
+    keywords: tuple[str, ...] = field(default=(), kw_only=True)
+    id: int = field(init=False, compare=False, repr=False)
+    is_skip: bool = field(init=False, compare=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, 'id', tokens.rule_id(self.name))
+        object.__setattr__(self, 'is_skip', isinstance(
+            self.regex_, regex.Skip))
+
+    @cached_property
+    def keyword_ids(self) -> Mapping[str, int]:
+        return {keyword: tokens.rule_id(keyword) for keyword in self.keywords}
 
     def __str__(self) -> str:
         if self.name == str(self.regex_):
@@ -44,9 +60,35 @@ class Rule:
     def __call__(self, state: chars.CharStream) -> StateAndResult:
         try:
             state, result = self.regex_(state)
-            return state, result.token(self.name)
         except errors.Error as error:
             raise RuleError(rule=self, state=state, child=error)
+        if self.keywords:
+            val = result.val()
+            if val in self.keyword_ids:
+                return state, result.token(val, self.keyword_ids[val])
+        return state, result.token(self.name, self.id)
+
+    def advance(self, state: chars.CharStream) -> Optional[chars.CharStream]:
+        index = self.regex_.advance(state.chars, 0)
+        if index < 0:
+            return None
+        return chars.CharStream(state.chars[index:])
+
+    def with_keywords(self, *keywords: str) -> 'Rule':
+        return Rule(self.name, self.regex_, keywords=tuple(sorted(set(self.keywords) | set(keywords))))
+
+    @property
+    def literal(self) -> Optional[str]:
+        if isinstance(self.regex_, regex.Literal):
+            return self.regex_.val
+        if isinstance(self.regex_, regex.And) and self.regex_.children:
+            vals: MutableSequence[str] = []
+            for child in self.regex_.children:
+                if not isinstance(child, regex.Literal):
+                    return None
+                vals.append(child.val)
+            return ''.join(vals)
+        return None
 
     @staticmethod
     def load(rule_name: str, regex_: str | regex.Regex | None = None) -> 'Rule':
@@ -56,9 +98,90 @@ class Rule:
             regex_ = regex.load(regex_)
         return Rule(rule_name, regex_)
 
+    @staticmethod
+    def skip(rule_name: str, regex_: str | regex.Regex) -> 'Rule':
+        if isinstance(regex_, str):
+            regex_ = regex.load(regex_)
+        if not isinstance(regex_, regex.Skip):
+            regex_ = regex.Skip(regex_)
+        return Rule(rule_name, regex_)
+
     @staticmethod
     def whitespace() -> 'Rule':
-        return Rule.load('ws', '~(\\w+)')
+        return Rule.skip('ws', '\\w+')
+
+
+@dataclass
+class _Trie:
+    children: MutableMapping[str, '_Trie'] = field(
+        default_factory=dict[str, '_Trie'])
+    rule_index: Optional[int] = None
+
+    def insert(self, val: str, rule_index: int) -> None:
+        node = self
+        for c in val:
+            node = node.children.setdefault(c, _Trie())
+        if node.rule_index is None:
+            node.rule_index = rule_index
+
+    def match(self, chars_: Sequence[chars.Char]) -> Optional[tuple[int, int]]:
+        node = self
+        match: Optional[tuple[int, int]] = None
+        for length, char in enumerate(chars_, 1):
+            child = node.children.get(char.val)
+            if child is None:
+                break
+            node = child
+            if node.rule_index is not None and (match is None or node.rule_index < match[0]):
+                match = node.rule_index, length
+        return match
+
+
+@dataclass
+class RuleStats:
+    attempts: int = 0
+    successes: int = 0
+    failures: int = 0
+    chars: int = 0
+    time: float = 0
+
+
+@dataclass
+class Stats:
+    rules: MutableMapping[str, RuleStats] = field(
+        default_factory=dict[str, RuleStats])
+
+    def record(self, rule_name: str, state: chars.CharStream, result: Optional[chars.CharStream], elapsed: float) -> None:
+        stats = self.rules.setdefault(rule_name, RuleStats())
+        stats.time += elapsed
+        stats.attempts += 1
+        if result is None:
+            stats.failures += 1
+        else:
+            stats.successes += 1
+            stats.chars += len(state) - len(result)
+
+    def report(self) -> str:
+        lines = [
+            f"{'rule':<16} {'attempts':>10} {'successes':>10} {'failures':>10} {'chars':>10} {'time':>10}"]
+        for rule_name, stats in sorted(self.rules.items(), key=lambda item: item[1].time, reverse=True):
+            lines.append(
+                f'{rule_name:<16} {stats.attempts:>10} {stats.successes:>10} {stats.failures:>10} {stats.chars:>10} {stats.time:>10.6f}')
+        return '\n'.join(lines)
+
+
+# Stats are per context so that concurrent lexes don't record into each other's.
+_stats: ContextVar[Optional[Stats]] = ContextVar('_stats', default=None)
+
+
+@contextmanager
+def instrument() -> Iterator[Stats]:
+    stats = Stats()
+    token = _stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _stats.reset(token)
 
 
 @dataclass(frozen=True)
@@ -74,33 +197,139 @@ class Lexer(Sized, Iterable[Rule]):
     def __iter__(self) -> Iterator[Rule]:
         return iter(self.rules)
 
-    def _rules_dict(self) -> OrderedDict[str, regex.Regex]:
-        rules = OrderedDict[str, regex.Regex]()
+    def _rules_dict(self) -> OrderedDict[str, Rule]:
+        rules = OrderedDict[str, Rule]()
         for rule in self.rules:
-            rules[rule.name] = rule.regex_
+            rules[rule.name] = rule
         return rules
 
     def __or__(self, rhs: 'Lexer | Rule') -> 'Lexer':
         if isinstance(rhs, Rule):
             rhs = Lexer([rhs])
-        return Lexer.load(**(self._rules_dict() | rhs._rules_dict()))
+        return Lexer(list((self._rules_dict() | rhs._rules_dict()).values()))
 
-    def _apply_any(self, state: chars.CharStream) -> StateAndResult:
-        errors_: MutableSequence[errors.Error] = []
-        for rule in self.rules:
+    @cached_property
+    def keywords(self) -> frozenset[str]:
+        return frozenset(keyword for rule in self.rules for keyword in rule.keywords)
+
+    def is_keyword(self, rule: Rule) -> bool:
+        return rule.name in self.keywords and rule.literal == rule.name
+
+    @cached_property
+    def _literals(self) -> _Trie:
+        literals = _Trie()
+        for rule_index, rule in enumerate(self.rules):
+            literal = rule.literal
+            if literal is not None and not self.is_keyword(rule):
+                literals.insert(literal, rule_index)
+        return literals
+
+    @cached_property
+    def _non_literals(self) -> Sequence[tuple[int, Rule]]:
+        return [(rule_index, rule) for rule_index, rule in enumerate(self.rules) if rule.literal is None]
+
+    @cached_property
+    def _literal_indices(self) -> Sequence[int]:
+        return [rule_index for rule_index, rule in enumerate(self.rules)
+                if rule.literal is not None and not self.is_keyword(rule)]
+
+    def _apply_any(self, state: chars.CharStream, stats: Optional[Stats]) -> tuple[chars.CharStream, Optional[tokens.Token]]:
+        start = time.perf_counter() if stats is not None else 0
+        literal = self._literals.match(state.chars)
+        literal_time = time.perf_counter() - start if stats is not None else 0
+        errors_: MutableMapping[int, errors.Error] = {}
+        for rule_index, rule in self._non_literals:
+            if literal is not None and rule_index > literal[0]:
+                break
+            start = time.perf_counter() if stats is not None else 0
+            if rule.is_skip:
+                skipped_state = rule.advance(state)
+                if stats is not None:
+                    stats.record(rule.name, state, skipped_state,
+                                 time.perf_counter() - start)
+                if skipped_state is not None:
+                    if stats is not None:
+                        self._record_literals(stats, state, rule_index, literal_time)
+                    return skipped_state, None
+                continue
             try:
-                return rule(state)
+                rule_state, token = rule(state)
             except errors.Error as error:
-                errors_.append(error)
-        raise LexError(lexer=self, state=state, children=errors_)
+                if stats is not None:
+                    stats.record(rule.name, state, None,
+                                 time.perf_counter() - start)
+                errors_[rule_index] = error
+                continue
+            if stats is not None:
+                stats.record(rule.name, state, rule_state,
+                             time.perf_counter() - start)
+                self._record_literals(stats, state, rule_index, literal_time)
+            return rule_state, token
+        if literal is not None:
+            start = time.perf_counter() if stats is not None else 0
+            rule_index, length = literal
+            rule = self.rules[rule_index]
+            literal_state = chars.CharStream(state.chars[length:])
+            token_ = tokens.Token(
+                rule.name,
+                ''.join(char.val for char in state.chars[:length]),
+                state.chars[0].position,
+                rule.id,
+            )
+            if stats is not None:
+                self._record_literals(
+                    stats, state, rule_index, literal_time + time.perf_counter() - start, literal_state)
+            return literal_state, token_
+        if stats is not None:
+            self._record_literals(stats, state, None, literal_time)
+        raise LexError(lexer=self, state=state, children=self._errors(state, errors_))
+
+    def _record_literals(
+        self,
+        stats: Stats,
+        state: chars.CharStream,
+        rule_index: Optional[int],
+        elapsed: float,
+        result: Optional[chars.CharStream] = None,
+    ) -> None:
+        # One trie lookup stands in for trying each literal rule in order, so every literal
+        # rule before the one that won (rule_index, or all of them if none did) is recorded
+        # as attempted. The lookup's time goes to the winner alone, since the lookup can't be
+        # split per literal. result is set when the winner is itself a literal.
+        for literal_index in self._literal_indices:
+            if rule_index is not None and literal_index > rule_index:
+                break
+            stats.record(
+                self.rules[literal_index].name,
+                state,
+                result if literal_index == rule_index else None,
+                0,
+            )
+        if rule_index is not None:
+            stats.rules.setdefault(self.rules[rule_index].name, RuleStats()).time += elapsed
+
+    def _errors(self, state: chars.CharStream, errors_: Mapping[int, errors.Error]) -> list[errors.Error]:
+        # Every rule's error, in rule order, including the skip and literal rules that weren't tried on their own.
+        children: list[errors.Error] = []
+        for rule_index, rule in enumerate(self.rules):
+            error = errors_.get(rule_index)
+            if error is None:
+                try:
+                    rule(state)
+                    continue
+                except errors.Error as rule_error:
+                    error = rule_error
+            children.append(error)
+        return children
 
     def __call__(self, state: chars.CharStream | str) -> tokens.TokenStream:
         if isinstance(state, str):
             return self(chars.CharStream.load(state))
         tokens_: MutableSequence[tokens.Token] = []
+        stats = _stats.get()
         while state:
-            state, token = self._apply_any(state)
-            if token.val:
+            state, token = self._apply_any(state, stats)
+            if token is not None and token.val:
                 tokens_.append(token)
         return tokens.TokenStream(tokens_)
 
@@ -115,3 +344,47 @@ class Lexer(Sized, Iterable[Rule]):
     @staticmethod
     def whitespace() -> 'Lexer':
         return Lexer([Rule.whitespace()])
+
+
+@dataclass(frozen=True)
+class ContextualLexer:
+    lexer: Lexer
+    start: Optional[frozenset[int]] = None
+    follows: Mapping[int, Optional[frozenset[int]]] = field(
+        default_factory=dict[int, Optional[frozenset[int]]])
+    _lexers: MutableMapping[frozenset[int], Lexer] = field(
+        default_factory=dict[frozenset[int], Lexer], init=False, compare=False, repr=False)
+
+    def __str__(self) -> str:
+        return f'ContextualLexer({self.lexer})'
+
+    def _lexer(self, rule_ids: Optional[frozenset[int]]) -> Lexer:
+        if rule_ids is None:
+            return self.lexer
+        lexer = self._lexers.get(rule_ids)
+        if lexer is None:
+            lexer = Lexer([
+                rule for rule in self.lexer.rules
+                if rule.is_skip or rule.id in rule_ids or not rule_ids.isdisjoint(rule.keyword_ids.values())
+            ])
+            self._lexers[rule_ids] = lexer
+        return lexer
+
+    def __call__(self, state: chars.CharStream | str) -> tokens.TokenStream:
+        if isinstance(state, str):
+            return self(chars.CharStream.load(state))
+        tokens_: MutableSequence[tokens.Token] = []
+        stats = _stats.get()
+        rule_ids = self.start
+        while state:
+            lexer = self._lexer(rule_ids)
+            try:
+                state, token = lexer._apply_any(state, stats)
+            except LexError:
+                if lexer is self.lexer:
+                    raise
+                state, token = self.lexer._apply_any(state, stats)
+            if token is not None and token.val:
+                tokens_.append(token)
+                rule_ids = self.follows.get(token.rule_id)
+        return tokens.TokenStream(tokens_)
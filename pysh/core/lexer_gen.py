@@ -0,0 +1,449 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+import hashlib
+import os
+import string
+import tempfile
+from typing import Any, Callable, MutableMapping, MutableSequence, Optional, Sequence
+from . import chars, errors, lexer, regex, tokens
+
+VERSION = 2
+
+# Generated lexers are only cached on disk when asked to: in CACHE_DIR_ENV if it's set,
+# or in the user's cache directory if CACHE_ENV is set to 1.
+CACHE_DIR_ENV = 'PYSH_CACHE_DIR'
+CACHE_ENV = 'PYSH_CACHE'
+
+_Lex = Callable[[str], tuple[Sequence[tuple[int, int, str]], int]]
+
+
+@dataclass(frozen=True, kw_only=True, repr=False)
+class LexError(errors.Error):
+    state: chars.CharStream
+
+    def _repr_line(self) -> str:
+        return f'LexError(state={self.state}, msg={repr(self.msg)})'
+
+    def __repr__(self) -> str:
+        return self._repr(0)
+
+
+def _leaf_cond(regex_: regex.Regex) -> Optional[str]:
+    if isinstance(regex_, regex.Any):
+        return 'i < n'
+    elif isinstance(regex_, regex.Literal):
+        return f'i < n and s[i] == {repr(regex_.val)}'
+    elif isinstance(regex_, regex.Range):
+        return f'i < n and {repr(regex_.start)} <= s[i] <= {repr(regex_.end)}'
+    elif isinstance(regex_, regex.Whitespace):
+        return 'i < n and s[i] in _WHITESPACE'
+    return None
+
+
+def _has_skip(regex_: regex.Regex) -> bool:
+    if isinstance(regex_, regex.Skip):
+        return True
+    elif isinstance(regex_, regex._NaryRegex):
+        return any(_has_skip(child) for child in regex_.children)
+    elif isinstance(regex_, regex._UnaryRegex):
+        return _has_skip(regex_.child)
+    return False
+
+
+@dataclass
+class _Generator:
+    lines: MutableSequence[str] = field(default_factory=list[str])
+    defs: MutableSequence[str] = field(default_factory=list[str])
+    funcs: MutableMapping[tuple[int, bool], str] = field(
+        default_factory=dict[tuple[int, bool], str])
+    regexes: MutableSequence[regex.Regex] = field(
+        default_factory=list[regex.Regex])
+    rule_names: MutableSequence[str] = field(default_factory=list[str])
+
+    def _emit(self, indent: int, line: str) -> None:
+        self.lines.append(f"{'    '*indent}{line}")
+
+    def _keep(self, indent: int, track: bool, count: str = '1') -> None:
+        if track:
+            if count == '1':
+                self._emit(indent, 'k.append(i)')
+            else:
+                self._emit(indent, f'k.extend(range(i, i + {count}))')
+
+    def _rollback(self, indent: int, track: bool) -> None:
+        if track:
+            self._emit(indent, 'del k[m:]')
+
+    def _mark(self, indent: int, track: bool) -> None:
+        if track:
+            self._emit(indent, 'm = len(k)')
+
+    def func(self, regex_: regex.Regex, track: bool) -> str:
+        key = (id(regex_), track)
+        if key in self.funcs:
+            return self.funcs[key]
+        # Keep regex_ alive so its id can't be reused while generating.
+        self.regexes.append(regex_)
+        name = f"_m{len(self.funcs)}{'_k' if track else ''}"
+        self.funcs[key] = name
+        lines, self.lines = self.lines, []
+        self._emit(0, f'def {name}(s, i, n, k):')
+        self._body(regex_, track)
+        self.defs.extend(list(self.lines) + ['', ''])
+        self.lines = lines
+        return name
+
+    def _body(self, regex_: regex.Regex, track: bool) -> None:
+        cond = _leaf_cond(regex_)
+        if cond is not None:
+            self._emit(1, f'if {cond}:')
+            self._keep(2, track)
+            self._emit(2, 'return i + 1')
+            self._emit(1, 'return -1')
+        elif isinstance(regex_, regex.And):
+            self._and(regex_, track)
+        elif isinstance(regex_, regex.Or):
+            self._mark(1, track)
+            for child in regex_.children:
+                child_cond = _leaf_cond(child)
+                if child_cond is not None:
+                    self._emit(1, f'if {child_cond}:')
+                    self._keep(2, track)
+                    self._emit(2, 'return i + 1')
+                else:
+                    self._emit(1, f'j = {self.func(child, track)}(s, i, n, k)')
+                    self._emit(1, 'if j >= 0:')
+                    self._emit(2, 'return j')
+                    self._rollback(1, track)
+            self._emit(1, 'return -1')
+        elif isinstance(regex_, regex.ZeroOrMore):
+            self._loop(regex_.child, track)
+        elif isinstance(regex_, regex.OneOrMore):
+            child_cond = _leaf_cond(regex_.child)
+            if child_cond is not None:
+                self._emit(1, f'if not ({child_cond}):')
+                self._emit(2, 'return -1')
+                self._keep(1, track)
+                self._emit(1, 'i += 1')
+            else:
+                self._emit(
+                    1, f'i = {self.func(regex_.child, track)}(s, i, n, k)')
+                self._emit(1, 'if i < 0:')
+                self._emit(2, 'return -1')
+            self._loop(regex_.child, track)
+        elif isinstance(regex_, regex.ZeroOrOne) and _leaf_cond(regex_.child) is not None:
+            self._emit(1, f'if {_leaf_cond(regex_.child)}:')
+            self._keep(2, track)
+            self._emit(2, 'return i + 1')
+            self._emit(1, 'return i')
+        elif isinstance(regex_, regex.ZeroOrOne):
+            self._mark(1, track)
+            self._emit(1, f'j = {self.func(regex_.child, track)}(s, i, n, k)')
+            self._emit(1, 'if j >= 0:')
+            self._emit(2, 'return j')
+            self._rollback(1, track)
+            self._emit(1, 'return i')
+        elif isinstance(regex_, regex.UntilEmpty):
+            self._emit(1, 'while i < n:')
+            self._emit(2, f'i = {self.func(regex_.child, track)}(s, i, n, k)')
+            self._emit(2, 'if i < 0:')
+            self._emit(3, 'return -1')
+            self._emit(1, 'return i')
+        elif isinstance(regex_, regex.Not):
+            self._emit(
+                1, f'if i >= n or {self.func(regex_.child, False)}(s, i, n, None) >= 0:')
+            self._emit(2, 'return -1')
+            self._keep(1, track)
+            self._emit(1, 'return i + 1')
+        elif isinstance(regex_, regex.Skip):
+            self._emit(
+                1, f'return {self.func(regex_.child, False)}(s, i, n, None)')
+        else:
+            raise errors.Error(
+                msg=f'unable to generate lexer code for regex {regex_}')
+
+    def _and(self, regex_: regex.And, track: bool) -> None:
+        children = list(regex_.children)
+        while children:
+            run = ''
+            while children and isinstance(head := children[0], regex.Literal):
+                run += head.val
+                children.pop(0)
+            if len(run) > 1:
+                self._emit(1, f'if not s.startswith({repr(run)}, i):')
+                self._emit(2, 'return -1')
+                self._keep(1, track, str(len(run)))
+                self._emit(1, f'i += {len(run)}')
+                continue
+            child = regex.Literal(run) if run else children.pop(0)
+            cond = _leaf_cond(child)
+            if cond is not None:
+                self._emit(1, f'if not ({cond}):')
+                self._emit(2, 'return -1')
+                self._keep(1, track)
+                self._emit(1, 'i += 1')
+            else:
+                self._emit(1, f'i = {self.func(child, track)}(s, i, n, k)')
+                self._emit(1, 'if i < 0:')
+                self._emit(2, 'return -1')
+        self._emit(1, 'return i')
+
+    def _loop(self, child: regex.Regex, track: bool) -> None:
+        cond = _leaf_cond(child)
+        if cond is not None and not track:
+            self._emit(1, f'while {cond}:')
+            self._emit(2, 'i += 1')
+            self._emit(1, 'return i')
+            return
+        self._emit(1, 'while True:')
+        self._mark(2, track)
+        self._emit(2, f'j = {self.func(child, track)}(s, i, n, k)')
+        self._emit(2, 'if j < 0:')
+        self._rollback(3, track)
+        self._emit(3, 'return i')
+        self._emit(2, 'i = j')
+
+    def _append(self, rule_index: int, rule: lexer.Rule, index: str, val: str) -> str:
+        if not rule.keywords:
+            return f'out.append(({rule_index}, {index}, {val}))'
+        keywords = {keyword: self.rule_names.index(
+            keyword) for keyword in rule.keywords}
+        self.defs += [f'_KEYWORDS_{rule_index} = {repr(keywords)}', '', '']
+        return f'v = {val}; out.append((_KEYWORDS_{rule_index}.get(v, {rule_index}), {index}, v))'
+
+    def lex(self, lexer_: lexer.Lexer) -> None:
+        self.rule_names = [rule.name for rule in lexer_.rules]
+        self.rule_names += sorted(lexer_.keywords - set(self.rule_names))
+        body: MutableSequence[str] = []
+        for rule_index, rule in enumerate(lexer_.rules):
+            literal = rule.literal
+            if lexer_.is_keyword(rule):
+                continue
+            elif literal is not None and not rule.keywords:
+                cond = _leaf_cond(regex.Literal(literal)) if len(
+                    literal) == 1 else f's.startswith({repr(literal)}, i)'
+                body += [
+                    f'        if {cond}:',
+                    f'            out.append(({rule_index}, i, {repr(literal)}))',
+                    f'            i += {len(literal)}',
+                    '            continue',
+                ]
+            elif _leaf_cond(rule.regex_) is not None and not rule.keywords:
+                body += [
+                    f'        if {_leaf_cond(rule.regex_)}:',
+                    f'            out.append(({rule_index}, i, s[i]))',
+                    '            i += 1',
+                    '            continue',
+                ]
+            elif isinstance(rule.regex_, regex.Skip):
+                body += [
+                    f'        j = {self.func(rule.regex_, False)}(s, i, n, None)',
+                    '        if j >= 0:',
+                    '            i = j',
+                    '            continue',
+                ]
+            elif _has_skip(rule.regex_):
+                body += [
+                    '        k = []',
+                    f'        j = {self.func(rule.regex_, True)}(s, i, n, k)',
+                    '        if j >= 0:',
+                    '            if k:',
+                    '                ' + self._append(
+                        rule_index, rule, 'k[0]', "''.join([s[x] for x in k])"),
+                    '            i = j',
+                    '            continue',
+                ]
+            else:
+                body += [
+                    f'        j = {self.func(rule.regex_, False)}(s, i, n, None)',
+                    '        if j >= 0:',
+                    '            if j > i:',
+                    '                ' + self._append(
+                        rule_index, rule, 'i', 's[i:j]'),
+                    '            i = j',
+                    '            continue',
+                ]
+        self.lines += [
+            'def lex(s):',
+            '    n = len(s)',
+            '    i = 0',
+            '    out = []',
+            '    while i < n:',
+            *body,
+            '        return out, i',
+            '    return out, -1',
+        ]
+
+
+def generate(lexer_: lexer.Lexer) -> str:
+    generator = _Generator()
+    generator.lex(lexer_)
+    header = [
+        f'# generated by pysh.core.lexer_gen version {VERSION}',
+        f'VERSION = {VERSION}',
+        f'RULES = {repr(tuple(generator.rule_names))}',
+        f'_WHITESPACE = {repr(string.whitespace)}',
+        '',
+        '',
+    ]
+    return '\n'.join(header + list(generator.defs) + list(generator.lines)) + '\n'
+
+
+def _positions(s: str, indices: Sequence[int], start: chars.Position) -> Sequence[chars.Position]:
+    positions: MutableSequence[chars.Position] = []
+    line, col, last = start.line, start.col, 0
+    for index in indices:
+        segment = s[last:index]
+        newlines = segment.count('\n')
+        if newlines:
+            line += newlines
+            col = len(segment) - segment.rfind('\n') - 1
+        else:
+            col += len(segment)
+        last = index
+        positions.append(chars.Position(line, col))
+    return positions
+
+
+@dataclass(frozen=True)
+class GeneratedLexer:
+    source: str
+    filename: str = '<lexer_gen>'
+    # Instrumented lexing falls back to the lexer the source was generated from, if known,
+    # since the generated code doesn't record stats.
+    lexer_: Optional[lexer.Lexer] = field(default=None, compare=False, repr=False)
+
+    @cached_property
+    def _module(self) -> dict[str, Any]:
+        module: dict[str, Any] = {}
+        exec(compile(self.source, self.filename, 'exec'), module)
+        if module.get('VERSION') != VERSION:
+            raise errors.Error(
+                msg=f'generated lexer version {module.get("VERSION")} != {VERSION}')
+        return module
+
+    @cached_property
+    def rule_names(self) -> Sequence[str]:
+        return self._module['RULES']
+
+    @cached_property
+    def _rule_ids(self) -> Sequence[int]:
+        return [tokens.rule_id(rule_name) for rule_name in self.rule_names]
+
+    def __call__(self, state: chars.CharStream | str) -> tokens.TokenStream:
+        if lexer._stats.get() is not None and self.lexer_ is not None:
+            return self.lexer_(state)
+        if isinstance(state, str):
+            s = state
+            start: Optional[chars.Position] = chars.Position()
+        else:
+            s = ''.join(char.val for char in state.chars)
+            start = None
+        lex: _Lex = self._module['lex']
+        matches, error_index = lex(s)
+        if start is not None:
+            positions = _positions(
+                s,
+                [index for _, index, _ in matches] +
+                ([error_index] if error_index >= 0 else []),
+                start,
+            )
+        else:
+            assert isinstance(state, chars.CharStream)
+            positions = [state.chars[index].position for _,
+                         index, _ in matches]
+        tokens_ = [
+            tokens.Token(self.rule_names[rule_index], val,
+                         position, self._rule_ids[rule_index])
+            for (rule_index, _, val), position in zip(matches, positions)
+        ]
+        if error_index >= 0:
+            if isinstance(state, str):
+                rest = chars.CharStream.load(s[error_index:], positions[-1])
+            else:
+                rest = chars.CharStream(state.chars[error_index:])
+            raise LexError(state=rest, msg=f'failed to lex {rest}')
+        return tokens.TokenStream(tokens_)
+
+    def save(self, path: str) -> None:
+        with open(path, 'w') as file:
+            file.write(self.source)
+
+    @staticmethod
+    def load(lexer_: lexer.Lexer) -> 'GeneratedLexer':
+        return GeneratedLexer(generate(lexer_), lexer_=lexer_)
+
+    @staticmethod
+    def load_file(path: str, lexer_: Optional[lexer.Lexer] = None) -> 'GeneratedLexer':
+        with open(path) as file:
+            return GeneratedLexer(file.read(), path, lexer_)
+
+
+_keys: dict[int, tuple[lexer.Lexer, str]] = {}
+_max_keys = 1 << 10
+
+
+def key(lexer_: lexer.Lexer) -> str:
+    entry = _keys.get(id(lexer_))
+    if entry is None or entry[0] is not lexer_:
+        entry = lexer_, hashlib.sha256(
+            f'{VERSION}:{list(lexer_.rules)!r}'.encode()).hexdigest()
+        _keys[id(lexer_)] = entry
+        while len(_keys) > _max_keys:
+            del _keys[next(iter(_keys))]
+    return entry[1]
+
+
+def cache_dir() -> Optional[str]:
+    dir = os.environ.get(CACHE_DIR_ENV)
+    if dir:
+        return dir
+    if os.environ.get(CACHE_ENV) != '1':
+        return None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'pysh')
+
+
+_cache: dict[tuple[Optional[str], str], GeneratedLexer] = {}
+
+
+def _write_atomic(path: str, source: str) -> None:
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(source)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def cached(lexer_: lexer.Lexer, dir: Optional[str] = None) -> GeneratedLexer:
+    dir = dir or cache_dir()
+    key_ = key(lexer_)
+    if (dir, key_) in _cache:
+        return _cache[(dir, key_)]
+    generated: Optional[GeneratedLexer] = None
+    if dir is not None:
+        path = os.path.join(dir, f'lexer_{key_}.py')
+        try:
+            generated = GeneratedLexer.load_file(path, lexer_)
+            # Loading the module checks its version stamp.
+            if generated.rule_names[:len(lexer_)] != tuple(rule.name for rule in lexer_.rules) or not callable(generated._module.get('lex')):
+                generated = None
+        except Exception:
+            # Truncated or corrupt cache files are regenerated below.
+            generated = None
+        if generated is None:
+            generated = GeneratedLexer(generate(lexer_), path, lexer_)
+            try:
+                os.makedirs(dir, exist_ok=True)
+                _write_atomic(path, generated.source)
+            except OSError:
+                pass
+    else:
+        generated = GeneratedLexer.load(lexer_)
+    _cache[(dir, key_)] = generated
+    return generated
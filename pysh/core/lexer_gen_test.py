@@ -0,0 +1,181 @@
+import os
+import tempfile
+from typing import Optional
+from unittest import TestCase, mock
+from . import chars, errors, lexer, lexer_gen, regex
+
+
+class GeneratedLexerTest(TestCase):
+    def test_call(self):
+        for lexer_, inputs in list[tuple[lexer.Lexer, list[str]]]([
+            (
+                lexer.Lexer.literal('a', 'b'),
+                ['', 'a', 'ab', 'ba', 'abc', 'c'],
+            ),
+            (
+                lexer.Lexer.literal('=', '==', 'return'),
+                ['==', 'return=', 'retur'],
+            ),
+            (
+                lexer.Lexer.load(
+                    id='(_|[a-z]|[A-Z])+',
+                    int='(\\-)?(\\d)+',
+                    str='"(^")*"',
+                ) | lexer.Lexer.literal('(', ')') | lexer.Lexer.whitespace(),
+                [
+                    'a(b, c)',
+                    'f(-12)\n  g("a b")\n',
+                    '"unterminated',
+                    'a $',
+                ],
+            ),
+            (
+                lexer.Lexer.load(
+                    r='a~bc',
+                    s='x?y+',
+                    t='z!',
+                    any='.',
+                ),
+                ['abc', 'ab', 'yyxyxy', 'zzz', 'q', 'abcq\nabc'],
+            ),
+            (
+                lexer.Lexer.literal('return') | lexer.Lexer([
+                    lexer.Rule.load('id', '[a-z]+').with_keywords(
+                        'return', 'none'),
+                ]) | lexer.Lexer.whitespace(),
+                ['return', 'returnx none', 'a return b'],
+            ),
+        ]):
+            for input in inputs:
+                with self.subTest(lexer_=lexer_, input=input):
+                    generated = lexer_gen.GeneratedLexer.load(lexer_)
+                    try:
+                        expected = lexer_(input)
+                    except errors.Error:
+                        with self.assertRaises(errors.Error):
+                            generated(input)
+                    else:
+                        self.assertEqual(generated(input), expected)
+                        self.assertEqual(
+                            [token.rule_id for token in generated(input)],
+                            [token.rule_id for token in expected],
+                        )
+
+    def test_call_char_stream(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.whitespace()
+        state = chars.CharStream.load('ab cd', chars.Position(3, 4))
+        self.assertEqual(
+            lexer_gen.GeneratedLexer.load(lexer_)(state),
+            lexer_(state),
+        )
+
+    def test_unsupported_regex(self):
+        class Custom(regex.Regex):
+            def __call__(self, state: chars.CharStream) -> regex.StateAndResult:
+                raise errors.Error(msg='custom')
+
+        with self.assertRaises(errors.Error):
+            lexer_gen.generate(lexer.Lexer([lexer.Rule('r', Custom())]))
+
+    def test_save_load_file(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.whitespace()
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'lexer.py')
+            lexer_gen.GeneratedLexer.load(lexer_).save(path)
+            self.assertEqual(
+                lexer_gen.GeneratedLexer.load_file(path)('ab cd'),
+                lexer_('ab cd'),
+            )
+
+    def test_instrument(self):
+        def counts(stats: lexer.Stats) -> dict[str, tuple[int, int, int, int]]:
+            return {rule_name: (rule_stats.attempts, rule_stats.successes, rule_stats.failures, rule_stats.chars)
+                    for rule_name, rule_stats in stats.rules.items()}
+
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal(
+            '=') | lexer.Lexer.whitespace()
+        with lexer.instrument() as expected:
+            expected_tokens = lexer_('a = bc')
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'lexer.py')
+            lexer_gen.GeneratedLexer.load(lexer_).save(path)
+            for name, generated, instrumented in list[tuple[str, lexer_gen.GeneratedLexer, bool]]([
+                ('load', lexer_gen.GeneratedLexer.load(lexer_), True),
+                ('cached', lexer_gen.cached(lexer_, dir), True),
+                ('load_file', lexer_gen.GeneratedLexer.load_file(path, lexer_), True),
+                # Without the source lexer there's nothing to record stats with.
+                ('load_file without lexer', lexer_gen.GeneratedLexer.load_file(path), False),
+            ]):
+                with self.subTest(name=name):
+                    with lexer.instrument() as stats:
+                        self.assertEqual(generated('a = bc'), expected_tokens)
+                    self.assertEqual(counts(stats), counts(expected) if instrumented else {})
+
+
+class CacheTest(TestCase):
+    def test_key(self):
+        self.assertEqual(
+            lexer_gen.key(lexer.Lexer.load(id='[a-z]+')),
+            lexer_gen.key(lexer.Lexer.load(id='[a-z]+')),
+        )
+        self.assertNotEqual(
+            lexer_gen.key(lexer.Lexer.load(id='[a-z]+')),
+            lexer_gen.key(lexer.Lexer.load(id='[a-y]+')),
+        )
+        lexer_ = lexer.Lexer.load(id='[a-z]+')
+        self.assertIs(lexer_gen.key(lexer_), lexer_gen.key(lexer_))
+
+    def test_cache_dir(self):
+        home = os.path.join(os.path.expanduser('~'), '.cache', 'pysh')
+        for env, expected in list[tuple[dict[str, str], Optional[str]]]([
+            ({}, None),
+            ({'XDG_CACHE_HOME': '/xdg'}, None),
+            ({lexer_gen.CACHE_ENV: '0'}, None),
+            ({lexer_gen.CACHE_ENV: '1'}, home),
+            ({lexer_gen.CACHE_ENV: '1', 'XDG_CACHE_HOME': '/xdg'}, os.path.join('/xdg', 'pysh')),
+            ({lexer_gen.CACHE_DIR_ENV: '/dir'}, '/dir'),
+            ({lexer_gen.CACHE_DIR_ENV: '/dir', lexer_gen.CACHE_ENV: '1'}, '/dir'),
+        ]):
+            with self.subTest(env=env, expected=expected):
+                environ = {name: val for name, val in os.environ.items()
+                           if name not in (lexer_gen.CACHE_DIR_ENV, lexer_gen.CACHE_ENV, 'XDG_CACHE_HOME')}
+                with mock.patch.dict(os.environ, environ | env, clear=True):
+                    self.assertEqual(lexer_gen.cache_dir(), expected)
+
+    def test_cached(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal('.')
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, f'lexer_{lexer_gen.key(lexer_)}.py')
+            generated = lexer_gen.cached(lexer_, dir)
+            self.assertEqual(generated('a.b'), lexer_('a.b'))
+            self.assertTrue(os.path.exists(path))
+            self.assertEqual(os.listdir(dir), [os.path.basename(path)])
+            self.assertIs(lexer_gen.cached(lexer_, dir), generated)
+
+    def test_cached_load_file(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal(',')
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, f'lexer_{lexer_gen.key(lexer_)}.py')
+            lexer_gen.GeneratedLexer.load(lexer_).save(path)
+            generated = lexer_gen.cached(lexer_, dir)
+            self.assertEqual(generated.filename, path)
+            self.assertEqual(generated('a,b'), lexer_('a,b'))
+
+    def test_cached_invalid_file(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal(';')
+        for contents in [
+            'VERSION = -1\n',
+            '',
+            'VERSION = 2\ndef lex(s:\n',
+            'raise RuntimeError()\n',
+            f'VERSION = {lexer_gen.VERSION}\nRULES = ()\n',
+            lexer_gen.generate(lexer_)[:100],
+        ]:
+            with self.subTest(contents=contents):
+                with tempfile.TemporaryDirectory() as dir:
+                    path = os.path.join(dir, f'lexer_{lexer_gen.key(lexer_)}.py')
+                    with open(path, 'w') as file:
+                        file.write(contents)
+                    self.assertEqual(lexer_gen.cached(lexer_, dir)('a;'), lexer_('a;'))
+                    with open(path) as file:
+                        self.assertEqual(file.read(), lexer_gen.generate(lexer_))
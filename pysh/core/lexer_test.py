@@ -1,8 +1,30 @@
+import threading
 from typing import Optional, Sequence
 from unittest import TestCase
 from . import chars, errors, lexer, regex, tokens
 
 
+class RuleTest(TestCase):
+    def test_id(self):
+        rule = lexer.Rule.load('r', 'a')
+        self.assertEqual(rule.id, tokens.rule_id('r'))
+        _, token = rule(chars.CharStream.load('a'))
+        self.assertEqual(token.rule_id, rule.id)
+
+
+class RuleLiteralTest(TestCase):
+    def test_literal(self):
+        for rule, expected in list[tuple[lexer.Rule, Optional[str]]]([
+            (lexer.Rule.load('a'), 'a'),
+            (lexer.Rule.load('abc'), 'abc'),
+            (lexer.Rule.load('r', 'a+'), None),
+            (lexer.Rule.load('r', '(ab)'), 'ab'),
+            (lexer.Rule.load('r', '[a-z]'), None),
+        ]):
+            with self.subTest(rule=rule, expected=expected):
+                self.assertEqual(rule.literal, expected)
+
+
 class LexerTest(TestCase):
     def test_call(self):
         for lexer_, state, expected in list[tuple[lexer.Lexer, str, Optional[tokens.TokenStream]]]([
@@ -59,6 +81,44 @@ class LexerTest(TestCase):
                     tokens.Token('s', 'b', chars.Position(0, 2)),
                 ])
             ),
+            (
+                lexer.Lexer.literal('=', '=='),
+                '==',
+                tokens.TokenStream([
+                    tokens.Token('=', '=', chars.Position(0, 0)),
+                    tokens.Token('=', '=', chars.Position(0, 1)),
+                ])
+            ),
+            (
+                lexer.Lexer.literal('==', '='),
+                '===',
+                tokens.TokenStream([
+                    tokens.Token('==', '==', chars.Position(0, 0)),
+                    tokens.Token('=', '=', chars.Position(0, 2)),
+                ])
+            ),
+            (
+                lexer.Lexer.literal('return') | lexer.Rule.load(
+                    'id', '[a-z]+'),
+                'returns',
+                tokens.TokenStream([
+                    tokens.Token('return', 'return', chars.Position(0, 0)),
+                    tokens.Token('id', 's', chars.Position(0, 6)),
+                ])
+            ),
+            (
+                lexer.Lexer([lexer.Rule.load('id', '[a-z]+')]) |
+                lexer.Lexer.literal('return'),
+                'return',
+                tokens.TokenStream([
+                    tokens.Token('id', 'return', chars.Position(0, 0)),
+                ])
+            ),
+            (
+                lexer.Lexer.literal('ab'),
+                'a',
+                None
+            ),
         ]):
             with self.subTest(lexer_=lexer_, state=state, expected=expected):
                 if expected is None:
@@ -67,6 +127,57 @@ class LexerTest(TestCase):
                 else:
                     self.assertEqual(lexer_(state), expected)
 
+    def test_keywords(self):
+        lexer_ = lexer.Lexer.literal('return') | lexer.Lexer([
+            lexer.Rule.load('id', '[a-z]+').with_keywords('return', 'none'),
+        ]) | lexer.Lexer.whitespace()
+        for state, expected in list[tuple[str, tokens.TokenStream]]([
+            (
+                'return',
+                tokens.TokenStream([
+                    tokens.Token('return', 'return', chars.Position(0, 0)),
+                ]),
+            ),
+            (
+                'returnx none',
+                tokens.TokenStream([
+                    tokens.Token('id', 'returnx', chars.Position(0, 0)),
+                    tokens.Token('none', 'none', chars.Position(0, 8)),
+                ]),
+            ),
+        ]):
+            with self.subTest(state=state, expected=expected):
+                actual = lexer_(state)
+                self.assertEqual(actual, expected)
+                self.assertEqual(
+                    [token.rule_id for token in actual],
+                    [token.rule_id for token in expected],
+                )
+        self.assertEqual(lexer_.keywords, frozenset({'return', 'none'}))
+        self.assertTrue(lexer_.is_keyword(lexer.Rule.load('return')))
+        self.assertFalse(lexer_.is_keyword(lexer.Rule.load('id', '[a-z]+')))
+
+    def test_skip(self):
+        rule = lexer.Rule.skip('ws', '\\w+')
+        self.assertTrue(rule.is_skip)
+        self.assertEqual(rule, lexer.Rule.whitespace())
+        self.assertFalse(lexer.Rule.load('r', 'a').is_skip)
+        self.assertEqual(
+            rule.advance(chars.CharStream.load(' \na')),
+            chars.CharStream([chars.Char('a', chars.Position(1, 0))]),
+        )
+        self.assertIsNone(rule.advance(chars.CharStream.load('a')))
+        lexer_ = lexer.Lexer.whitespace() | lexer.Lexer.load(id='[a-z]+')
+        self.assertEqual(
+            lexer_('  a \n b'),
+            tokens.TokenStream([
+                tokens.Token('id', 'a', chars.Position(0, 2)),
+                tokens.Token('id', 'b', chars.Position(1, 1)),
+            ]),
+        )
+        with self.assertRaises(errors.Error):
+            lexer_(' $')
+
     def test_literals(self):
         for vals, expected in list[tuple[Sequence[str], lexer.Lexer]]([
             (
@@ -92,6 +203,24 @@ class LexerTest(TestCase):
             with self.subTest(vals=vals, expected=expected):
                 self.assertEqual(lexer.Lexer.literal(*vals), expected)
 
+    def test_error(self):
+        for lexer_, input in list[tuple[lexer.Lexer, str]]([
+            (lexer.Lexer.literal('a', 'bc', '='), 'x'),
+            (lexer.Lexer.literal('a', 'bc', '='), 'bx'),
+            (lexer.Lexer.literal('a', 'bc') | lexer.Lexer.whitespace(), 'a x'),
+            (lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal('=', '+='), 'a = 1'),
+        ]):
+            with self.subTest(lexer_=lexer_, input=input):
+                with self.assertRaises(lexer.LexError) as context:
+                    lexer_(input)
+                state = context.exception.state
+                expected: list[errors.Error] = []
+                for rule in lexer_.rules:
+                    with self.assertRaises(errors.Error) as rule_context:
+                        rule(state)
+                    expected.append(rule_context.exception)
+                self.assertEqual(context.exception.children, expected)
+
     def test_or(self):
         for lhs, rhs, expected in list[tuple[lexer.Lexer, lexer.Lexer, lexer.Lexer]]([
             (
@@ -182,3 +311,62 @@ class LexerTest(TestCase):
         ]):
             with self.subTest(lhs=lhs, rhs=rhs, expected=expected):
                 self.assertEqual(lhs | rhs, expected)
+
+
+class InstrumentTest(TestCase):
+    def test_instrument(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal(
+            '=') | lexer.Lexer.whitespace()
+        with lexer.instrument() as stats:
+            lexer_('a = bc')
+        self.assertEqual(
+            {rule_name: (rule_stats.attempts, rule_stats.successes, rule_stats.failures, rule_stats.chars)
+             for rule_name, rule_stats in stats.rules.items()},
+            {
+                'id': (5, 2, 3, 3),
+                '=': (3, 1, 2, 1),
+                'ws': (2, 2, 0, 2),
+            },
+        )
+        self.assertIn('id', stats.report())
+        lexer_('a')
+        self.assertEqual(stats.rules['id'].attempts, 5)
+
+    def test_instrument_literal_shadowed(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+') | lexer.Lexer.literal('if')
+        with lexer.instrument() as stats:
+            lexer_('if')
+        self.assertEqual(
+            {rule_name: (rule_stats.attempts, rule_stats.successes, rule_stats.failures)
+             for rule_name, rule_stats in stats.rules.items()},
+            {'id': (1, 1, 0)},
+        )
+
+    def test_instrument_literals(self):
+        lexer_ = lexer.Lexer.literal('=', '+') | lexer.Lexer.load(id='[a-z]+')
+        with lexer.instrument() as stats:
+            lexer_('a=b+c')
+        self.assertEqual(
+            {rule_name: (rule_stats.attempts, rule_stats.successes, rule_stats.failures, rule_stats.chars)
+             for rule_name, rule_stats in stats.rules.items()},
+            {
+                '=': (5, 1, 4, 1),
+                '+': (4, 1, 3, 1),
+                'id': (3, 3, 0, 3),
+            },
+        )
+        self.assertGreater(stats.rules['+'].time, 0)
+        with lexer.instrument() as stats:
+            lexer_('a=b')
+        self.assertEqual(stats.rules['+'].attempts, 2)
+        self.assertEqual(stats.rules['+'].time, 0)
+
+    def test_instrument_thread(self):
+        lexer_ = lexer.Lexer.load(id='[a-z]+')
+        with lexer.instrument() as stats:
+            thread = threading.Thread(target=lexer_, args=('abc',))
+            thread.start()
+            thread.join()
+            self.assertEqual(stats.rules, {})
+            lexer_('a')
+        self.assertEqual(stats.rules['id'].attempts, 1)
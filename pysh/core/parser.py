@@ -1,6 +1,13 @@
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field, fields
-from typing import Callable, Generic, Iterable, Iterator, Mapping, MutableSequence, Optional, Sequence, Sized, Type,  TypeVar, Union, overload
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass, field, fields, replace
+from enum import Enum, auto
+from functools import cached_property
+from itertools import count
+import json
+import time
+from typing import Any, Callable, ClassVar, Generator, Generic, Iterable, Iterator, Mapping, MutableMapping, MutableSequence, Optional, Sequence, Sized, Type, TypeVar, Union, overload
 from . import errors, lexer, tokens
 
 _Result = TypeVar('_Result')
@@ -48,27 +55,572 @@ class ParseError(StateError):
 class Scope(Generic[_Result]):
     rules: Mapping[str, 'SingleResultRule[_Result]'] = field(
         default_factory=dict[str, 'SingleResultRule[_Result]'])
+    parent: Optional['Scope[_Result]'] = field(default=None, kw_only=True)
+    _resolved: MutableMapping[str, Optional['SingleResultRule[_Result]']] = field(
+        default_factory=dict[str, Optional['SingleResultRule[_Result]']], init=False, compare=False, repr=False)
 
     def __post_init__(self):
         for _, rule in self.rules.items():
             assert rule is not None
 
     def __str__(self) -> str:
-        return f"{{{', '.join([f'{name}={rule}' for name, rule in self.rules.items()])}}}"
+        return f"{{{', '.join([f'{name}={rule}' for name, rule in self.items()])}}}"
+
+    @cached_property
+    def _flat(self) -> Mapping[str, 'SingleResultRule[_Result]']:
+        if self.parent is None:
+            return self.rules
+        return dict(self.parent._flat) | dict(self.rules)
+
+    def _lookup(self, name: str) -> Optional['SingleResultRule[_Result]']:
+        if self.parent is None:
+            return self.rules.get(name)
+        if name not in self._resolved:
+            rule = self.rules.get(name)
+            self._resolved[name] = rule if rule is not None else self.parent._lookup(
+                name)
+        return self._resolved[name]
+
+    def __bool__(self) -> bool:
+        return bool(self.rules) or bool(self.parent)
 
     def __len__(self) -> int:
-        return len(self.rules)
+        return len(self._flat)
+
+    def __contains__(self, name: str) -> bool:
+        return self._lookup(name) is not None
 
     def __getitem__(self, name: str) -> 'SingleResultRule[_Result]':
-        if name not in self.rules:
+        rule = self._lookup(name)
+        if rule is None:
             raise KeyError(f'unknown rule {name}')
-        return self.rules[name]
+        return rule
 
     def __iter__(self) -> Iterator[str]:
-        return iter(self.rules)
+        return iter(self._flat)
+
+    def items(self) -> Iterable[tuple[str, 'SingleResultRule[_Result]']]:
+        return self._flat.items()
 
     def __or__(self, rhs: 'Scope[_Result]') -> 'Scope[_Result]':
-        return Scope[_Result](dict(self.rules) | dict(rhs.rules))
+        if not rhs:
+            return self
+        if not self:
+            return rhs
+        if rhs.parent is None and rhs.rules is self.rules:
+            # rhs is already the innermost layer.
+            return self
+        return Scope[_Result](rhs.rules, parent=self | rhs.parent if rhs.parent is not None else self)
+
+
+_MemoKey = tuple[str, int]
+_MemoEntry = tuple[Scope[Any], Optional[tokens.Token], Any, int]
+
+
+@dataclass
+class _Memo:
+    max_size: int
+    # Entries bucketed by the length of the state they start at.
+    entries: MutableMapping[int, MutableMapping[_MemoKey, _MemoEntry]] = field(
+        default_factory=dict[int, MutableMapping[_MemoKey, _MemoEntry]])
+    retain: bool = False
+    size: int = 0
+    # Length of the state at the last cut. Nothing before it is kept.
+    cut: Optional[int] = None
+
+    def __len__(self) -> int:
+        return self.size
+
+    def get(self, key: _MemoKey, state: tokens.TokenStream, scope: Scope[Any], farthest: Optional['_Farthest']) -> Optional[Any]:
+        bucket = self.entries.get(len(state))
+        entry = bucket.get(key) if bucket is not None else None
+        if entry is None:
+            return None
+        entry_scope, entry_head, result, reach = entry
+        if entry_scope is not scope or entry_head is not (state.tokens[0] if state else None):
+            return None
+        if farthest is not None:
+            farthest.reach = min(farthest.reach, reach)
+        return result
+
+    def start(self, state: tokens.TokenStream, farthest: Optional['_Farthest']) -> int:
+        if farthest is None:
+            return 0
+        reach, farthest.reach = farthest.reach, len(state) + 1
+        return reach
+
+    def put(self, key: _MemoKey, state: tokens.TokenStream, scope: Scope[Any], result: Any, outer_reach: int, farthest: Optional['_Farthest']) -> None:
+        reach = 0
+        if farthest is not None:
+            reach = farthest.reach
+            if not isinstance(result, errors.Error):
+                reach = min(reach, len(result[0]) + 1)
+            farthest.reach = min(outer_reach, reach)
+        if self.cut is None or len(state) <= self.cut:
+            self._store(len(state), key, (scope, state.tokens[0] if state else None, result, reach))
+
+    def _store(self, size: int, key: _MemoKey, entry: _MemoEntry) -> None:
+        bucket = self.entries.get(size)
+        if bucket is None:
+            bucket = self.entries[size] = {}
+        if key not in bucket:
+            self.size += 1
+        bucket[key] = entry
+        while self.size > self.max_size:
+            oldest_size, oldest = next(iter(self.entries.items()))
+            del oldest[next(iter(oldest))]
+            if not oldest:
+                del self.entries[oldest_size]
+            self.size -= 1
+
+    def release(self, state: tokens.TokenStream) -> None:
+        if self.retain:
+            return
+        self.cut = len(state)
+        for size in [size for size in self.entries if size > self.cut]:
+            self.size -= len(self.entries.pop(size))
+
+
+class _Failure(errors.Error):
+    def __init__(self):
+        pass
+
+
+@dataclass(frozen=True, kw_only=True, repr=False)
+class _CutError(errors.UnaryError):
+    def _repr_line(self) -> str:
+        return '_CutError()'
+
+    def __repr__(self) -> str:
+        return self._repr(0)
+
+
+@dataclass
+class _Farthest:
+    state: Optional[tokens.TokenStream] = None
+    rule_ids: set[int] = field(default_factory=set[int])
+    # Length of the shortest state examined by the innermost memoized rule.
+    reach: int = 0
+
+    def expect(self, state: tokens.TokenStream, rule_ids: Iterable[int]) -> None:
+        self.reach = min(self.reach, len(state))
+        if self.state is None or len(state) < len(self.state):
+            self.state = state
+            self.rule_ids = set(rule_ids)
+        elif len(state) == len(self.state):
+            self.rule_ids.update(rule_ids)
+
+    def error(self, rule_name: str, state: tokens.TokenStream) -> 'ParseError':
+        # Without any recorded expectations the parse failed where it started.
+        state = self.state if self.state is not None else state
+        expected = ', '.join(sorted(tokens.rule_name(rule_id)
+                             for rule_id in self.rule_ids))
+        actual = str(state.tokens[0]) if state else 'end of stream'
+        position = f' at {state.tokens[0].position}' if state else ''
+        return ParseError(rule_name=rule_name, state=state, msg=f'expected one of {expected} got {actual}{position}')
+
+
+@dataclass(frozen=True)
+class _Context:
+    memo: Optional[_Memo] = None
+    farthest: Optional[_Farthest] = None
+    debug: bool = False
+    profile: Optional['Profile'] = None
+    choices: Optional['Choices'] = None
+    # Results of factored prefixes, keyed by the id of the _Prefix rule.
+    prefixes: Optional[MutableMapping[int, MutableSequence[MutableSequence[Any]]]] = None
+
+
+# Parse state is per context so that concurrent and nested parses don't share it.
+_context: ContextVar[_Context] = ContextVar('_context', default=_Context())
+
+
+def _set(**changes: Any) -> Token[_Context]:
+    return _context.set(replace(_context.get(), **changes))
+
+
+@contextmanager
+def debug() -> Iterator[None]:
+    token = _set(debug=True)
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _rule_error(rule: 'Rule[Any]', state: tokens.TokenStream, error: errors.Error, cut: bool = False) -> errors.Error:
+    if isinstance(error, _CutError):
+        error, cut = error.child, True
+    if _context.get().debug:
+        error = RuleError(rule=rule, state=state, children=[error])
+    return _CutError(child=error) if cut else error
+
+
+def _parse_error(rule_name: str, state: tokens.TokenStream, error: errors.Error, nested: bool = True) -> errors.Error:
+    cut = False
+    if isinstance(error, _CutError):
+        error, cut = error.child, True
+    parse_error = ParseError(rule_name=rule_name, state=state, children=[error])
+    return _CutError(child=parse_error) if cut and nested else parse_error
+
+
+def _expected_error(rule: 'Rule[Any]', state: tokens.TokenStream, lex_rule: lexer.Rule) -> errors.Error:
+    context = _context.get()
+    if context.farthest is not None:
+        context.farthest.expect(state, (lex_rule.id,))
+    if context.debug:
+        return RuleError(rule=rule, state=state, msg=f"expected {lex_rule.name} got {state.tokens[0].rule_name if state else 'end of stream'}")
+    return _Failure()
+
+
+def _expect_error(error: errors.Error) -> None:
+    # Custom rules report what they expected through the errors they raise.
+    farthest = _context.get().farthest
+    if farthest is not None and isinstance(error, tokens.TokenStreamError) and error.expected is not None:
+        farthest.expect(error.state, (error.expected,))
+
+
+def _reach_end() -> None:
+    # Custom rules can look at any later token without recording it, so
+    # incremental parses treat them as reaching the end of the stream.
+    context = _context.get()
+    if context.farthest is not None and context.memo is not None and context.memo.retain:
+        context.farthest.reach = 0
+
+
+@dataclass(frozen=True)
+class First:
+    rule_ids: frozenset[int] = frozenset()
+    nullable: bool = False
+    unknown: bool = False
+
+    def __or__(self, rhs: 'First') -> 'First':
+        return First(self.rule_ids | rhs.rule_ids, self.nullable or rhs.nullable, self.unknown or rhs.unknown)
+
+    def __and__(self, rhs: 'First') -> 'First':
+        # A sequence is only nullable if every part of it is, even when some part is unknown.
+        if not self.nullable:
+            return self
+        return First(self.rule_ids | rhs.rule_ids, rhs.nullable, self.unknown or rhs.unknown)
+
+    def optional(self) -> 'First':
+        return replace(self, nullable=True)
+
+    def admits(self, rule_id: Optional[int]) -> bool:
+        return self.unknown or self.nullable or rule_id in self.rule_ids
+
+
+def _scope_key(scope: Scope[Any]) -> tuple[tuple[str, int], ...]:
+    return tuple((name, id(rule)) for name, rule in scope.items())
+
+
+@dataclass
+class Follows:
+    tokens: MutableMapping[int, First] = field(
+        default_factory=dict[int, First])
+    unknown: bool = False
+    _rules: MutableMapping[tuple[str, tuple[tuple[str, int], ...]], First] = field(
+        default_factory=dict[tuple[str, tuple[tuple[str, int], ...]], First], repr=False)
+    _pending: MutableSequence[tuple['Rule[Any]', Scope[Any], First]] = field(
+        default_factory=list[tuple['Rule[Any]', Scope[Any], First]], repr=False)
+
+    def token(self, rule_id: int, after: First) -> None:
+        self.tokens[rule_id] = self.tokens.get(rule_id, First()) | after
+
+    def rule(self, rule_name: str, scope: Scope[Any], after: First) -> None:
+        if rule_name not in scope:
+            return
+        key = rule_name, _scope_key(scope)
+        prev_after = self._rules.get(key)
+        if prev_after is not None:
+            after |= prev_after
+        if after != prev_after:
+            self._rules[key] = after
+            self._pending.append((scope[rule_name], scope, after))
+
+    @staticmethod
+    def load(rule: 'Rule[Any]', scope: Scope[Any]) -> 'Follows':
+        follows = Follows()
+        rule.follow(scope, First(nullable=True), follows)
+        while follows._pending and not follows.unknown:
+            rule, scope, after = follows._pending.pop()
+            rule.follow(scope, after, follows)
+        return follows
+
+
+_Steps = Generator[Union[tuple['Rule[Any]', tokens.TokenStream, 'Scope[Any]'], '_Steps'], Any, Any]
+_Rebuild = Callable[['Rule[Any]'], Any]
+
+
+@dataclass
+class RuleProfile:
+    calls: int = 0
+    successes: int = 0
+    failures: int = 0
+    tokens: int = 0
+    backtracks: int = 0
+    inclusive: float = 0
+    exclusive: float = 0
+
+
+@dataclass
+class _ProfileFrame:
+    name: str
+    path: tuple[str, ...]
+    size: int
+    start: float
+    transparent: bool
+    children: float = 0
+
+
+def _profile_name(rule: 'Rule[Any]') -> str:
+    if isinstance(rule, Ref):
+        return rule.rule_name
+    elif isinstance(rule, Parser):
+        return f'Parser({rule.root_rule_name})'
+    elif isinstance(rule, _Adapter):
+        return f'{rule.kind}.{rule.method}'
+    return type(rule).__qualname__
+
+
+@dataclass
+class Profile:
+    rules: MutableMapping[str, RuleProfile] = field(
+        default_factory=dict[str, RuleProfile])
+    stacks: MutableMapping[tuple[str, ...], float] = field(
+        default_factory=dict[tuple[str, ...], float])
+    _frames: MutableSequence[_ProfileFrame] = field(
+        default_factory=list[_ProfileFrame], repr=False)
+    _active: MutableMapping[str, int] = field(
+        default_factory=dict[str, int], repr=False)
+
+    def enter(self, rule: 'Rule[Any]', state: tokens.TokenStream) -> None:
+        name = _profile_name(rule)
+        parent = self._frames[-1] if self._frames else None
+        self.rules.setdefault(name, RuleProfile()).calls += 1
+        self._active[name] = self._active.get(name, 0) + 1
+        self._frames.append(_ProfileFrame(
+            name,
+            (parent.path if parent is not None else ()) + (name,),
+            len(state),
+            time.perf_counter(),
+            False,
+        ))
+
+    def enter_helper(self) -> None:
+        # Helper generators run on behalf of the rule that yielded them.
+        parent = self._frames[-1]
+        self._frames.append(_ProfileFrame(
+            parent.name, parent.path, parent.size, time.perf_counter(), True))
+
+    def exit(self, result: Any, error: Optional[errors.Error]) -> None:
+        frame = self._frames.pop()
+        elapsed = time.perf_counter() - frame.start
+        parent = self._frames[-1] if self._frames else None
+        if frame.transparent:
+            if parent is not None:
+                parent.children += frame.children
+            return
+        if parent is not None:
+            parent.children += elapsed
+        profile = self.rules[frame.name]
+        exclusive = elapsed - frame.children
+        profile.exclusive += exclusive
+        self.stacks[frame.path] = self.stacks.get(frame.path, 0) + exclusive
+        self._active[frame.name] -= 1
+        if not self._active[frame.name]:
+            profile.inclusive += elapsed
+        if error is not None:
+            profile.failures += 1
+        else:
+            profile.successes += 1
+            state = result if isinstance(result, tokens.TokenStream) else result[0]
+            profile.tokens += frame.size - len(state)
+
+    def backtrack(self) -> None:
+        self.rules[self._frames[-1].name].backtracks += 1
+
+    def report(self) -> str:
+        lines = [
+            f"{'rule':<32} {'calls':>10} {'successes':>10} {'failures':>10} {'tokens':>10} {'backtracks':>10} {'inclusive':>10} {'exclusive':>10}"]
+        for name, profile in sorted(self.rules.items(), key=lambda item: item[1].exclusive, reverse=True):
+            lines.append(
+                f'{name:<32} {profile.calls:>10} {profile.successes:>10} {profile.failures:>10} {profile.tokens:>10} '
+                f'{profile.backtracks:>10} {profile.inclusive:>10.6f} {profile.exclusive:>10.6f}')
+        return '\n'.join(lines)
+
+    def collapsed(self) -> str:
+        return ''.join(f"{';'.join(path)} {round(time_ * 1e6)}\n" for path, time_ in sorted(self.stacks.items()))
+
+
+@contextmanager
+def profile() -> Iterator[Profile]:
+    profile_ = Profile()
+    token = _set(profile=profile_)
+    try:
+        yield profile_
+    finally:
+        _context.reset(token)
+
+
+@dataclass
+class Choices:
+    # Attempts and successes per alternative of each compiled Or whose dispatch fell back to
+    # trying every alternative (an Or reached from scopes that disagree on its dispatch table),
+    # keyed by the Or's path. Applying them orders its alternatives by success rate, but only
+    # within runs that can't both match. Dispatched Ors are neither recorded nor reordered:
+    # a bucket only holds alternatives that admit the same token.
+    attempts: MutableMapping[str, MutableSequence[int]] = field(
+        default_factory=dict[str, MutableSequence[int]])
+    successes: MutableMapping[str, MutableSequence[int]] = field(
+        default_factory=dict[str, MutableSequence[int]])
+
+    def record(self, rule: 'Or[Any]', index: int, success: bool) -> None:
+        attempts = self.attempts.get(rule.path)
+        if attempts is None:
+            attempts = self.attempts[rule.path] = [0] * len(rule.children)
+        successes = self.successes.get(rule.path)
+        if successes is None:
+            successes = self.successes[rule.path] = [0] * len(rule.children)
+        attempts[index] += 1
+        if success:
+            successes[index] += 1
+
+    def rates(self, path: str) -> Optional[Sequence[float]]:
+        attempts = self.attempts.get(path)
+        successes = self.successes.get(path)
+        if attempts is None or successes is None or len(attempts) != len(successes):
+            return None
+        return [success / attempt if attempt else 0. for attempt, success in zip(attempts, successes)]
+
+    def apply(self, parser_: 'Parser[_Result]') -> 'Parser[_Result]':
+        return replace(parser_, choices=Choices(
+            {path: list(attempts) for path, attempts in self.attempts.items()},
+            {path: list(successes) for path, successes in self.successes.items()},
+        ))
+
+    def save(self, filename: str) -> None:
+        with open(filename, 'w') as file:
+            json.dump({'attempts': self.attempts, 'successes': self.successes}, file)
+
+    @staticmethod
+    def load(filename: str) -> 'Choices':
+        with open(filename) as file:
+            data = json.load(file)
+        return Choices(data['attempts'], data['successes'])
+
+
+@contextmanager
+def choices(choices_: Optional[Choices] = None) -> Iterator[Choices]:
+    choices_ = choices_ if choices_ is not None else Choices()
+    token = _set(choices=choices_)
+    try:
+        yield choices_
+    finally:
+        _context.reset(token)
+
+
+def run(rule: 'Rule[_Result]', state: tokens.TokenStream, scope: Scope[_Result]) -> Any:
+    context = _context.get()
+    if context.farthest is not None:
+        return _run(rule, state, rule._steps(state, scope))
+    # A rule run on its own reports the farthest failure, as a parser does.
+    farthest = _Farthest()
+    token = _set(farthest=farthest)
+    try:
+        return _run(rule, state, rule._steps(state, scope))
+    except (_Failure, _CutError):
+        raise farthest.error(str(rule), state) from None
+    finally:
+        _context.reset(token)
+
+
+def _ref_key(ref: 'Ref[Any]', state: tokens.TokenStream, scope: Scope[Any]) -> tuple[str, int, int, int]:
+    tokens_ = state.tokens.tokens if isinstance(state.tokens, tokens._Slice) else state.tokens
+    return ref.rule_name, id(scope), id(tokens_), len(state)
+
+
+def _run(rule: 'Rule[Any]', state: tokens.TokenStream, steps: _Steps) -> Any:
+    # Rules yield (rule, state, scope) to call a child rule, or a generator to run a helper.
+    # Leaf rules that only define __call__ are called directly rather than through a generator.
+    profile_ = _context.get().profile
+    stack: MutableSequence[_Steps] = [steps]
+    # The Ref call each frame of the stack runs, if any, so that a Ref re-entered at the
+    # same position and scope, which would grow the stack forever, is reported instead.
+    refs: MutableSequence[Optional[tuple[str, int, int, int]]] = [None]
+    active_refs: set[tuple[str, int, int, int]] = set()
+    if profile_ is not None:
+        profile_.enter(rule, state)
+    result: Any = None
+    error: Optional[errors.Error] = None
+    try:
+        while stack:
+            thrown = error
+            try:
+                if thrown is None:
+                    call = stack[-1].send(result)
+                else:
+                    call = stack[-1].throw(thrown)
+            except StopIteration as stop:
+                if profile_ is not None:
+                    if thrown is not None:
+                        profile_.backtrack()
+                    profile_.exit(stop.value, None)
+                stack.pop()
+                ref = refs.pop()
+                if ref is not None:
+                    active_refs.discard(ref)
+                result, error = stop.value, None
+                continue
+            except errors.Error as stop_error:
+                if profile_ is not None:
+                    profile_.exit(None, stop_error)
+                stack.pop()
+                ref = refs.pop()
+                if ref is not None:
+                    active_refs.discard(ref)
+                result, error = None, stop_error
+                continue
+            result, error = None, None
+            if isinstance(call, tuple):
+                child, child_state, child_scope = call
+                if profile_ is not None:
+                    if thrown is not None:
+                        profile_.backtrack()
+                    profile_.enter(child, child_state)
+                if type(child).__module__ != __name__:
+                    _reach_end()
+                if type(child)._steps is Rule._steps:
+                    try:
+                        result = child(child_state, child_scope)
+                    except errors.Error as leaf_error:
+                        _expect_error(leaf_error)
+                        error = leaf_error
+                    if profile_ is not None:
+                        profile_.exit(result, error)
+                else:
+                    ref = None
+                    if isinstance(child, Ref):
+                        ref = _ref_key(child, child_state, child_scope)
+                        if ref in active_refs:
+                            raise RuleError(rule=child, state=child_state,
+                                            msg=f'left recursion in rule {child.rule_name}')
+                        active_refs.add(ref)
+                    stack.append(child._steps(child_state, child_scope))
+                    refs.append(ref)
+            else:
+                stack.append(call)
+                refs.append(None)
+                if profile_ is not None:
+                    if thrown is not None:
+                        profile_.backtrack()
+                    profile_.enter_helper()
+    finally:
+        while stack:
+            stack.pop().close()
+    if error is not None:
+        raise error
+    return result
 
 
 class Rule(Generic[_Result], ABC):
@@ -77,6 +629,27 @@ class Rule(Generic[_Result], ABC):
     def lexer_(self) -> lexer.Lexer:
         ...
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return First(unknown=True)
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        follows.unknown = True
+
+    def _subrules(self, scope: Scope[_Result]) -> Sequence[tuple['Rule[Any]', Scope[Any]]]:
+        return []
+
+    def _rebuild(self, rebuild: _Rebuild) -> 'Rule[_Result]':
+        return self
+
+    @abstractmethod
+    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> Any:
+        ...
+
+    # Leaf rules override __call__, and rules that call other rules override _steps.
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return self(state, scope)
+        yield
+
     @abstractmethod
     def single(self) -> 'SingleResultRule[_Result]':
         ...
@@ -98,15 +671,28 @@ class _UnaryRule(Generic[_Result, _ChildRuleType], Rule[_Result]):
     child: _ChildRuleType
 
     def __str__(self) -> str:
-        return f"{self.__class__.__qualname__}({','.join([f'{f.name}={getattr(self,f.name)}' for f in fields(self)])})"
+        return f"{self.__class__.__qualname__}({','.join([f'{f.name}={getattr(self,f.name)}' for f in fields(self) if f.repr])})"
 
-    @property
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         return self.child.lexer_
 
+    def _child_scope(self, scope: Scope[_Result]) -> Scope[Any]:
+        return scope
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self.child.first(self._child_scope(scope), refs)
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        self.child.follow(self._child_scope(scope), after, follows)
+
+    def _subrules(self, scope: Scope[_Result]) -> Sequence[tuple['Rule[Any]', Scope[Any]]]:
+        return [(self.child, self._child_scope(scope))]
+
+    def _rebuild(self, rebuild: _Rebuild) -> Rule[_Result]:
+        child = rebuild(self.child)
+        return self if child is self.child else replace(self, child=child)
 
-_AdapterResult = TypeVar('_AdapterResult')
-_AdapterConvertResult = TypeVar('_AdapterConvertResult')
 
 _AndArgs = Union[
     'NoResultRule[_Result]',
@@ -126,9 +712,8 @@ _RandArgs = Union[
 
 
 class NoResultRule(Rule[_Result]):
-    @abstractmethod
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> tokens.TokenStream:
-        ...
+        return run(self, state, scope)
 
     @overload
     def __and__(self, rhs: 'NoResultRule[_Result]') -> 'NoResultAnd[_Result]':
@@ -201,52 +786,21 @@ class NoResultRule(Rule[_Result]):
             msg=f'unable to convert NoResultRule {self} to SingleResultRule')
 
     def optional(self) -> 'OptionalResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, 'NoResultRule[_AdapterResult]'], OptionalResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndOptionalResult[_AdapterResult]:
-                return self.child(state, scope), None
-
-        return Adapter[_Result](self)
+        return _NoResultOptional(self)
 
     def multiple(self) -> 'MultipleResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, NoResultRule[_AdapterResult]], MultipleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndMultipleResult[_AdapterResult]:
-                return self.child(state, scope), []
-        return Adapter[_Result](self)
+        return _NoResultMultiple(self)
 
     def with_lexer(self, lexer_: lexer.Lexer) -> 'NoResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, NoResultRule[_AdapterResult]], NoResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> tokens.TokenStream:
-                return self.child(state, scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return super().lexer_ | lexer_
-
-        return Adapter(self)
+        return _NoResultWithLexer(self, lexer_)
 
     def with_scope(self, scope: Scope[_Result]) -> 'NoResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, NoResultRule[_AdapterResult]], NoResultRule[_AdapterResult]):
-            scope: Scope[_AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> tokens.TokenStream:
-                return self.child(state, scope | self.scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                lexer_ = super().lexer_
-                for rule in self.scope.rules.values():
-                    lexer_ |= rule.lexer_
-                return lexer_
-
-        return Adapter[_Result](self, scope)
+        return _NoResultWithScope(self, scope)
 
 
 class SingleResultRule(Rule[_Result]):
-    @abstractmethod
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndSingleResult[_Result]:
-        ...
+        return run(self, state, scope)
 
     @overload
     def __and__(self, rhs: 'NoResultRule[_Result]') -> 'SingleResultAnd[_Result]':
@@ -321,73 +875,22 @@ class SingleResultRule(Rule[_Result]):
         return self
 
     def optional(self) -> 'OptionalResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, SingleResultRule[_AdapterResult]], OptionalResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndOptionalResult[_AdapterResult]:
-                return self.child(state, scope)
-        return Adapter[_Result](self)
+        return _SingleOptional(self)
 
     def multiple(self) -> 'MultipleResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, SingleResultRule[_AdapterResult]], MultipleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndMultipleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                return state, [result]
-        return Adapter[_Result](self)
+        return _SingleMultiple(self)
 
     def convert(self, func: Callable[[_Result], _Result]) -> 'SingleResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, SingleResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            func: Callable[[_AdapterResult], _AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                return state, self.func(result)
-
-        return Adapter[_Result](self, func)
+        return _SingleConvert(self, func)
 
     def convert_type(self, func: Callable[[_Result], _ConvertResult]) -> 'SingleResultRule[_ConvertResult]':
-        @dataclass(frozen=True)
-        class Adapter(
-            Generic[_AdapterResult, _AdapterConvertResult],
-            _UnaryRule[_AdapterConvertResult,
-                       SingleResultRule[_AdapterResult]],
-            SingleResultRule[_AdapterConvertResult],
-        ):
-            func: Callable[[_AdapterResult], _AdapterConvertResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterConvertResult]) -> StateAndSingleResult[_AdapterConvertResult]:
-                state, result = self.child(state, Scope[_AdapterResult]())
-                return state, self.func(result)
-
-        return Adapter[_Result, _ConvertResult](self, func)
+        return _SingleConvertType(self, func)
 
     def with_lexer(self, lexer_: lexer.Lexer) -> 'SingleResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, SingleResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                return self.child(state, scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return super().lexer_ | lexer_
-
-        return Adapter(self)
+        return _SingleWithLexer(self, lexer_)
 
     def with_scope(self, scope: Scope[_Result]) -> 'SingleResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, SingleResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            scope: Scope[_AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                return self.child(state, scope | self.scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                lexer_ = super().lexer_
-                for rule in self.scope.rules.values():
-                    lexer_ |= rule.lexer_
-                return lexer_
-
-        return Adapter[_Result](self, scope)
+        return _SingleWithScope(self, scope)
 
     def zero_or_more(self) -> 'ZeroOrMore[_Result]':
         return ZeroOrMore[_Result](self)
@@ -413,11 +916,21 @@ class SingleResultRule(Rule[_Result]):
             scope = Scope[_Result]()
         return self(input, scope)
 
+    def stream(self, input: str | tokens.TokenStream, scope: Optional[Scope[_Result]] = None) -> Iterator[_Result]:
+        # Only parsing is streamed: a str input is lexed in full before the first result,
+        # and the whole token list stays referenced until the stream is done.
+        if isinstance(input, str):
+            input = self.lexer_(input)
+        if scope is None:
+            scope = Scope[_Result]()
+        while input:
+            input, result = self(input, scope)
+            yield result
+
 
 class OptionalResultRule(Rule[_Result]):
-    @abstractmethod
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndOptionalResult[_Result]:
-        ...
+        return run(self, state, scope)
 
     @overload
     def __and__(self, rhs: 'NoResultRule[_Result]') -> 'OptionalResultAnd[_Result]':
@@ -486,103 +999,33 @@ class OptionalResultRule(Rule[_Result]):
             raise TypeError(type(lhs))
 
     def single(self) -> SingleResultRule[_Result]:
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                if result is None:
-                    raise RuleError(rule=self, state=state,
-                                    msg=f'failed to get result from {self.child}')
-                else:
-                    return state, result
-        return Adapter[_Result](self)
+        return _OptionalSingle(self)
 
     def single_or(self, default: _Result) -> SingleResultRule[_Result]:
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            default: _AdapterResult
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                if result is None:
-                    return state, self.default
-                else:
-                    return state, result
-
-        return Adapter[_Result](self, default)
+        return _OptionalSingleOr(self, default)
 
     def optional(self) -> 'OptionalResultRule[_Result]':
         return self
 
     def multiple(self) -> 'MultipleResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], MultipleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndMultipleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                if result is None:
-                    return state, []
-                else:
-                    return state, [result]
-        return Adapter[_Result](self)
+        return _OptionalMultiple(self)
 
     def convert(self, func: Callable[[Optional[_Result]], _Result]) -> 'SingleResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            func: Callable[[Optional[_AdapterResult]], _AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                return state, self.func(result)
-
-        return Adapter[_Result](self, func)
+        return _OptionalConvert(self, func)
 
     def convert_type(self, func: Callable[[Optional[_Result]], _ConvertResult]) -> 'SingleResultRule[_ConvertResult]':
-        @dataclass(frozen=True)
-        class Adapter(
-            Generic[_AdapterResult, _AdapterConvertResult],
-            _UnaryRule[_AdapterConvertResult,
-                       OptionalResultRule[_AdapterResult]],
-            SingleResultRule[_AdapterConvertResult],
-        ):
-            func: Callable[[Optional[_AdapterResult]], _AdapterConvertResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterConvertResult]) -> StateAndSingleResult[_AdapterConvertResult]:
-                state, result = self.child(state, Scope[_AdapterResult]())
-                return state, self.func(result)
-
-        return Adapter[_Result, _ConvertResult](self, func)
+        return _OptionalConvertType(self, func)
 
     def with_lexer(self, lexer_: lexer.Lexer) -> 'OptionalResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], OptionalResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndOptionalResult[_AdapterResult]:
-                return self.child(state, scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return super().lexer_ | lexer_
-
-        return Adapter(self)
+        return _OptionalWithLexer(self, lexer_)
 
     def with_scope(self, scope: Scope[_Result]) -> 'OptionalResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, OptionalResultRule[_AdapterResult]], OptionalResultRule[_AdapterResult]):
-            scope: Scope[_AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndOptionalResult[_AdapterResult]:
-                return self.child(state, scope | self.scope)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                lexer_ = super().lexer_
-                for rule in self.scope.rules.values():
-                    lexer_ |= rule.lexer_
-                return lexer_
-
-        return Adapter[_Result](self, scope)
+        return _OptionalWithScope(self, scope)
 
 
 class MultipleResultRule(Rule[_Result]):
-    @abstractmethod
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndMultipleResult[_Result]:
-        ...
+        return run(self, state, scope)
 
     @overload
     def __and__(self, rhs: 'NoResultRule[_Result]') -> 'MultipleResultAnd[_Result]':
@@ -649,84 +1092,328 @@ class MultipleResultRule(Rule[_Result]):
             raise TypeError(type(lhs))
 
     def single(self) -> SingleResultRule[_Result]:
-        class Adapter(_UnaryRule[_AdapterResult, MultipleResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, results = self.child(state, scope)
-                if len(results) != 1:
-                    raise RuleError(
-                        rule=self, state=state, msg=f'expected 1 result from {self.child} got {len(results)}')
-                return state, results[0]
-        return Adapter[_Result](self)
+        return _MultipleSingle(self)
 
     def optional(self) -> OptionalResultRule[_Result]:
-        class Adapter(_UnaryRule[_AdapterResult, MultipleResultRule[_AdapterResult]], OptionalResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndOptionalResult[_AdapterResult]:
-                state, results = self.child(state, scope)
-                if len(results) == 0:
-                    return state, None
-                elif len(results) == 1:
-                    return state, results[0]
-                else:
-                    raise RuleError(
-                        rule=self, state=state, msg=f'expected 0 or 1 results from {self.child} got {len(results)}')
-        return Adapter[_Result](self)
+        return _MultipleOptional(self)
 
     def multiple(self) -> 'MultipleResultRule[_Result]':
         return self
 
     def convert(self, func: Callable[[Sequence[_Result]], _Result]) -> 'SingleResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, MultipleResultRule[_AdapterResult]], SingleResultRule[_AdapterResult]):
-            func: Callable[[Sequence[_AdapterResult]], _AdapterResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndSingleResult[_AdapterResult]:
-                state, result = self.child(state, scope)
-                return state, self.func(result)
-
-        return Adapter[_Result](self, func)
+        return _MultipleConvert(self, func)
 
     def convert_type(self, func: Callable[[Sequence[_Result]], _ConvertResult]) -> 'SingleResultRule[_ConvertResult]':
-        @dataclass(frozen=True)
-        class Adapter(
-            Generic[_AdapterResult, _AdapterConvertResult],
-            _UnaryRule[_AdapterConvertResult,
-                       MultipleResultRule[_AdapterResult]],
-            SingleResultRule[_AdapterConvertResult],
-        ):
-            func: Callable[[Sequence[_AdapterResult]], _AdapterConvertResult]
-
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterConvertResult]) -> StateAndSingleResult[_AdapterConvertResult]:
-                state, results = self.child(state, Scope[_AdapterResult]())
-                return state, self.func(results)
-        return Adapter[_Result, _ConvertResult](self, func)
+        return _MultipleConvertType(self, func)
 
     def with_lexer(self, lexer_: lexer.Lexer) -> 'MultipleResultRule[_Result]':
-        class Adapter(_UnaryRule[_AdapterResult, MultipleResultRule[_AdapterResult]], MultipleResultRule[_AdapterResult]):
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndMultipleResult[_AdapterResult]:
-                return self.child(state, scope)
+        return _MultipleWithLexer(self, lexer_)
 
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return super().lexer_ | lexer_
+    def with_scope(self, scope: Scope[_Result]) -> 'MultipleResultRule[_Result]':
+        return _MultipleWithScope(self, scope)
 
-        return Adapter(self)
 
-    def with_scope(self, scope: Scope[_Result]) -> 'MultipleResultRule[_Result]':
-        @dataclass(frozen=True)
-        class Adapter(_UnaryRule[_AdapterResult, MultipleResultRule[_AdapterResult]], MultipleResultRule[_AdapterResult]):
-            scope: Scope[_AdapterResult]
+@dataclass(frozen=True)
+class _Adapter(_UnaryRule[_Result, _ChildRuleType]):
+    kind: ClassVar[str]
+    method: ClassVar[str]
+
+
+@dataclass(frozen=True)
+class _WithLexer(_Adapter[_Result, _ChildRuleType]):
+    method = 'with_lexer'
+
+    extra_lexer: lexer.Lexer
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return self.child.lexer_ | self.extra_lexer
+
+
+_max_merged_scopes = 1 << 6
+
+
+@dataclass(frozen=True)
+class _WithScope(_Adapter[_Result, _ChildRuleType]):
+    method = 'with_scope'
+
+    scope: Scope[_Result]
+    # Merged scopes by outer scope, so that the memo, keyed by scope, sees one scope per outer scope.
+    _merged_scopes: MutableMapping[int, tuple[Scope[_Result], Scope[_Result]]] = field(
+        default_factory=dict[int, tuple[Scope[_Result], Scope[_Result]]], init=False, compare=False, repr=False)
+
+    def _child_scope(self, scope: Scope[_Result]) -> Scope[_Result]:
+        entry = self._merged_scopes.get(id(scope))
+        if entry is None or entry[0] is not scope:
+            entry = scope, scope | self.scope
+            self._merged_scopes[id(scope)] = entry
+            while len(self._merged_scopes) > _max_merged_scopes:
+                del self._merged_scopes[next(iter(self._merged_scopes))]
+        return entry[1]
+
+    def _rebuild(self, rebuild: _Rebuild) -> Rule[_Result]:
+        child = rebuild(self.child)
+        rules = {name: rebuild(rule) for name, rule in self.scope.items()}
+        if child is self.child and all(rule is self.scope[name] for name, rule in rules.items()):
+            return self
+        return replace(self, child=child, scope=Scope[_Result](rules))
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        lexer_ = self.child.lexer_
+        for _, rule in self.scope.items():
+            lexer_ |= rule.lexer_
+        return lexer_
+
+
+@dataclass(frozen=True)
+class _NoResultOptional(_Adapter[_Result, NoResultRule[_Result]], OptionalResultRule[_Result]):
+    kind, method = 'NoResultRule', 'optional'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope), None
+
+
+@dataclass(frozen=True)
+class _NoResultMultiple(_Adapter[_Result, NoResultRule[_Result]], MultipleResultRule[_Result]):
+    kind, method = 'NoResultRule', 'multiple'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope), []
+
+
+@dataclass(frozen=True)
+class _NoResultWithLexer(_WithLexer[_Result, NoResultRule[_Result]], NoResultRule[_Result]):
+    kind = 'NoResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope)
+
+
+@dataclass(frozen=True)
+class _NoResultWithScope(_WithScope[_Result, NoResultRule[_Result]], NoResultRule[_Result]):
+    kind = 'NoResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, self._child_scope(scope))
+
+
+@dataclass(frozen=True)
+class _SingleOptional(_Adapter[_Result, SingleResultRule[_Result]], OptionalResultRule[_Result]):
+    kind, method = 'SingleResultRule', 'optional'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope)
+
+
+@dataclass(frozen=True)
+class _SingleMultiple(_Adapter[_Result, SingleResultRule[_Result]], MultipleResultRule[_Result]):
+    kind, method = 'SingleResultRule', 'multiple'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        return state, [result]
+
+
+@dataclass(frozen=True)
+class _SingleConvert(_Adapter[_Result, SingleResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'SingleResultRule', 'convert'
+
+    func: Callable[[_Result], _Result]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        return state, self.func(result)
+
+
+@dataclass(frozen=True)
+class _SingleConvertType(
+    Generic[_Result, _ConvertResult],
+    _Adapter[_ConvertResult, SingleResultRule[_Result]],
+    SingleResultRule[_ConvertResult],
+):
+    kind, method = 'SingleResultRule', 'convert_type'
+
+    func: Callable[[_Result], _ConvertResult]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_ConvertResult]) -> _Steps:
+        state, result = yield self.child, state, Scope[_Result]()
+        return state, self.func(result)
+
+    def _child_scope(self, scope: Scope[_ConvertResult]) -> Scope[Any]:
+        return Scope[_Result]()
+
+
+@dataclass(frozen=True)
+class _SingleWithLexer(_WithLexer[_Result, SingleResultRule[_Result]], SingleResultRule[_Result]):
+    kind = 'SingleResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope)
+
+
+@dataclass(frozen=True)
+class _SingleWithScope(_WithScope[_Result, SingleResultRule[_Result]], SingleResultRule[_Result]):
+    kind = 'SingleResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, self._child_scope(scope))
+
+
+@dataclass(frozen=True)
+class _OptionalSingle(_Adapter[_Result, OptionalResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'OptionalResultRule', 'single'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        if result is None:
+            raise RuleError(rule=self, state=state,
+                            msg=f'failed to get result from {self.child}')
+        else:
+            return state, result
+
+
+@dataclass(frozen=True)
+class _OptionalSingleOr(_Adapter[_Result, OptionalResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'OptionalResultRule', 'single_or'
+
+    default: _Result
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        if result is None:
+            return state, self.default
+        else:
+            return state, result
+
+
+@dataclass(frozen=True)
+class _OptionalMultiple(_Adapter[_Result, OptionalResultRule[_Result]], MultipleResultRule[_Result]):
+    kind, method = 'OptionalResultRule', 'multiple'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        if result is None:
+            return state, []
+        else:
+            return state, [result]
+
+
+@dataclass(frozen=True)
+class _OptionalConvert(_Adapter[_Result, OptionalResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'OptionalResultRule', 'convert'
+
+    func: Callable[[Optional[_Result]], _Result]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        return state, self.func(result)
+
+
+@dataclass(frozen=True)
+class _OptionalConvertType(
+    Generic[_Result, _ConvertResult],
+    _Adapter[_ConvertResult, OptionalResultRule[_Result]],
+    SingleResultRule[_ConvertResult],
+):
+    kind, method = 'OptionalResultRule', 'convert_type'
+
+    func: Callable[[Optional[_Result]], _ConvertResult]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_ConvertResult]) -> _Steps:
+        state, result = yield self.child, state, Scope[_Result]()
+        return state, self.func(result)
+
+    def _child_scope(self, scope: Scope[_ConvertResult]) -> Scope[Any]:
+        return Scope[_Result]()
+
+
+@dataclass(frozen=True)
+class _OptionalWithLexer(_WithLexer[_Result, OptionalResultRule[_Result]], OptionalResultRule[_Result]):
+    kind = 'OptionalResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope)
+
+
+@dataclass(frozen=True)
+class _OptionalWithScope(_WithScope[_Result, OptionalResultRule[_Result]], OptionalResultRule[_Result]):
+    kind = 'OptionalResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, self._child_scope(scope))
+
+
+@dataclass(frozen=True)
+class _MultipleSingle(_Adapter[_Result, MultipleResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'MultipleResultRule', 'single'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, results = yield self.child, state, scope
+        if len(results) != 1:
+            raise RuleError(
+                rule=self, state=state, msg=f'expected 1 result from {self.child} got {len(results)}')
+        return state, results[0]
+
+
+@dataclass(frozen=True)
+class _MultipleOptional(_Adapter[_Result, MultipleResultRule[_Result]], OptionalResultRule[_Result]):
+    kind, method = 'MultipleResultRule', 'optional'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, results = yield self.child, state, scope
+        if len(results) == 0:
+            return state, None
+        elif len(results) == 1:
+            return state, results[0]
+        else:
+            raise RuleError(
+                rule=self, state=state, msg=f'expected 0 or 1 results from {self.child} got {len(results)}')
+
+
+@dataclass(frozen=True)
+class _MultipleConvert(_Adapter[_Result, MultipleResultRule[_Result]], SingleResultRule[_Result]):
+    kind, method = 'MultipleResultRule', 'convert'
+
+    func: Callable[[Sequence[_Result]], _Result]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        state, result = yield self.child, state, scope
+        return state, self.func(result)
+
+
+@dataclass(frozen=True)
+class _MultipleConvertType(
+    Generic[_Result, _ConvertResult],
+    _Adapter[_ConvertResult, MultipleResultRule[_Result]],
+    SingleResultRule[_ConvertResult],
+):
+    kind, method = 'MultipleResultRule', 'convert_type'
 
-            def __call__(self, state: tokens.TokenStream, scope: Scope[_AdapterResult]) -> StateAndMultipleResult[_AdapterResult]:
-                return self.child(state, scope | self.scope)
+    func: Callable[[Sequence[_Result]], _ConvertResult]
 
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                lexer_ = super().lexer_
-                for rule in self.scope.rules.values():
-                    lexer_ |= rule.lexer_
-                return lexer_
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_ConvertResult]) -> _Steps:
+        state, results = yield self.child, state, Scope[_Result]()
+        return state, self.func(results)
 
-        return Adapter[_Result](self, scope)
+    def _child_scope(self, scope: Scope[_ConvertResult]) -> Scope[Any]:
+        return Scope[_Result]()
+
+
+@dataclass(frozen=True)
+class _MultipleWithLexer(_WithLexer[_Result, MultipleResultRule[_Result]], MultipleResultRule[_Result]):
+    kind = 'MultipleResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, scope)
+
+
+@dataclass(frozen=True)
+class _MultipleWithScope(_WithScope[_Result, MultipleResultRule[_Result]], MultipleResultRule[_Result]):
+    kind = 'MultipleResultRule'
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self.child, state, self._child_scope(scope))
 
 
 @dataclass(frozen=True)
@@ -736,19 +1423,48 @@ class Ref(SingleResultRule[_Result]):
     def __str__(self) -> str:
         return self.rule_name
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndSingleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         if self.rule_name not in scope:
             raise KeyError(f'unknown rule {self.rule_name}')
+        context = _context.get()
+        memo, farthest = context.memo, context.farthest
+        if memo is not None:
+            key = self.rule_name, id(scope)
+            memoized = memo.get(key, state, scope, farthest)
+            if memoized is not None:
+                if isinstance(memoized, errors.Error):
+                    raise memoized.with_traceback(None)
+                return memoized
+            reach = memo.start(state, farthest)
         try:
-            return scope[self.rule_name].single()(state, scope)
+            result = yield scope[self.rule_name].single(), state, scope
         except errors.Error as error:
-            raise ParseError(rule_name=self.rule_name,
-                             state=state, children=[error])
-
-    @property
+            if context.debug:
+                error = _parse_error(self.rule_name, state, error)
+            if memo is not None:
+                memo.put(key, state, scope, error, reach, farthest)
+            raise error.with_traceback(None)
+        if memo is not None:
+            memo.put(key, state, scope, result, reach, farthest)
+        return result
+
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         return lexer.Lexer()
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        if self.rule_name not in scope or self.rule_name in refs:
+            return First(unknown=True)
+        return scope[self.rule_name].first(scope, refs | {self.rule_name})
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        follows.rule(self.rule_name, scope, after)
+
+    def _subrules(self, scope: Scope[_Result]) -> Sequence[tuple['Rule[Any]', Scope[Any]]]:
+        if self.rule_name not in scope:
+            return []
+        return [(scope[self.rule_name], scope)]
+
 
 @dataclass(frozen=True)
 class AbstractLiteral(SingleResultRule[_Result]):
@@ -762,15 +1478,20 @@ class AbstractLiteral(SingleResultRule[_Result]):
         ...
 
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndSingleResult[_Result]:
-        if state.head().rule_name != self.lex_rule.name:
-            raise RuleError(
-                rule=self, state=state, msg=f'expected {self.lex_rule.name} got {state.head().rule_name}')
-        return state.tail(), self.result(state.head())
+        if not state or state.tokens[0].rule_id != self.lex_rule.id:
+            raise _expected_error(self, state, self.lex_rule)
+        return state.tail(), self.result(state.tokens[0])
 
-    @property
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         return lexer.Lexer([self.lex_rule])
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return First(frozenset({self.lex_rule.id}))
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        follows.token(self.lex_rule.id, after)
+
 
 @dataclass(frozen=True)
 class Literal(AbstractLiteral[_Result]):
@@ -785,38 +1506,52 @@ class ZeroOrMore(_UnaryRule[_Result, SingleResultRule[_Result]], MultipleResultR
     def __str__(self) -> str:
         return f'{self.child}*'
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndMultipleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         results: MutableSequence[_Result] = []
         while True:
             try:
-                state, result = self.child(state, scope)
-                results.append(result)
+                child_state, result = yield self.child, state, scope
             except errors.Error:
                 return state, results
+            if len(child_state) == len(state):
+                return state, results
+            state = child_state
+            results.append(result)
 
-    @property
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         return self.child.lexer_
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self.child.first(scope, refs).optional()
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        self.child.follow(scope, self.child.first(scope).optional() & after, follows)
+
 
 @dataclass(frozen=True)
 class OneOrMore(_UnaryRule[_Result, SingleResultRule[_Result]], MultipleResultRule[_Result]):
     def __str__(self) -> str:
         return f'{self.child}+'
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndMultipleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         try:
-            state, result = self.child(state, scope)
+            state, result = yield self.child, state, scope
             results: MutableSequence[_Result] = [result]
         except errors.Error as error:
-            raise RuleError(
-                rule=self, state=state, children=[error])
+            raise _rule_error(self, state, error)
         while True:
             try:
-                state, result = self.child(state, scope)
-                results.append(result)
+                child_state, result = yield self.child, state, scope
             except errors.Error:
                 return state, results
+            if len(child_state) == len(state):
+                return state, results
+            state = child_state
+            results.append(result)
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        self.child.follow(scope, self.child.first(scope).optional() & after, follows)
 
 
 @dataclass(frozen=True)
@@ -824,28 +1559,43 @@ class ZeroOrOne(_UnaryRule[_Result, SingleResultRule[_Result]], OptionalResultRu
     def __str__(self) -> str:
         return f'{self.child}?'
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndOptionalResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         try:
-            return self.child(state, scope)
+            return (yield self.child, state, scope)
         except errors.Error:
             return state, None
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self.child.first(scope, refs).optional()
+
 
 class _AbstractUntilState(_UnaryRule[_Result, SingleResultRule[_Result]], MultipleResultRule[_Result]):
     @abstractmethod
     def _is_state_finished(self, state: tokens.TokenStream) -> bool:
         ...
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndMultipleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         results: MutableSequence[_Result] = []
         while not self._is_state_finished(state):
             try:
-                state, result = self.child(state, scope)
-                results.append(result)
+                child_state, result = yield self.child, state, scope
             except errors.Error as error:
-                raise RuleError(rule=self, state=state, children=[error])
+                raise _rule_error(self, state, error)
+            if len(child_state) == len(state):
+                raise self._no_progress_error(state)
+            state = child_state
+            results.append(result)
         return state, results
 
+    def _no_progress_error(self, state: tokens.TokenStream) -> errors.Error:
+        return RuleError(rule=self, state=state, msg=f'{self} made no progress')
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self.child.first(scope, refs).optional()
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        self.child.follow(scope, self.child.first(scope).optional() & after, follows)
+
 
 @dataclass(frozen=True)
 class UntilToken(_AbstractUntilState[_Result]):
@@ -855,7 +1605,12 @@ class UntilToken(_AbstractUntilState[_Result]):
         return f'({self.child}!{self.lex_rule})'
 
     def _is_state_finished(self, state: tokens.TokenStream) -> bool:
-        return state.head().rule_name == self.lex_rule.name
+        if not state:
+            raise _expected_error(self, state, self.lex_rule)
+        return state.tokens[0].rule_id == self.lex_rule.id
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        super().follow(scope, First(frozenset({self.lex_rule.id})) | after, follows)
 
 
 @dataclass(frozen=True)
@@ -867,14 +1622,225 @@ class UntilEmpty(_AbstractUntilState[_Result]):
         return len(state) == 0
 
 
+@dataclass(frozen=True)
+class Analysis:
+    nullable: frozenset[str] = frozenset()
+    left_recursive: frozenset[str] = frozenset()
+    unreachable: frozenset[str] = frozenset()
+    unresolved: frozenset[str] = frozenset()
+    nullable_loops: Sequence[str] = field(default_factory=list[str])
+
+    @property
+    def ok(self) -> bool:
+        return not (self.left_recursive or self.unresolved or self.nullable_loops)
+
+    def report(self) -> str:
+        lines: MutableSequence[str] = []
+        for label, names in list[tuple[str, Iterable[str]]]([
+            ('left recursive', sorted(self.left_recursive)),
+            ('unresolved', sorted(self.unresolved)),
+            ('nullable loops', self.nullable_loops),
+            ('unreachable', sorted(self.unreachable)),
+            ('nullable', sorted(self.nullable)),
+        ]):
+            names = list(names)
+            if names:
+                lines.append(f"{label}: {', '.join(names)}")
+        return '\n'.join(lines)
+
+
+def _left_refs(rule: 'Rule[Any]', scope: Scope[Any]) -> Sequence[tuple[str, Scope[Any]]]:
+    refs: MutableSequence[tuple[str, Scope[Any]]] = []
+    rules: MutableSequence[tuple[Rule[Any], Scope[Any]]] = [(rule, scope)]
+    visited: set[tuple[int, tuple[tuple[str, int], ...]]] = set()
+    while rules:
+        rule, scope = rules.pop()
+        key = id(rule), _scope_key(scope)
+        if key in visited:
+            continue
+        visited.add(key)
+        if isinstance(rule, Ref):
+            if rule.rule_name in scope:
+                refs.append((rule.rule_name, scope))
+        elif isinstance(rule, _AbstractAnd):
+            for child in rule.children:
+                rules.append((child, scope))
+                if not child.first(scope).nullable:
+                    break
+        else:
+            rules.extend(rule._subrules(scope))
+    return refs
+
+
+def _walk(scope: Scope[Any]) -> Iterator[tuple['Rule[Any]', Scope[Any]]]:
+    visited: set[tuple[int, tuple[tuple[str, int], ...]]] = set()
+    rules: MutableSequence[tuple[Rule[Any], Scope[Any]]] = [
+        (rule, scope) for _, rule in scope.items()]
+    while rules:
+        rule, scope = rules.pop()
+        key = id(rule), _scope_key(scope)
+        if key in visited:
+            continue
+        visited.add(key)
+        yield rule, scope
+        rules.extend(rule._subrules(scope))
+
+
+def _factor(original: 'Rule[Any]', rule: 'Rule[Any]', path: str) -> 'Rule[Any]':
+    return rule._factored() if isinstance(rule, Or) else rule
+
+
+@dataclass
+class _Rebuilder:
+    # Copies rules bottom up, passing each original rule, its copy with rebuilt
+    # children and its path to transform. Shared rules are copied once.
+    transform: Callable[['Rule[Any]', 'Rule[Any]', str], 'Rule[Any]']
+    rules: MutableMapping[int, 'Rule[Any]'] = field(
+        default_factory=dict[int, 'Rule[Any]'])
+
+    def rule(self, rule: 'Rule[Any]', path: str) -> Any:
+        rebuilt = self.rules.get(id(rule))
+        if rebuilt is None:
+            index = count()
+            rebuilt = self.rules[id(rule)] = self.transform(
+                rule, rule._rebuild(lambda child: self.rule(child, f'{path}.{next(index)}')), path)
+        return rebuilt
+
+    def scope(self, scope: Scope[Any]) -> Scope[Any]:
+        return Scope[Any]({name: self.rule(rule, name) for name, rule in scope.items()})
+
+
 @dataclass(frozen=True)
 class Parser(Generic[_Result], SingleResultRule[_Result], Mapping[str, SingleResultRule[_Result]]):
     root_rule_name: str
     scope: Scope[_Result]
+    packrat: bool = field(default=False, kw_only=True)
+    memo_size: int = field(default=1 << 16, kw_only=True)
+    contextual: bool = field(default=False, kw_only=True)
+    choices: Optional[Choices] = field(
+        default=None, kw_only=True, compare=False, repr=False)
+    _merged_scope: Optional[tuple[Scope[_Result], Scope[_Result]]] = field(
+        default=None, init=False, compare=False, repr=False)
 
     def __str__(self) -> str:
         return f'Parser(root={self.root_rule_name},scope={self.scope})'
 
+    def with_packrat(self, memo_size: Optional[int] = None) -> 'Parser[_Result]':
+        return replace(self, packrat=True, memo_size=memo_size or self.memo_size)
+
+    def with_contextual(self) -> 'Parser[_Result]':
+        return replace(self, contextual=True)
+
+    def incremental(self, state: tokens.TokenStream | str) -> 'Incremental[_Result]':
+        if isinstance(state, str):
+            state = self._lex(state)
+        return Incremental[_Result]._parse(self, state, _Memo(self.memo_size, retain=True))
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self._first
+
+    @cached_property
+    def _first(self) -> First:
+        return self.scope[self.root_rule_name].first(self.scope, frozenset({self.root_rule_name}))
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        follows.rule(self.root_rule_name, self._scope(scope), after)
+
+    def _scope(self, scope: Optional[Scope[_Result]]) -> Scope[_Result]:
+        if not scope:
+            return self._compiled
+        if self._merged_scope is not None and self._merged_scope[0] is scope:
+            return self._merged_scope[1]
+        merged_scope = scope | self._compiled
+        object.__setattr__(self, '_merged_scope', (scope, merged_scope))
+        return merged_scope
+
+    @cached_property
+    def _compiled(self) -> Scope[_Result]:
+        # The parser factors and dispatches its own copy of the rules, leaving rules
+        # shared with other parsers unchanged.
+        left_recursive = self.analyze().left_recursive
+        if left_recursive:
+            raise errors.Error(
+                msg=f"left recursive rules {', '.join(sorted(left_recursive))} in {self}")
+        factored = _Rebuilder(_factor).scope(self.scope)
+        firsts: MutableMapping[int, MutableSequence[Sequence[First]]] = {}
+        for rule, scope in _walk(factored):
+            if isinstance(rule, Or):
+                rule_firsts = [child.first(scope) for child in rule.children]
+                scope_firsts = firsts.setdefault(id(rule), [])
+                if rule_firsts not in scope_firsts:
+                    scope_firsts.append(rule_firsts)
+
+        def dispatch(factored_rule: Rule[Any], rule: Rule[Any], path: str) -> Rule[Any]:
+            if not isinstance(rule, Or):
+                return rule
+            rule_firsts = firsts.get(id(factored_rule), [])
+            rule_dispatch = _Dispatch.load(rule_firsts, len(rule.children))
+            if rule_dispatch is not None and rule_dispatch.indices:
+                return replace(rule, dispatch=rule_dispatch)
+            rule = replace(rule, dispatch=rule_dispatch, firsts=rule_firsts, path=path)
+            rates = self.choices.rates(path) if self.choices is not None else None
+            if rates is not None and len(rates) == len(rule.children):
+                rule = rule._reorder(rates)
+            return rule
+
+        return _Rebuilder(dispatch).scope(factored)
+
+    def analyze(self) -> Analysis:
+        referenced = {self.root_rule_name}
+        unresolved: set[str] = set()
+        nullable_loops: MutableSequence[str] = []
+        refs: MutableSequence[tuple[str, Scope[Any]]] = [
+            (self.root_rule_name, self.scope)]
+        visited: set[tuple[int, tuple[tuple[str, int], ...]]] = set()
+        # Visit the root first so that only rules it reaches count as referenced.
+        for rule_name in [self.root_rule_name, *self.scope]:
+            rules: MutableSequence[tuple[Rule[Any], Scope[Any]]] = [
+                (self.scope[rule_name], self.scope)]
+            while rules:
+                rule, scope = rules.pop()
+                key = id(rule), _scope_key(scope)
+                if key in visited:
+                    continue
+                visited.add(key)
+                if isinstance(rule, Ref):
+                    if rule.rule_name in scope:
+                        if rule_name == self.root_rule_name:
+                            referenced.add(rule.rule_name)
+                        refs.append((rule.rule_name, scope))
+                    else:
+                        unresolved.add(rule.rule_name)
+                elif isinstance(rule, (ZeroOrMore, OneOrMore, _AbstractUntilState)) and rule.child.first(scope).nullable:
+                    nullable_loops.append(str(rule))
+                rules.extend(rule._subrules(scope))
+        graph: MutableMapping[tuple[str, tuple[tuple[str, int], ...]], Sequence[tuple[str, tuple[tuple[str, int], ...]]]] = {}
+        for rule_name, scope in refs:
+            key_ = rule_name, _scope_key(scope)
+            if key_ not in graph:
+                graph[key_] = [(ref_name, _scope_key(ref_scope))
+                               for ref_name, ref_scope in _left_refs(scope[rule_name], scope)]
+        left_recursive: set[str] = set()
+        for start in graph:
+            nodes = list(graph[start])
+            seen: set[tuple[str, tuple[tuple[str, int], ...]]] = set()
+            while nodes:
+                node = nodes.pop()
+                if node == start:
+                    left_recursive.add(start[0])
+                    break
+                if node not in seen:
+                    seen.add(node)
+                    nodes.extend(graph.get(node, []))
+        return Analysis(
+            nullable=frozenset(rule_name for rule_name, rule in self.scope.items()
+                               if rule.first(self.scope, frozenset({rule_name})).nullable),
+            left_recursive=frozenset(left_recursive),
+            unreachable=frozenset(set(self.scope) - referenced),
+            unresolved=frozenset(unresolved),
+            nullable_loops=nullable_loops,
+        )
+
     def __len__(self) -> int:
         return len(self.scope)
 
@@ -884,6 +1850,32 @@ class Parser(Generic[_Result], SingleResultRule[_Result], Mapping[str, SingleRes
     def __getitem__(self, name: str) -> SingleResultRule[_Result]:
         return self.scope[name]
 
+    def _parse(self, state: tokens.TokenStream, scope: Optional[Scope[_Result]], rule_name: str) -> _Steps:
+        # Compiling checks the grammar, and its errors aren't parse failures.
+        rule = self._compiled[rule_name].single()
+        context = _context.get()
+        token = None
+        if context.farthest is None or context.prefixes is None or (self.packrat and context.memo is None):
+            token = _context.set(replace(
+                context,
+                memo=_Memo(self.memo_size) if self.packrat and context.memo is None else context.memo,
+                farthest=context.farthest or _Farthest(),
+                prefixes=context.prefixes if context.prefixes is not None else {},
+            ))
+        farthest = context.farthest or _context.get().farthest
+        try:
+            return (yield rule, state, self._scope(scope))
+        except errors.Error as error:
+            if context.debug:
+                raise _parse_error(rule_name, state, error, context.farthest is not None)
+            if context.farthest is None:
+                assert farthest is not None
+                raise farthest.error(rule_name, state) from None
+            raise
+        finally:
+            if token is not None:
+                _context.reset(token)
+
     def __call__(
             self,
             state: tokens.TokenStream | str,
@@ -891,22 +1883,119 @@ class Parser(Generic[_Result], SingleResultRule[_Result], Mapping[str, SingleRes
             rule_name: Optional[str] = None,
     ) -> StateAndSingleResult[_Result]:
         if isinstance(state, str):
-            state = self.lexer_(state)
-        scope = (scope or Scope[_Result]()) | self.scope
-        rule_name = rule_name or self.root_rule_name
-        try:
-            return self.scope[rule_name].single()(state, scope)
-        except errors.Error as error:
-            raise ParseError(rule_name=rule_name,
-                             state=state, children=[error])
+            state = self._lex(state)
+        return _run(self, state, self._parse(state, scope, rule_name or self.root_rule_name))
 
-    @property
+    def _steps(self, state: tokens.TokenStream, scope: Optional[Scope[_Result]]) -> _Steps:
+        return self._parse(state, scope, self.root_rule_name)
+
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         lexer_ = lexer.Lexer()
-        for _, rule in self.scope.rules.items():
+        for _, rule in self.scope.items():
             lexer_ |= rule.lexer_
         return lexer_
 
+    @cached_property
+    def contextual_lexer(self) -> lexer.ContextualLexer:
+        follows = Follows.load(self, Scope[_Result]())
+        if follows.unknown:
+            return lexer.ContextualLexer(self.lexer_)
+        return lexer.ContextualLexer(
+            self.lexer_,
+            None if self._first.unknown else self._first.rule_ids,
+            {rule_id: None if after.unknown else after.rule_ids
+             for rule_id, after in follows.tokens.items()},
+        )
+
+    def _lex(self, state: str) -> tokens.TokenStream:
+        if self.contextual:
+            return self.contextual_lexer(state)
+        return self.lexer_(state)
+
+
+def _moved_suffix(old: Sequence[tokens.Token], new: Sequence[tokens.Token], limit: int) -> int:
+    # The number of trailing tokens that an edit only moved: all of them by the same number
+    # of lines, and those on the line where the edit ends by the same number of columns too.
+    suffix = 0
+    line_delta: Optional[int] = None
+    col_line: Optional[int] = None
+    col_delta = 0
+    prev_line: Optional[int] = None
+    while suffix < limit:
+        old_token, new_token = old[-1 - suffix], new[-1 - suffix]
+        if old_token.rule_id != new_token.rule_id or old_token.val != new_token.val:
+            break
+        old_position, new_position = old_token.position, new_token.position
+        if line_delta is None:
+            line_delta = new_position.line - old_position.line
+        elif new_position.line - old_position.line != line_delta:
+            break
+        if col_line is not None:
+            if old_position.line != col_line or new_position.col - old_position.col != col_delta:
+                break
+        elif new_position.col != old_position.col:
+            if old_position.line == prev_line:
+                break
+            col_line, col_delta = old_position.line, new_position.col - old_position.col
+        prev_line = old_position.line
+        suffix += 1
+    return suffix
+
+
+@dataclass(frozen=True)
+class Incremental(Generic[_Result]):
+    parser: Parser[_Result]
+    state: tokens.TokenStream
+    result: StateAndSingleResult[_Result]
+    _memo: _Memo = field(compare=False, repr=False)
+
+    @staticmethod
+    def _parse(parser_: Parser[_Result], state: tokens.TokenStream, memo: _Memo) -> 'Incremental[_Result]':
+        token = _set(memo=memo)
+        try:
+            result = parser_(state)
+        finally:
+            _context.reset(token)
+        return Incremental[_Result](parser_, state, result, memo)
+
+    def edit(self, state: tokens.TokenStream | str) -> 'Incremental[_Result]':
+        if isinstance(state, str):
+            state = self.parser._lex(state)
+        old, new = self.state.tokens, state.tokens
+        prefix = 0
+        while prefix < min(len(old), len(new)) and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = _moved_suffix(old, new, min(len(old), len(new)) - prefix)
+        # Tokens before the edit keep their identity and the moved ones after it take their
+        # new positions. Reused results are kept as they are, so a result that holds on to
+        # a token after the edit still has its old position.
+        tokens_ = [*old[:prefix], *new[prefix:]]
+        memo = _Memo(self._memo.max_size, retain=True)
+        for size, bucket in self._memo.entries.items():
+            for key, (scope, head, result, reach) in bucket.items():
+                if isinstance(result, errors.Error):
+                    continue
+                start = len(old) - size
+                if start >= len(old) - suffix:
+                    shift = 0
+                elif len(old) - reach + 1 < prefix:
+                    shift = len(tokens_) - len(old)
+                else:
+                    continue
+                rest, result_ = result
+                memo._store(size + shift, key, (
+                    scope,
+                    tokens_[len(tokens_) - size - shift] if head is not None else None,
+                    (tokens.TokenStream(
+                        tokens_[len(tokens_) - len(rest) - shift:]), result_),
+                    reach + shift,
+                ))
+        try:
+            return Incremental[_Result]._parse(self.parser, tokens.TokenStream(tokens_), memo)
+        except errors.Error:
+            return self.parser.incremental(state)
+
 
 @dataclass(frozen=True)
 class LexRule(NoResultRule[_Result]):
@@ -916,16 +2005,20 @@ class LexRule(NoResultRule[_Result]):
         return str(self.lex_rule)
 
     def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> tokens.TokenStream:
-        try:
-            state, _ = state.pop(self.lex_rule.name)
-            return state
-        except errors.Error as error:
-            raise RuleError(rule=self, state=state, children=[error])
+        if not state or state.tokens[0].rule_id != self.lex_rule.id:
+            raise _expected_error(self, state, self.lex_rule)
+        return state.tail()
 
-    @property
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         return lexer.Lexer([self.lex_rule])
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return First(frozenset({self.lex_rule.id}))
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        follows.token(self.lex_rule.id, after)
+
     @classmethod
     def load(cls, val: str | lexer.Rule) -> 'LexRule[_Result]':
         if isinstance(val, str):
@@ -933,6 +2026,28 @@ class LexRule(NoResultRule[_Result]):
         return LexRule[_Result](val)
 
 
+@dataclass(frozen=True)
+class Cut(NoResultRule[_Result]):
+    def __str__(self) -> str:
+        return '~'
+
+    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> tokens.TokenStream:
+        memo = _context.get().memo
+        if memo is not None:
+            memo.release(state)
+        return state
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer()
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return First(nullable=True)
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        pass
+
+
 @dataclass(frozen=True)
 class _NaryRule(Generic[_Result, _ChildRuleType], Rule[_Result], Sized, Iterable[_ChildRuleType]):
     children: Sequence[_ChildRuleType]
@@ -943,13 +2058,22 @@ class _NaryRule(Generic[_Result, _ChildRuleType], Rule[_Result], Sized, Iterable
     def __iter__(self) -> Iterator[_ChildRuleType]:
         return iter(self.children)
 
-    @property
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         lexer_ = lexer.Lexer()
         for child in self.children:
             lexer_ |= child.lexer_
         return lexer_
 
+    def _subrules(self, scope: Scope[_Result]) -> Sequence[tuple['Rule[Any]', Scope[Any]]]:
+        return [(child, scope) for child in self.children]
+
+    def _rebuild(self, rebuild: _Rebuild) -> Rule[_Result]:
+        children = [rebuild(child) for child in self.children]
+        if all(child is prev for child, prev in zip(children, self.children)):
+            return self
+        return replace(self, children=children)
+
     def num_children_of_type(self, type: Type[_ChildRuleType]) -> int:
         return len(list(filter(lambda child: isinstance(child, type), self)))
 
@@ -965,6 +2089,26 @@ class _AbstractAnd(_NaryRule[_Result, _ChildRuleType]):
     def __str__(self) -> str:
         return f"({' & '.join(map(str,self))})"
 
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        first = First(nullable=True)
+        for child in self.children:
+            if not first.nullable:
+                break
+            first &= child.first(scope, refs)
+        return first
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        for child in reversed(self.children):
+            child.follow(scope, after, follows)
+            after = child.first(scope) & after
+
+    @cached_property
+    def _cut(self) -> int:
+        for index, child in enumerate(self.children):
+            if isinstance(child, Cut):
+                return index
+        return len(self.children)
+
 
 @dataclass(frozen=True)
 class NoResultAnd(_AbstractAnd[_Result, NoResultRule[_Result]], NoResultRule[_Result]):
@@ -1032,12 +2176,12 @@ class NoResultAnd(_AbstractAnd[_Result, NoResultRule[_Result]], NoResultRule[_Re
         else:
             raise TypeError(type(lhs))
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> tokens.TokenStream:
-        for child in self:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        for index, child in enumerate(self):
             try:
-                state = child(state, scope)
+                state = yield child, state, scope
             except errors.Error as error:
-                raise RuleError(rule=self, state=state, children=[error])
+                raise _rule_error(self, state, error, index > self._cut)
         return state
 
 
@@ -1110,13 +2254,13 @@ class OptionalResultAnd(_AbstractAnd[_Result, OptionalResultRule[_Result] | NoRe
         else:
             raise TypeError(type(lhs))
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndOptionalResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         result: Optional[_Result] = None
-        for child in self:
+        for index, child in enumerate(self):
             try:
-                state, child_result = child.optional()(state, scope)
+                state, child_result = yield child.optional(), state, scope
             except errors.Error as error:
-                raise RuleError(rule=self, state=state, children=[error])
+                raise _rule_error(self, state, error, index > self._cut)
             if child_result is not None:
                 if result is not None:
                     raise RuleError(
@@ -1194,13 +2338,13 @@ class SingleResultAnd(_AbstractAnd[_Result, SingleResultRule[_Result] | NoResult
         else:
             raise TypeError(type(lhs))
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndSingleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         result: Optional[_Result] = None
-        for child in self:
+        for index, child in enumerate(self):
             try:
-                state, child_result = child.optional()(state, scope)
+                state, child_result = yield child.optional(), state, scope
             except errors.Error as error:
-                raise RuleError(rule=self, state=state, children=[error])
+                raise _rule_error(self, state, error, index > self._cut)
             if child_result is not None:
                 if result is not None:
                     raise RuleError(
@@ -1279,36 +2423,148 @@ class MultipleResultAnd(_AbstractAnd[_Result, Rule[_Result]], MultipleResultRule
         else:
             raise TypeError(type(lhs))
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndMultipleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
         results: MutableSequence[_Result] = []
-        for child in self:
+        for index, child in enumerate(self):
             try:
-                state, child_results = child.multiple()(state, scope)
+                state, child_results = yield child.multiple(), state, scope
                 results += child_results
             except errors.Error as error:
-                raise RuleError(rule=self, state=state, children=[error])
+                raise _rule_error(self, state, error, index > self._cut)
         return state, results
 
 
+@dataclass(frozen=True)
+class _Dispatch:
+    indices: Mapping[int, Sequence[int]]
+    default: Sequence[int]
+
+    def __call__(self, state: tokens.TokenStream) -> Sequence[int]:
+        if not state:
+            return self.default
+        return self.indices.get(state.tokens[0].rule_id, self.default)
+
+    @staticmethod
+    def load(firsts: Sequence[Sequence[First]], size: int) -> Optional['_Dispatch']:
+        # An Or reached from several scopes only dispatches if every scope agrees.
+        dispatch: Optional[_Dispatch] = None
+        for scope_firsts in firsts:
+            rule_ids = sorted(
+                frozenset[int]().union(*[first.rule_ids for first in scope_firsts]))
+            scope_dispatch = _Dispatch(
+                {rule_id: [index for index, first in enumerate(scope_firsts) if first.admits(rule_id)]
+                 for rule_id in rule_ids},
+                [index for index, first in enumerate(scope_firsts)
+                 if first.admits(None)],
+            )
+            if dispatch is not None and dispatch != scope_dispatch:
+                return _Dispatch({}, list(range(size)))
+            dispatch = scope_dispatch
+        return dispatch
+
+
 @dataclass(frozen=True)
 class Or(_NaryRule[_Result, SingleResultRule[_Result]], SingleResultRule[_Result]):
+    # Set on the copies of rules that a Parser compiles. firsts and path are only set where
+    # dispatch falls back to trying every alternative, the only Ors that Choices records.
+    dispatch: Optional[_Dispatch] = field(
+        default=None, kw_only=True, compare=False, repr=False)
+    firsts: Sequence[Sequence[First]] = field(
+        default=(), kw_only=True, compare=False, repr=False)
+    path: str = field(default='', kw_only=True, compare=False, repr=False)
+    _propagate_cut: ClassVar[bool] = False
+
     def __str__(self) -> str:
         return f"({' | '.join(map(str,self.children))})"
 
     def __or__(self, rhs: SingleResultRule[_Result]) -> 'Or[_Result]':
         return Or[_Result](list(self.children)+[rhs])
 
-    def __call__(self, state: tokens.TokenStream, scope: Scope[_Result]) -> StateAndSingleResult[_Result]:
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        context = _context.get()
+        choices_ = context.choices if self.path else None
         child_errors: MutableSequence[errors.Error] = []
-        for child in self.children:
+        if self.dispatch is None:
+            indices: Sequence[int] = range(len(self.children))
+        else:
+            indices = self.dispatch(state)
+            if context.farthest is not None and self.dispatch.indices and (not state or state.tokens[0].rule_id not in self.dispatch.indices):
+                context.farthest.expect(state, self.dispatch.indices)
+        for index in indices:
             try:
-                return child(state, scope)
+                result = yield self.children[index], state, scope
             except errors.Error as error:
-                child_errors.append(error)
-        raise RuleError(
-            rule=self, state=state, children=child_errors)
+                if choices_ is not None:
+                    choices_.record(self, index, False)
+                if context.debug:
+                    child_errors.append(error)
+                if isinstance(error, _CutError):
+                    if self._propagate_cut:
+                        raise
+                    break
+                continue
+            if choices_ is not None:
+                choices_.record(self, index, True)
+            return result
+        if context.debug:
+            raise RuleError(rule=self, state=state, children=child_errors)
+        raise _Failure()
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        first = First()
+        for child in self.children:
+            first |= child.first(scope, refs)
+        return first
 
-    @property
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        for child in self.children:
+            child.follow(scope, after, follows)
+
+    def _disjoint(self, lhs: int, rhs: int) -> bool:
+        return bool(self.firsts) and all(
+            not firsts[lhs].nullable and not firsts[lhs].unknown and
+            not firsts[rhs].nullable and not firsts[rhs].unknown and
+            not firsts[lhs].rule_ids & firsts[rhs].rule_ids
+            for firsts in self.firsts)
+
+    def _order(self, indices: Sequence[int], rates: Sequence[float]) -> Sequence[int]:
+        # At most one of a run of pairwise FIRST-disjoint alternatives can match, so the run can be permuted.
+        order: MutableSequence[int] = []
+        run: MutableSequence[int] = []
+        for index in indices:
+            if not all(self._disjoint(index, prev) for prev in run):
+                order += sorted(run, key=lambda index: -rates[index])
+                run = []
+            run.append(index)
+        order += sorted(run, key=lambda index: -rates[index])
+        return order
+
+    def _reorder(self, rates: Sequence[float]) -> 'Or[_Result]':
+        if self.dispatch is None:
+            return self
+        return replace(self, dispatch=_Dispatch({}, self._order(self.dispatch.default, rates)))
+
+    def _factored(self) -> 'Or[_Result]':
+        children: MutableSequence[SingleResultRule[_Result]] = []
+        start = 0
+        while start < len(self.children):
+            prefix = _leading(self.children[start])
+            end = start + 1
+            while prefix is not None and end < len(self.children) and _leading(self.children[end]) == prefix:
+                end += 1
+            if prefix is not None and end - start > 1:
+                shared: _Prefix[_Result, Any] = _NoResultPrefix(prefix) if isinstance(
+                    prefix, NoResultRule) else _SinglePrefix(prefix)
+                children.append(_Factored[_Result](
+                    [_with_leading(child, shared) for child in self.children[start:end]], prefix=shared))
+            else:
+                children.append(self.children[start])
+            start = end
+        if len(children) < len(self.children):
+            return replace(self, children=children)
+        return self
+
+    @cached_property
     def lexer_(self) -> lexer.Lexer:
         lexer_ = lexer.Lexer()
         for child in self.children:
@@ -1316,6 +2572,214 @@ class Or(_NaryRule[_Result, SingleResultRule[_Result]], SingleResultRule[_Result
         return lexer_
 
 
+def _leading(rule: Rule[Any]) -> Optional[NoResultRule[Any] | SingleResultRule[Any]]:
+    while isinstance(rule, _Adapter) and not isinstance(rule, _WithScope) and rule.method != 'convert_type':
+        rule = rule.child
+    if not isinstance(rule, _AbstractAnd) or len(rule.children) < 2:
+        return None
+    prefix = rule.children[0]
+    if not isinstance(prefix, (NoResultRule, SingleResultRule)) or isinstance(prefix, (LexRule, AbstractLiteral, Cut, _Prefix)):
+        return None
+    return prefix
+
+
+def _with_leading(rule: _ChildRuleType, prefix: Rule[Any]) -> _ChildRuleType:
+    if isinstance(rule, _Adapter):
+        return replace(rule, child=_with_leading(rule.child, prefix))
+    elif isinstance(rule, _AbstractAnd):
+        return replace(rule, children=[prefix, *rule.children[1:]])
+    raise TypeError(type(rule))
+
+
+@dataclass(frozen=True)
+class _Prefix(_UnaryRule[_Result, _ChildRuleType]):
+    def __str__(self) -> str:
+        return str(self.child)
+
+    def _slot(self, state: tokens.TokenStream) -> Optional[MutableSequence[Any]]:
+        prefixes = _context.get().prefixes
+        parsed = prefixes.get(id(self)) if prefixes is not None else None
+        if parsed and parsed[-1][0] is state:
+            return parsed[-1]
+        return None
+
+    @staticmethod
+    def _result(slot: MutableSequence[Any]) -> Any:
+        if isinstance(slot[1], errors.Error):
+            raise slot[1].with_traceback(None)
+        return slot[1]
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        slot = self._slot(state)
+        if slot is None:
+            return (yield self.child, state, scope)
+        if len(slot) == 1:
+            try:
+                slot.append((yield self.child, state, scope))
+            except errors.Error as error:
+                slot.append(error)
+        return self._result(slot)
+
+
+@dataclass(frozen=True)
+class _NoResultPrefix(_Prefix[_Result, NoResultRule[_Result]], NoResultRule[_Result]):
+    pass
+
+
+@dataclass(frozen=True)
+class _SinglePrefix(_Prefix[_Result, SingleResultRule[_Result]], SingleResultRule[_Result]):
+    pass
+
+
+@dataclass(frozen=True)
+class _Factored(Or[_Result]):
+    prefix: _Prefix[_Result, Any] = field(kw_only=True)
+    _propagate_cut = True
+
+    def _rebuild(self, rebuild: _Rebuild) -> Rule[_Result]:
+        # The prefix is shared with the children, so it is rebuilt after them to the same copy.
+        children = [rebuild(child) for child in self.children]
+        prefix = rebuild(self.prefix)
+        if prefix is self.prefix and all(child is prev for child, prev in zip(children, self.children)):
+            return self
+        assert isinstance(prefix, _Prefix)
+        return replace(self, children=children, prefix=prefix)
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        prefixes = _context.get().prefixes
+        if prefixes is None:
+            return (yield from super()._steps(state, scope))
+        parsed = prefixes.setdefault(id(self.prefix), [])
+        parsed.append([state])
+        try:
+            return (yield from super()._steps(state, scope))
+        finally:
+            parsed.pop()
+
+
+class Associativity(Enum):
+    LEFT = auto()
+    RIGHT = auto()
+
+
+@dataclass(frozen=True)
+class PrefixOperator(Generic[_Result]):
+    lex_rule: lexer.Rule
+    precedence: int
+    func: Callable[[_Result], _Result]
+
+
+@dataclass(frozen=True)
+class InfixOperator(Generic[_Result]):
+    lex_rule: lexer.Rule
+    precedence: int
+    func: Callable[[_Result, _Result], _Result]
+    associativity: Associativity = Associativity.LEFT
+
+
+@dataclass(frozen=True)
+class PostfixOperator(Generic[_Result]):
+    lex_rule: lexer.Rule
+    precedence: int
+    func: Callable[[_Result], _Result]
+
+
+@dataclass(frozen=True)
+class OperatorTable(SingleResultRule[_Result]):
+    operand: SingleResultRule[_Result]
+    prefix: Sequence[PrefixOperator[_Result]] = field(
+        default_factory=list[PrefixOperator[_Result]])
+    infix: Sequence[InfixOperator[_Result]] = field(
+        default_factory=list[InfixOperator[_Result]])
+    postfix: Sequence[PostfixOperator[_Result]] = field(
+        default_factory=list[PostfixOperator[_Result]])
+
+    def __str__(self) -> str:
+        return f"OperatorTable({self.operand}, {', '.join(lex_rule.name for lex_rule in self._lex_rules)})"
+
+    @property
+    def _lex_rules(self) -> Sequence[lexer.Rule]:
+        return [operator.lex_rule for operator in self.prefix] + \
+            [operator.lex_rule for operator in self.infix] + \
+            [operator.lex_rule for operator in self.postfix]
+
+    @cached_property
+    def _prefix(self) -> Mapping[int, PrefixOperator[_Result]]:
+        return {operator.lex_rule.id: operator for operator in self.prefix}
+
+    @cached_property
+    def _infix(self) -> Mapping[int, InfixOperator[_Result]]:
+        return {operator.lex_rule.id: operator for operator in self.infix}
+
+    @cached_property
+    def _postfix(self) -> Mapping[int, PostfixOperator[_Result]]:
+        return {operator.lex_rule.id: operator for operator in self.postfix}
+
+    def _apply(self, state: tokens.TokenStream, scope: Scope[_Result], precedence: int) -> _Steps:
+        prefix = self._prefix.get(state.tokens[0].rule_id) if state else None
+        if prefix is not None:
+            state, operand = yield self._apply(
+                state.tail(), scope, prefix.precedence)
+            result = prefix.func(operand)
+        else:
+            try:
+                state, result = yield self.operand, state, scope
+            except errors.Error as error:
+                raise _rule_error(self, state, error)
+        while state:
+            rule_id = state.tokens[0].rule_id
+            postfix = self._postfix.get(rule_id)
+            if postfix is not None and postfix.precedence >= precedence:
+                state = state.tail()
+                result = postfix.func(result)
+                continue
+            infix = self._infix.get(rule_id)
+            if infix is not None and infix.precedence >= precedence:
+                state, rhs = yield self._apply(
+                    state.tail(),
+                    scope,
+                    infix.precedence + 1 if infix.associativity == Associativity.LEFT else infix.precedence,
+                )
+                result = infix.func(result, rhs)
+                continue
+            break
+        farthest = _context.get().farthest
+        if farthest is not None:
+            farthest.expect(state, [*self._infix, *self._postfix])
+        return state, result
+
+    def _steps(self, state: tokens.TokenStream, scope: Scope[_Result]) -> _Steps:
+        return (yield self._apply(state, scope, 0))
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return self.operand.lexer_ | lexer.Lexer(self._lex_rules)
+
+    def first(self, scope: Scope[_Result], refs: frozenset[str] = frozenset()) -> First:
+        return self.operand.first(scope, refs) | First(frozenset(self._prefix))
+
+    def follow(self, scope: Scope[_Result], after: First, follows: Follows) -> None:
+        operand = self.first(scope)
+        tail = First(frozenset(self._infix) | frozenset(self._postfix)) | after
+        for rule_id in [*self._prefix, *self._infix]:
+            follows.token(rule_id, operand)
+        for rule_id in self._postfix:
+            follows.token(rule_id, tail)
+        self.operand.follow(scope, tail, follows)
+
+    def _subrules(self, scope: Scope[_Result]) -> Sequence[tuple['Rule[Any]', Scope[Any]]]:
+        return [(self.operand, scope)]
+
+    def _rebuild(self, rebuild: _Rebuild) -> Rule[_Result]:
+        operand = rebuild(self.operand)
+        return self if operand is self.operand else replace(self, operand=operand)
+
+
+_parsers: MutableMapping[type, Parser[Any]] = {}
+_context_parsers: MutableMapping[tuple[type, int], tuple[Any, Parser[Any]]] = {}
+_max_context_parsers = 1 << 10
+
+
 class _AbstractParsable(ABC, Generic[_Result]):
     @classmethod
     def _name(cls) -> str:
@@ -1342,14 +2806,16 @@ class Parsable(Generic[_ParsableType], _AbstractParsable[_ParsableType]):
 
     @classmethod
     def parser_(cls) -> Parser[_ParsableType]:
-        return Parser[_ParsableType](
-            cls._name(),
-            Scope[_ParsableType](
-                {cls._name(): cls._parse_rule()} |
-                {type._name(): type._parse_rule()
-                 for type in cls._types()}
+        if cls not in _parsers:
+            _parsers[cls] = Parser[_ParsableType](
+                cls._name(),
+                Scope[_ParsableType](
+                    {cls._name(): cls._parse_rule()} |
+                    {type._name(): type._parse_rule()
+                     for type in cls._types()}
+                )
             )
-        )
+        return _parsers[cls]
 
 
 _ParsableWithContextType = TypeVar(
@@ -1365,11 +2831,18 @@ class ParsableWithContext(Generic[_ParsableWithContextType, _ParsableContext], _
 
     @classmethod
     def parser_(cls, context: _ParsableContext) -> Parser[_ParsableWithContextType]:
-        return Parser[_ParsableWithContextType](
-            cls._name(),
-            Scope[_ParsableWithContextType](
-                {cls._name(): cls._parse_rule(context)} |
-                {type._name(): type._parse_rule(context)
-                 for type in cls._types()}
+        key = cls, id(context)
+        entry = _context_parsers.get(key)
+        if entry is None or entry[0] is not context:
+            entry = context, Parser[_ParsableWithContextType](
+                cls._name(),
+                Scope[_ParsableWithContextType](
+                    {cls._name(): cls._parse_rule(context)} |
+                    {type._name(): type._parse_rule(context)
+                     for type in cls._types()}
+                )
             )
-        )
+            _context_parsers[key] = entry
+            while len(_context_parsers) > _max_context_parsers:
+                del _context_parsers[next(iter(_context_parsers))]
+        return entry[1]
@@ -0,0 +1,688 @@
+from dataclasses import dataclass, field
+from functools import cached_property
+import hashlib
+import importlib
+import importlib.util
+import os
+import sys
+from types import ModuleType
+from typing import Any, Callable, Generic, MutableMapping, MutableSequence, Optional, Sequence, TypeVar
+from . import errors, lexer, parser, tokens
+
+VERSION = 7
+
+_Result = TypeVar('_Result')
+
+_Parse = Callable[[str, Sequence[tokens.Token], Sequence[int], int, int],
+                  tuple[Optional[tuple[int, Any]], int, set[int], bool]]
+
+
+# Frames left for converters and custom rules when generated parsers limit their depth.
+_DEPTH_MARGIN = 100
+
+
+class DepthError(RecursionError):
+    # Raised by generated parsers for input nested too deep for them to recurse through
+    # without reaching the recursion limit.
+    pass
+
+
+def _stack_depth() -> int:
+    frame: Any = sys._getframe()
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+def _adapter(rule: parser.Rule[Any]) -> Optional[tuple[str, str]]:
+    if isinstance(rule, parser._Adapter):
+        return rule.kind, rule.method
+    return None
+
+
+def _importable(obj: Any) -> Optional[tuple[str, str]]:
+    module = getattr(obj, '__module__', None)
+    qualname = getattr(obj, '__qualname__', None)
+    if not isinstance(module, str) or not isinstance(qualname, str) or '.' in qualname or '<' in qualname:
+        return None
+    if getattr(sys.modules.get(module), qualname, None) is not obj:
+        return None
+    return module, qualname
+
+
+@dataclass
+class _Generator:
+    header: MutableSequence[str] = field(default_factory=list[str])
+    defs: MutableSequence[str] = field(default_factory=list[str])
+    tables: MutableSequence[str] = field(default_factory=list[str])
+    lines: MutableSequence[str] = field(default_factory=list[str])
+    objects: MutableSequence[Any] = field(default_factory=list[Any])
+    object_names: MutableMapping[int, str] = field(
+        default_factory=dict[int, str])
+    token_names: MutableMapping[int, str] = field(
+        default_factory=dict[int, str])
+    prefix_names: MutableMapping[int, str] = field(
+        default_factory=dict[int, str])
+    funcs: MutableMapping[tuple[int, tuple[tuple[str, int], ...]], str] = field(
+        default_factory=dict[tuple[int, tuple[tuple[str, int], ...]], str])
+    # Keep rules and scopes alive so their ids can't be reused while generating.
+    rules: MutableSequence[Any] = field(default_factory=list[Any])
+    # Whether failures in the current function come after a cut.
+    cut: bool = False
+    # Number of table and helper indices handed out so far.
+    indices: int = 0
+
+    def _index(self) -> int:
+        self.indices += 1
+        return self.indices - 1
+
+    def _emit(self, indent: int, line: str) -> None:
+        if line.startswith('return'):
+            # Every generated function counts its own frame, see _def, until it returns,
+            # which is after the value it returns has been computed.
+            if line != 'return None':
+                self.lines.append(f"{'    '*indent}rv = {line[len('return '):]}")
+                line = 'return rv'
+            self.lines.append(f"{'    '*indent}c[3] -= 1")
+        self.lines.append(f"{'    '*indent}{line}")
+
+    def _def(self, name: str, params: str = 't, d, i, c') -> None:
+        self._emit(0, f'def {name}({params}):')
+        self._emit(1, 'c[3] += 1')
+        self._emit(1, 'if c[3] > c[4]:')
+        self._emit(2, "raise DepthError('input nested too deep for the generated parser')")
+
+    def object(self, obj: Any) -> str:
+        if id(obj) in self.object_names:
+            return self.object_names[id(obj)]
+        name = f'_o{len(self.object_names)}'
+        self.object_names[id(obj)] = name
+        importable = _importable(obj)
+        if importable is not None:
+            self.header.append(
+                f'from {importable[0]} import {importable[1]} as {name}')
+        else:
+            self.header.append(f'{name} = OBJECTS[{len(self.objects)}]')
+            self.objects.append(obj)
+        return name
+
+    def token(self, rule_id: int) -> str:
+        if rule_id not in self.token_names:
+            name = f'_t{len(self.token_names)}'
+            self.token_names[rule_id] = name
+            self.header.append(
+                f'{name} = rule_id({repr(tokens.rule_name(rule_id))})')
+        return self.token_names[rule_id]
+
+    def prefix(self, rule: parser._Prefix[Any, Any]) -> str:
+        if id(rule) not in self.prefix_names:
+            name = f'c[{5 + len(self.prefix_names)}]'
+            self.prefix_names[id(rule)] = name
+            self.rules.append(rule)
+        return self.prefix_names[id(rule)]
+
+    def _tokens(self, rule_ids: Sequence[int]) -> str:
+        return f"({''.join(f'{self.token(rule_id)}, ' for rule_id in sorted(rule_ids, key=tokens.rule_name))})"
+
+    def _resolve(self, rule: parser.Rule[Any], scope: parser.Scope[Any]) -> tuple[parser.Rule[Any], parser.Scope[Any]]:
+        seen: set[int] = set()
+        while id(rule) not in seen:
+            seen.add(id(rule))
+            adapter = _adapter(rule)
+            if isinstance(rule, parser.Ref) and rule.rule_name in scope:
+                rule = scope[rule.rule_name]
+            elif isinstance(rule, parser.Parser):
+                scope = rule._scope(scope)
+                rule = rule._compiled[rule.root_rule_name]
+            elif adapter is not None and adapter[1] == 'with_lexer':
+                rule = getattr(rule, 'child')
+            elif adapter is not None and adapter[1] == 'with_scope':
+                scope = scope | getattr(rule, 'scope')
+                rule = getattr(rule, 'child')
+            elif adapter == ('SingleResultRule', 'optional'):
+                rule = getattr(rule, 'child')
+            else:
+                break
+        return rule, scope
+
+    def func(self, rule: parser.Rule[Any], scope: parser.Scope[Any]) -> str:
+        rule, scope = self._resolve(rule, scope)
+        key = id(rule), parser._scope_key(scope)
+        if key in self.funcs:
+            return self.funcs[key]
+        self.rules += [rule, scope]
+        name = f'_p{len(self.funcs)}'
+        self.funcs[key] = name
+        lines, self.lines = self.lines, []
+        cut, self.cut = self.cut, False
+        self._def(name)
+        self._body(rule, scope)
+        self.defs.extend(list(self.lines) + ['', ''])
+        self.lines = lines
+        self.cut = cut
+        return name
+
+    def _fail(self, indent: int, rule_ids: Optional[str] = None) -> None:
+        if rule_ids is not None:
+            self._emit(indent, f'_expect(c, i, {rule_ids})')
+        if self.cut:
+            self._emit(indent, 'c[2] = True')
+        self._emit(indent, 'return None')
+
+    def _call(self, indent: int, rule: parser.Rule[Any], scope: parser.Scope[Any], var: str = '_') -> None:
+        if isinstance(rule, parser.LexRule):
+            token = self.token(rule.lex_rule.id)
+            self._emit(indent, f'if d[i] != {token}:')
+            self._fail(indent + 1, f'({token},)')
+            self._emit(indent, 'i += 1')
+            if var != '_':
+                self._emit(indent, f'{var} = None')
+            return
+        self._emit(indent, f'r = {self.func(rule, scope)}(t, d, i, c)')
+        self._emit(indent, 'if r is None:')
+        self._fail(indent + 1)
+        self._emit(indent, f'i, {var} = r')
+
+    def _convert(self, indent: int, func: Any, arg: str) -> None:
+        self._emit(indent, 'try:')
+        self._emit(indent + 1, f'return i, {self.object(func)}({arg})')
+        self._emit(indent, 'except Error:')
+        self._fail(indent + 1)
+
+    def _body(self, rule: parser.Rule[Any], scope: parser.Scope[Any]) -> None:
+        adapter = _adapter(rule)
+        if isinstance(rule, parser.Ref):
+            self._emit(
+                1, f'raise KeyError({repr(f"unknown rule {rule.rule_name}")})')
+        elif isinstance(rule, parser.LexRule):
+            self._call(1, rule, scope)
+            self._emit(1, 'return i, None')
+        elif isinstance(rule, parser.Cut):
+            self._emit(1, 'return i, None')
+        elif isinstance(rule, parser.AbstractLiteral):
+            token = self.token(rule.lex_rule.id)
+            self._emit(1, f'if d[i] != {token}:')
+            self._fail(2, f'({token},)')
+            self._emit(1, 'i += 1')
+            self._convert(1, rule.func if isinstance(
+                rule, parser.Literal) else rule.result, 't[i - 1]')
+        elif isinstance(rule, parser.NoResultAnd):
+            for no_result_child in rule:
+                if isinstance(no_result_child, parser.Cut):
+                    self.cut = True
+                    continue
+                self._call(1, no_result_child, scope)
+            self._emit(1, 'return i, None')
+        elif isinstance(rule, parser.OptionalResultAnd) or isinstance(rule, parser.SingleResultAnd):
+            self._emit(1, 'result = None')
+            for optional_child in rule:
+                if isinstance(optional_child, parser.Cut):
+                    self.cut = True
+                    continue
+                if isinstance(optional_child, parser.NoResultRule):
+                    self._call(1, optional_child, scope)
+                    continue
+                self._call(1, optional_child.optional(), scope, 'x')
+                self._emit(1, 'if x is not None:')
+                self._emit(2, 'if result is not None:')
+                self._emit(3, 'return None')
+                self._emit(2, 'result = x')
+            if isinstance(rule, parser.SingleResultAnd):
+                self._emit(1, 'if result is None:')
+                self._emit(2, 'return None')
+            self._emit(1, 'return i, result')
+        elif isinstance(rule, parser.MultipleResultAnd):
+            self._emit(1, 'results = []')
+            for multiple_child in rule:
+                if isinstance(multiple_child, parser.Cut):
+                    self.cut = True
+                    continue
+                if isinstance(multiple_child, parser.NoResultRule):
+                    self._call(1, multiple_child, scope)
+                    continue
+                self._call(1, multiple_child.multiple(), scope, 'xs')
+                self._emit(1, 'results += xs')
+            self._emit(1, 'return i, results')
+        elif isinstance(rule, parser._Factored):
+            self._factored(rule, scope)
+        elif isinstance(rule, parser.Or):
+            self._or(rule, scope)
+        elif isinstance(rule, parser._Prefix):
+            prefix = self.prefix(rule)
+            self._emit(1, f'if {prefix} and {prefix}[-1][0] == i:')
+            self._emit(2, f'h = {prefix}[-1]')
+            self._emit(2, 'if len(h) == 1:')
+            self._emit(3, f'h.append({self.func(rule.child, scope)}(t, d, i, c))')
+            self._emit(2, 'return h[1]')
+            self._emit(1, f'return {self.func(rule.child, scope)}(t, d, i, c)')
+        elif isinstance(rule, parser.ZeroOrMore) or isinstance(rule, parser.OneOrMore):
+            child = self.func(rule.child, scope)
+            self._emit(1, 'results = []')
+            if isinstance(rule, parser.OneOrMore):
+                self._call(1, rule.child, scope, 'x')
+                self._emit(1, 'results.append(x)')
+            self._emit(1, 'while True:')
+            self._emit(2, f'r = {child}(t, d, i, c)')
+            self._emit(2, 'if r is None:')
+            self._emit(3, 'c[2] = False')
+            self._emit(3, 'return i, results')
+            self._emit(2, 'if r[0] == i:')
+            self._emit(3, 'return i, results')
+            self._emit(2, 'i, x = r')
+            self._emit(2, 'results.append(x)')
+        elif isinstance(rule, parser.ZeroOrOne):
+            self._emit(1, f'r = {self.func(rule.child, scope)}(t, d, i, c)')
+            self._emit(1, 'if r is None:')
+            self._emit(2, 'c[2] = False')
+            self._emit(2, 'return i, None')
+            self._emit(1, 'return r')
+        elif isinstance(rule, parser.UntilToken):
+            token = self.token(rule.lex_rule.id)
+            self._emit(1, 'results = []')
+            self._emit(1, 'while True:')
+            self._emit(2, 'if d[i] < 0:')
+            self._fail(3, f'({token},)')
+            self._emit(2, f'if d[i] == {token}:')
+            self._emit(3, 'return i, results')
+            self._emit(2, 'j = i')
+            self._call(2, rule.child, scope, 'x')
+            self._emit(2, 'if i == j:')
+            self._fail(3)
+            self._emit(2, 'results.append(x)')
+        elif isinstance(rule, parser.UntilEmpty):
+            self._emit(1, 'results = []')
+            self._emit(1, 'while d[i] >= 0:')
+            self._emit(2, 'j = i')
+            self._call(2, rule.child, scope, 'x')
+            self._emit(2, 'if i == j:')
+            self._fail(3)
+            self._emit(2, 'results.append(x)')
+            self._emit(1, 'return i, results')
+        elif isinstance(rule, parser.OperatorTable):
+            self._operator_table(rule, scope)
+        elif adapter is not None:
+            self._adapter_body(rule, scope, adapter)
+        else:
+            self._opaque(rule, scope)
+
+    def _or(self, rule: parser.Or[Any], scope: parser.Scope[Any]) -> None:
+        index = self._index()
+        funcs = [self.func(child, scope) for child in rule.children]
+
+        def alternatives(indices: Sequence[int]) -> str:
+            return f"({''.join(f'{funcs[i]}, ' for i in indices)})"
+
+        if rule.dispatch is None:
+            self.tables.append(
+                f'_a{index} = {alternatives(range(len(funcs)))}')
+            self._emit(1, f'for f in _a{index}:')
+        else:
+            self.tables += [
+                f'_d{index} = {{' + ', '.join(
+                    f'{self.token(rule_id)}: {alternatives(indices)}'
+                    for rule_id, indices in sorted(rule.dispatch.indices.items(), key=lambda item: tokens.rule_name(item[0]))) + '}',
+                f'_a{index} = {alternatives(rule.dispatch.default)}',
+                f'_k{index} = {self._tokens(list(rule.dispatch.indices))}',
+            ]
+            self._emit(1, f'a = _d{index}.get(d[i])')
+            self._emit(1, 'if a is None:')
+            if rule.dispatch.indices:
+                self._emit(2, f'_expect(c, i, _k{index})')
+            self._emit(2, f'a = _a{index}')
+            self._emit(1, 'for f in a:')
+        self._emit(2, 'r = f(t, d, i, c)')
+        self._emit(2, 'if r is not None:')
+        self._emit(3, 'return r')
+        self._emit(2, 'if c[2]:')
+        if not rule._propagate_cut:
+            self._emit(3, 'c[2] = False')
+        self._emit(3, 'return None')
+        self._emit(1, 'return None')
+
+    def _factored(self, rule: parser._Factored[Any], scope: parser.Scope[Any]) -> None:
+        prefix = self.prefix(rule.prefix)
+        name = f'_f{self._index()}'
+        self._emit(1, f'{prefix}.append([i])')
+        self._emit(1, 'try:')
+        self._emit(2, f'return {name}(t, d, i, c)')
+        self._emit(1, 'finally:')
+        self._emit(2, f'{prefix}.pop()')
+        self.lines += ['', '']
+        self._def(name)
+        self._or(rule, scope)
+
+    def _operator_table(self, rule: parser.OperatorTable[Any], scope: parser.Scope[Any]) -> None:
+        index = self._index()
+        self.tables += [
+            f'_prefix{index} = {{' + ', '.join(
+                f'{self.token(operator.lex_rule.id)}: ({operator.precedence}, {self.object(operator.func)})'
+                for operator in rule.prefix) + '}',
+            f'_infix{index} = {{' + ', '.join(
+                f'{self.token(operator.lex_rule.id)}: ({operator.precedence}, {self.object(operator.func)}, '
+                f'{operator.precedence + 1 if operator.associativity == parser.Associativity.LEFT else operator.precedence})'
+                for operator in rule.infix) + '}',
+            f'_postfix{index} = {{' + ', '.join(
+                f'{self.token(operator.lex_rule.id)}: ({operator.precedence}, {self.object(operator.func)})'
+                for operator in rule.postfix) + '}',
+            f'_operators{index} = {self._tokens([*rule._infix, *rule._postfix])}',
+        ]
+        name = f'_climb{index}'
+        self._emit(1, f'return {name}(t, d, i, c, 0)')
+        self.lines += ['', '']
+        self._def(name, 't, d, i, c, p')
+        self._emit(1, f'op = _prefix{index}.get(d[i])')
+        self._emit(1, 'if op is not None:')
+        self._emit(2, f'r = {name}(t, d, i + 1, c, op[0])')
+        self._emit(2, 'if r is None:')
+        self._fail(3)
+        self._emit(2, 'i, x = r')
+        self._emit(2, 'try:')
+        self._emit(3, 'x = op[1](x)')
+        self._emit(2, 'except Error:')
+        self._fail(3)
+        self._emit(1, 'else:')
+        self._call(2, rule.operand, scope, 'x')
+        self._emit(1, 'while d[i] >= 0:')
+        self._emit(2, f'op = _postfix{index}.get(d[i])')
+        self._emit(2, 'if op is not None and op[0] >= p:')
+        self._emit(3, 'i += 1')
+        self._emit(3, 'try:')
+        self._emit(4, 'x = op[1](x)')
+        self._emit(3, 'except Error:')
+        self._fail(4)
+        self._emit(3, 'continue')
+        self._emit(2, f'op = _infix{index}.get(d[i])')
+        self._emit(2, 'if op is not None and op[0] >= p:')
+        self._emit(3, f'r = {name}(t, d, i + 1, c, op[2])')
+        self._emit(3, 'if r is None:')
+        self._fail(4)
+        self._emit(3, 'i, y = r')
+        self._emit(3, 'try:')
+        self._emit(4, 'x = op[1](x, y)')
+        self._emit(3, 'except Error:')
+        self._fail(4)
+        self._emit(3, 'continue')
+        self._emit(2, 'break')
+        self._emit(1, f'_expect(c, i, _operators{index})')
+        self._emit(1, 'return i, x')
+
+    def _adapter_body(self, rule: parser.Rule[Any], scope: parser.Scope[Any], adapter: tuple[str, str]) -> None:
+        kind, method = adapter
+        child: parser.Rule[Any] = getattr(rule, 'child')
+        if method == 'convert_type':
+            scope = parser.Scope()
+        self._call(1, child, scope, 'x')
+        if method in ('convert', 'convert_type'):
+            self._convert(1, getattr(rule, 'func'), 'x')
+        elif (kind, method) == ('NoResultRule', 'optional'):
+            self._emit(1, 'return i, None')
+        elif (kind, method) == ('NoResultRule', 'multiple'):
+            self._emit(1, 'return i, []')
+        elif (kind, method) == ('SingleResultRule', 'multiple'):
+            self._emit(1, 'return i, [x]')
+        elif (kind, method) == ('OptionalResultRule', 'single'):
+            self._emit(1, 'if x is None:')
+            self._fail(2)
+            self._emit(1, 'return i, x')
+        elif (kind, method) == ('OptionalResultRule', 'single_or'):
+            self._emit(1, 'if x is None:')
+            self._emit(
+                2, f'return i, {self.object(getattr(rule, "default"))}')
+            self._emit(1, 'return i, x')
+        elif (kind, method) == ('OptionalResultRule', 'multiple'):
+            self._emit(1, 'if x is None:')
+            self._emit(2, 'return i, []')
+            self._emit(1, 'return i, [x]')
+        elif (kind, method) == ('MultipleResultRule', 'single'):
+            self._emit(1, 'if len(x) != 1:')
+            self._fail(2)
+            self._emit(1, 'return i, x[0]')
+        elif (kind, method) == ('MultipleResultRule', 'optional'):
+            self._emit(1, 'if len(x) == 0:')
+            self._emit(2, 'return i, None')
+            self._emit(1, 'if len(x) == 1:')
+            self._emit(2, 'return i, x[0]')
+            self._fail(1)
+        else:
+            raise errors.Error(
+                msg=f'unable to generate parser code for adapter {kind}.{method}')
+
+    def _opaque(self, rule: parser.Rule[Any], scope: parser.Scope[Any]) -> None:
+        self._emit(1, 'try:')
+        if isinstance(rule, parser.NoResultRule):
+            self._emit(
+                2, f'state = {self.object(rule)}(TokenStream(_Slice(t, i)), {self.object(scope)})')
+            self._emit(2, 'x = None')
+        else:
+            self._emit(
+                2, f'state, x = {self.object(rule)}(TokenStream(_Slice(t, i)), {self.object(scope)})')
+        self._emit(1, 'except _CutError:')
+        self._emit(2, 'c[2] = True')
+        self._emit(2, 'return None')
+        self._emit(1, 'except Error as error:')
+        self._emit(2, '_expect_error(error)')
+        self._fail(2)
+        self._emit(1, 'return len(t) - len(state), x')
+
+    def parse(self, parser_: parser.Parser[Any]) -> None:
+        roots = {rule_name: self.func(rule.single(), parser_._compiled)
+                 for rule_name, rule in parser_._compiled.items()}
+        self.lines += [
+            'ROOTS = {' +
+            ', '.join(f'{repr(rule_name)}: {func}' for rule_name,
+                      func in roots.items()) + '}',
+            '',
+            '',
+            'def parse(rule_name, t, d, i, depth):',
+            f'    c = [-1, set(), False, 0, depth{", []" * len(self.prefix_names)}]',
+            '    return ROOTS[rule_name](t, d, i, c), c[0], c[1], c[2]',
+        ]
+
+
+def _generate(parser_: parser.Parser[Any], preamble: Sequence[str] = ()) -> tuple[str, Sequence[Any]]:
+    generator = _Generator()
+    generator.parse(parser_)
+    header = [
+        f'# generated by pysh.core.parser_gen version {VERSION}',
+        f'from {errors.__name__} import Error',
+        f'from {parser.__name__} import _CutError, _expect_error',
+        f'from {tokens.__name__} import TokenStream, _Slice, rule_id',
+        f'from {__name__} import DepthError',
+        f'VERSION = {VERSION}',
+        *preamble,
+        *generator.header,
+        '',
+        '',
+        '# Each parse passes its own state c: the farthest index, the rule ids expected there,',
+        '# whether a cut was crossed, the number of generated frames on the stack and the most',
+        '# allowed, and a stack of results for each factored prefix.',
+        'def _expect(c, i, rule_ids):',
+        '    if i > c[0]:',
+        '        c[0], c[1] = i, set(rule_ids)',
+        '    elif i == c[0]:',
+        '        c[1].update(rule_ids)',
+        '',
+        '',
+    ]
+    return '\n'.join(header + list(generator.defs) + list(generator.tables) + ['', ''] + list(generator.lines)) + '\n', list(generator.objects)
+
+
+def generate(parser_: parser.Parser[Any]) -> tuple[str, Sequence[Any]]:
+    return _generate(parser_)
+
+
+def key(parser_: parser.Parser[Any]) -> str:
+    return hashlib.sha256(generate(parser_)[0].encode()).hexdigest()
+
+
+def _grammar_name(grammar: Callable[[], parser.Parser[Any]]) -> tuple[str, str]:
+    owner = getattr(grammar, '__self__', None)
+    module: Optional[str]
+    qualname: Optional[str]
+    if isinstance(owner, type):
+        # Classmethods such as Parsable.parser_ are named through the class they're bound to.
+        module = owner.__module__
+        qualname = f'{owner.__qualname__}.{getattr(grammar, "__name__", "")}'
+    else:
+        module = getattr(grammar, '__module__', None)
+        qualname = getattr(grammar, '__qualname__', None)
+    if isinstance(module, str) and isinstance(qualname, str) and '<' not in qualname:
+        try:
+            if _import_grammar(module, qualname) == grammar:
+                return module, qualname
+        except (ImportError, AttributeError):
+            pass
+    raise errors.Error(msg=f'grammar {grammar} is not importable')
+
+
+def _import_grammar(module: str, qualname: str) -> Callable[[], parser.Parser[Any]]:
+    obj: Any = importlib.import_module(module)
+    for name in qualname.split('.'):
+        obj = getattr(obj, name)
+    return obj
+
+
+def _load_grammar(module: str, qualname: str, key_: str) -> tuple[parser.Parser[Any], Sequence[Any]]:
+    # Called by saved modules when they're imported: objects that can't be imported by
+    # name are taken from a fresh copy of the grammar, which must generate the same source.
+    parser_ = _import_grammar(module, qualname)()
+    source, objects = generate(parser_)
+    if hashlib.sha256(source.encode()).hexdigest() != key_:
+        raise errors.Error(
+            msg=f'grammar {module}.{qualname} changed since its parser was generated')
+    return parser_, objects
+
+
+@dataclass(frozen=True)
+class GeneratedParser(Generic[_Result], parser.SingleResultRule[_Result]):
+    parser_: parser.Parser[_Result]
+    source: str
+    objects: Sequence[Any] = field(
+        default_factory=list[Any], compare=False, repr=False)
+    filename: str = '<parser_gen>'
+    # Input too deep for the generated functions raises DepthError unless this is set, in
+    # which case it's parsed again by the interpreter. That reruns every converter, so only
+    # set it for grammars whose converters have no side effects.
+    reparse_deep: bool = False
+    # Rule ids of the last token list parsed, shared by the statements of a stream.
+    _ids: MutableMapping[int, tuple[Sequence[tokens.Token], Sequence[int]]] = field(
+        default_factory=dict[int, tuple[Sequence[tokens.Token], Sequence[int]]], compare=False, repr=False)
+
+    def __str__(self) -> str:
+        return f'GeneratedParser({self.parser_})'
+
+    @cached_property
+    def _module(self) -> dict[str, Any]:
+        module: dict[str, Any] = {'OBJECTS': self.objects}
+        exec(compile(self.source, self.filename, 'exec'), module)
+        if module.get('VERSION') != VERSION:
+            raise errors.Error(
+                msg=f'generated parser version {module.get("VERSION")} != {VERSION}')
+        return module
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return self.parser_.lexer_
+
+    def first(self, scope: parser.Scope[_Result], refs: frozenset[str] = frozenset()) -> parser.First:
+        return self.parser_.first(scope, refs)
+
+    def __call__(
+            self,
+            state: tokens.TokenStream | str,
+            scope: Optional[parser.Scope[_Result]] = None,
+            rule_name: Optional[str] = None,
+    ) -> parser.StateAndSingleResult[_Result]:
+        if isinstance(state, str):
+            state = self.parser_._lex(state)
+        context = parser._context.get()
+        if scope or context.debug or context.profile is not None or context.choices is not None:
+            return self.parser_(state, scope, rule_name)
+        rule_name = rule_name or self.parser_.root_rule_name
+        if isinstance(state.tokens, tokens._Slice):
+            t, start = state.tokens.tokens, state.tokens.start
+        else:
+            t, start = state.tokens, 0
+        ids = self._ids.get(id(t))
+        if ids is None or ids[0] is not t:
+            ids = t, [token.rule_id for token in t] + [-1]
+            self._ids.clear()
+            self._ids[id(t)] = ids
+        parse: _Parse = self._module['parse']
+        prev_farthest, farthest = context.farthest, parser._Farthest()
+        context_token = parser._set(farthest=farthest)
+        try:
+            try:
+                result, index, rule_ids, cut = parse(
+                    rule_name, t, ids[1], start, sys.getrecursionlimit() - _stack_depth() - _DEPTH_MARGIN)
+            finally:
+                parser._context.reset(context_token)
+        except DepthError:
+            if not self.reparse_deep:
+                raise
+            return self.parser_(state, scope, rule_name)
+        if index >= 0:
+            farthest.expect(tokens.TokenStream(tokens._Slice(t, index)), rule_ids)
+        if prev_farthest is not None and farthest.state is not None:
+            prev_farthest.expect(farthest.state, farthest.rule_ids)
+        if result is None:
+            if prev_farthest is not None:
+                raise parser._CutError(child=parser._Failure()) if cut else parser._Failure()
+            raise farthest.error(rule_name, state)
+        index, val = result
+        return tokens.TokenStream(tokens._Slice(t, index)), val
+
+    def save(self, path: str, grammar: Callable[[], parser.Parser[_Result]]) -> None:
+        module, qualname = _grammar_name(grammar)
+        key_ = hashlib.sha256(self.source.encode()).hexdigest()
+        if key(grammar()) != key_:
+            raise errors.Error(
+                msg=f'grammar {module}.{qualname} does not generate {self}')
+        source, _ = _generate(self.parser_, [
+            f'from {__name__} import _load_grammar',
+            f'PARSER, OBJECTS = _load_grammar({module!r}, {qualname!r}, {key_!r})',
+        ])
+        with open(path, 'w') as file:
+            file.write(source)
+
+    @staticmethod
+    def load(parser_: parser.Parser[_Result], reparse_deep: bool = False) -> 'GeneratedParser[_Result]':
+        source, objects = generate(parser_)
+        return GeneratedParser[_Result](parser_, source, objects, reparse_deep=reparse_deep)
+
+    @staticmethod
+    def load_module(module: ModuleType) -> 'GeneratedParser[Any]':
+        if getattr(module, 'VERSION', None) != VERSION:
+            raise errors.Error(
+                msg=f'generated parser version {getattr(module, "VERSION", None)} != {VERSION}')
+        with open(module.__file__ or '') as file:
+            source = file.read()
+        generated = GeneratedParser[Any](
+            module.PARSER, source, module.OBJECTS, module.__file__ or '<parser_gen>')
+        # The module is already executed, so seed the cached property rather than run it again.
+        generated.__dict__['_module'] = vars(module)
+        return generated
+
+    @staticmethod
+    def load_file(path: str) -> 'GeneratedParser[Any]':
+        name = f'_parser_gen_{hashlib.sha256(os.path.abspath(path).encode()).hexdigest()}'
+        spec = importlib.util.spec_from_file_location(name, path)
+        if spec is None or spec.loader is None:
+            raise errors.Error(msg=f'unable to import generated parser {path}')
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return GeneratedParser.load_module(module)
+
+
+_cache: dict[tuple[int, bool], tuple[parser.Parser[Any], GeneratedParser[Any]]] = {}
+
+
+def cached(parser_: parser.Parser[_Result], reparse_deep: bool = False) -> GeneratedParser[_Result]:
+    key_ = id(parser_), reparse_deep
+    entry = _cache.get(key_)
+    if entry is None or entry[0] is not parser_:
+        entry = parser_, GeneratedParser.load(parser_, reparse_deep)
+        _cache[key_] = entry
+    return entry[1]
@@ -0,0 +1,376 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from typing import Any, Iterator, MutableSequence, Optional, Sequence
+from unittest import TestCase
+from . import errors, lexer, parser, parser_gen, tokens
+
+
+def _int(token: tokens.Token) -> int:
+    return int(token.val)
+
+
+def _sum(vals: Sequence[int]) -> int:
+    return sum(vals)
+
+
+class Custom(parser.SingleResultRule[int]):
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[int]) -> parser.StateAndSingleResult[int]:
+        if not state or state.head().rule_name != '$':
+            raise errors.Error(msg='expected $')
+        return state.tail(), len(scope)
+
+    @property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer.literal('$')
+
+
+_int_lex_rule = lexer.Rule.load('int', '\\d+')
+
+
+def _parser() -> parser.Parser[int]:
+    return parser.Parser[int](
+        'expr',
+        parser.Scope[int]({
+            'expr': parser.OperatorTable[int](
+                parser.Ref[int]('operand'),
+                prefix=[parser.PrefixOperator[int](
+                    lexer.Rule.load('-'), 3, lambda val: -val)],
+                infix=[
+                    parser.InfixOperator[int](
+                        lexer.Rule.load('+'), 1, lambda lhs, rhs: lhs + rhs),
+                    parser.InfixOperator[int](
+                        lexer.Rule.load('*'), 2, lambda lhs, rhs: lhs * rhs),
+                ],
+            ).with_lexer(lexer.Lexer.whitespace()),
+            'operand': parser.Or[int]([
+                parser.Literal[int](_int_lex_rule, _int),
+                parser.Ref[int]('paren'),
+                parser.Ref[int]('sum'),
+                parser.Ref[int]('custom'),
+                parser.Ref[int]('optional'),
+                parser.Ref[int]('cut'),
+                parser.Ref[int]('bang'),
+            ]),
+            'paren': '(' & parser.Ref[int]('expr') & ')',
+            'sum': (
+                '[' &
+                parser.Ref[int]('expr').until_token(lexer.Rule.load(']')) &
+                ']'
+            ).convert(_sum),
+            'custom': Custom().with_scope(parser.Scope[int]({'extra': Custom()})),
+            'optional': (
+                '?' & parser.Literal[int](_int_lex_rule, _int).zero_or_one()
+            ).single_or(0),
+            'cut': '!' & parser.Cut[int]() & parser.Literal[int](_int_lex_rule, _int),
+            'bang': '!' & parser.LexRule[int].load('!') & parser.Literal[int](_int_lex_rule, _int),
+        }),
+    )
+
+
+def _other_parser() -> parser.Parser[int]:
+    return parser.Parser[int]('int', parser.Scope[int]({'int': parser.Literal[int](_int_lex_rule, _int)}))
+
+
+class Gate(parser.NoResultRule[int]):
+    def __init__(self, barrier: threading.Barrier):
+        self.barrier = barrier
+
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[int]) -> tokens.TokenStream:
+        self.barrier.wait(timeout=10)
+        return state
+
+    @property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer()
+
+
+class _Copies(list[tokens.Token]):
+    # Counts the tokens copied out of the list by slicing or iterating it.
+    copied = 0
+
+    def __iter__(self) -> Iterator[tokens.Token]:
+        self.copied += len(self)
+        return super().__iter__()
+
+    def __getitem__(self, index: Any) -> Any:
+        if isinstance(index, slice):
+            self.copied += len(range(*index.indices(len(self))))
+        return super().__getitem__(index)
+
+
+class GeneratedParserTest(TestCase):
+    def test_call(self):
+        parser_ = _parser()
+        generated = parser_gen.GeneratedParser.load(parser_)
+        for input in [
+            '1',
+            '1 + 2 * 3',
+            '(1 + 2) * 3',
+            '-1 + 2',
+            '[1 2 (3 + 4)]',
+            '$ + 1',
+            '? + ?2',
+            '!1 + 2',
+            '!!2',
+            '[!1 !!2]',
+            '1 2',
+            '',
+            '1 +',
+            '(1',
+            '[1 2',
+            '*',
+        ]:
+            with self.subTest(input=input):
+                try:
+                    expected = parser_(input)
+                except parser.ParseError as error:
+                    with self.assertRaises(parser.ParseError) as context:
+                        generated(input)
+                    self.assertEqual(context.exception.state, error.state)
+                    self.assertEqual(context.exception.msg, error.msg)
+                else:
+                    self.assertEqual(generated(input), expected)
+
+    def test_save_load_file(self):
+        parser_ = _parser()
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'parser.py')
+            parser_gen.GeneratedParser.load(parser_).save(path, _parser)
+            generated = parser_gen.GeneratedParser.load_file(path)
+            for input in ['1 + 2 * 3', '[1 (2 + 3)]', '$ + ?2', '!1 + 2', '1 +']:
+                with self.subTest(input=input):
+                    try:
+                        expected = parser_(input)
+                    except parser.ParseError as error:
+                        with self.assertRaises(parser.ParseError) as context:
+                            generated(input)
+                        self.assertEqual(context.exception.msg, error.msg)
+                    else:
+                        self.assertEqual(generated(input), expected)
+
+    def test_load_file_new_process(self):
+        # Rule ids are interned in a different order in a fresh interpreter.
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'parser.py')
+            parser_gen.GeneratedParser.load(_parser()).save(path, _parser)
+            result = subprocess.run(
+                [sys.executable, '-c',
+                 'import sys; from pysh.core import tokens, parser_gen; tokens.rule_id("z"); '
+                 'print(parser_gen.GeneratedParser.load_file(sys.argv[1])("1 + 2 * [3 4]")[1])', path],
+                capture_output=True, text=True, check=True,
+                cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+            )
+        self.assertEqual(result.stdout.strip(), '15')
+
+    def test_load_file_changed_grammar(self):
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'parser.py')
+            generated = parser_gen.GeneratedParser.load(_parser())
+            generated.save(path, _parser)
+            with open(path) as file:
+                source = file.read()
+            with open(path, 'w') as file:
+                file.write(source.replace(parser_gen.key(_parser()), '0' * 64))
+            with self.assertRaises(errors.Error):
+                parser_gen.GeneratedParser.load_file(path)
+
+    def test_save_invalid_grammar(self):
+        generated = parser_gen.GeneratedParser.load(_parser())
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'parser.py')
+            with self.assertRaises(errors.Error):
+                generated.save(path, lambda: _parser())
+            with self.assertRaises(errors.Error):
+                generated.save(path, _other_parser)
+            self.assertFalse(os.path.exists(path))
+
+    def test_rule_name(self):
+        parser_ = _parser()
+        generated = parser_gen.GeneratedParser.load(parser_)
+        self.assertEqual(
+            generated('1 2', rule_name='operand'),
+            parser_('1 2', rule_name='operand'),
+        )
+        with self.assertRaises(KeyError):
+            generated('1', rule_name='unknown')
+
+    def test_unknown_ref(self):
+        parser_ = parser.Parser[int](
+            'a', parser.Scope[int]({'a': parser.Ref[int]('b')}))
+        generated = parser_gen.GeneratedParser.load(parser_)
+        with self.assertRaises(KeyError):
+            generated(tokens.TokenStream())
+
+    def test_nested(self):
+        generated = parser_gen.GeneratedParser.load(_parser())
+        rule = generated.until_empty()
+        self.assertEqual(
+            rule(generated.lexer_('1 + 2 3'), parser.Scope[int]()),
+            (tokens.TokenStream(), [3, 3]),
+        )
+        with self.assertRaises(errors.Error):
+            rule(generated.lexer_('1 +'), parser.Scope[int]())
+
+    def test_deep(self):
+        parser_ = _parser()
+        generated = parser_gen.GeneratedParser.load(parser_)
+        reparsed = parser_gen.GeneratedParser.load(parser_, reparse_deep=True)
+        limit = sys.getrecursionlimit()
+        for depth, deep in list[tuple[int, bool]]([
+            (0, False),
+            (10, False),
+            (limit // 16, False),
+            (limit // 2, True),
+            (limit, True),
+        ]):
+            with self.subTest(depth=depth):
+                input = '(' * depth + '1' + ')' * depth
+                expected = parser_(input)
+                self.assertEqual(reparsed(input), expected)
+                if deep:
+                    with self.assertRaises(parser_gen.DepthError):
+                        generated(input)
+                else:
+                    self.assertEqual(generated(input), expected)
+        # Long but shallow input must not add up to too deep.
+        input = '[' + ' '.join(['-1 + (2) * ?'] * limit) + ']'
+        self.assertEqual(generated(input), parser_(input))
+
+    def test_converter_recursion_error(self):
+        calls: MutableSequence[int] = []
+
+        def convert(token: tokens.Token) -> int:
+            calls.append(1)
+            raise RecursionError()
+
+        generated = parser_gen.GeneratedParser.load(parser.Parser[int](
+            'int', parser.Scope[int]({'int': parser.Literal[int](_int_lex_rule, convert)})), reparse_deep=True)
+        with self.assertRaises(RecursionError) as context:
+            generated('1')
+        self.assertNotIsInstance(context.exception, parser_gen.DepthError)
+        self.assertEqual(len(calls), 1)
+
+    def test_stream(self):
+        generated = parser_gen.GeneratedParser.load(_parser())
+        for count in [10, 100, 1000]:
+            with self.subTest(count=count):
+                t = _Copies(generated.lexer_(' '.join(['1 + 2'] * count)).tokens)
+                state = tokens.TokenStream(t)
+                vals: MutableSequence[int] = []
+                while state:
+                    state, val = generated(state)
+                    vals.append(val)
+                    assert isinstance(state.tokens, tokens._Slice)
+                    self.assertIs(state.tokens.tokens, t)
+                self.assertEqual(vals, [3] * count)
+                self.assertLessEqual(t.copied, len(t))
+
+    def test_threads(self):
+        def load(barrier: threading.Barrier) -> parser_gen.GeneratedParser[int]:
+            int_ = parser.Literal[int](_int_lex_rule, _int)
+            return parser_gen.GeneratedParser.load(parser.Parser[int](
+                'expr',
+                parser.Scope[int]({
+                    'expr': (
+                        (int_ & '+' & Gate(barrier) & ';') |
+                        (int_ & '-' & Gate(barrier) & ',')
+                    ),
+                }),
+            ))
+
+        inputs = [
+            tokens.TokenStream([tokens.Token('int', '1'), tokens.Token('+', '+'), tokens.Token('int', '2')]),
+            tokens.TokenStream([tokens.Token('int', '1'), tokens.Token('-', '-'), tokens.Token('int', '2')]),
+        ]
+        expected: MutableSequence[str] = []
+        for state in inputs:
+            with self.assertRaises(parser.ParseError) as context:
+                load(threading.Barrier(1))(state)
+            expected.append(context.exception.msg)
+        generated = load(threading.Barrier(len(inputs)))
+        actual: MutableSequence[Optional[str]] = [None] * len(inputs)
+
+        def parse(index: int) -> None:
+            try:
+                generated(inputs[index])
+            except parser.ParseError as error:
+                actual[index] = error.msg
+
+        threads = [threading.Thread(target=parse, args=(index,))
+                   for index in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(actual, expected)
+
+    def test_debug(self):
+        generated = parser_gen.GeneratedParser.load(_parser())
+        with parser.debug():
+            with self.assertRaises(parser.ParseError) as context:
+                generated('1 +')
+        self.assertNotEqual(context.exception.children, [])
+
+    def test_profile(self):
+        parser_ = _parser()
+        expected = parser_('1 + 2')
+        generated = parser_gen.GeneratedParser.load(parser_)
+        with parser.profile() as profile:
+            self.assertEqual(generated('1 + 2'), expected)
+        self.assertEqual(profile.rules['operand'].calls, 2)
+
+    def test_contextual(self):
+        parser_ = _parser().with_contextual()
+        generated = parser_gen.GeneratedParser.load(parser_)
+        for input in ['1 + 2', '[1 (2)]', '1 +']:
+            with self.subTest(input=input):
+                try:
+                    expected = parser_(input)
+                except parser.ParseError:
+                    with self.assertRaises(parser.ParseError):
+                        generated(input)
+                else:
+                    self.assertEqual(generated(input), expected)
+
+    def test_factored(self):
+        int_ = parser.Literal[int](_int_lex_rule, _int)
+        parser_ = parser.Parser[int](
+            'expr',
+            parser.Scope[int]({
+                'expr': (
+                    (parser.Ref[int]('int') & '+') |
+                    (parser.Ref[int]('int') & '-').convert(lambda val: -val) |
+                    (parser.Ref[int]('int') & '*' & parser.Cut[int]() & '*') |
+                    (parser.Ref[int]('int') & '*') |
+                    parser.Ref[int]('int')
+                ).with_lexer(lexer.Lexer.whitespace()),
+                'int': int_,
+            }),
+        )
+        generated = parser_gen.GeneratedParser.load(parser_)
+        for input in ['1 +', '1 -', '1 * *', '1 *', '1', '1 * -', '']:
+            with self.subTest(input=input):
+                try:
+                    expected = parser_(input)
+                except parser.ParseError as error:
+                    with self.assertRaises(parser.ParseError) as context:
+                        generated(input)
+                    self.assertEqual(context.exception.state, error.state)
+                else:
+                    self.assertEqual(generated(input), expected)
+        self.assertIn('c[5].append([i])', generated.source)
+
+    def test_imports(self):
+        source, objects = parser_gen.generate(_parser())
+        self.assertIn(f'from {__name__} import _int as ', source)
+        self.assertIn(f'from {__name__} import _sum as ', source)
+        self.assertNotIn(_int, objects)
+
+    def test_cached(self):
+        parser_ = _parser()
+        generated = parser_gen.cached(parser_)
+        self.assertIs(parser_gen.cached(parser_), generated)
+        self.assertIsNot(parser_gen.cached(_parser()), generated)
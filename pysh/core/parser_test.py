@@ -1,6 +1,10 @@
+import os
+import sys
+import tempfile
+import threading
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
-from typing import Iterable, Iterator, MutableSequence, Optional, Sequence, Sized, Type, Union
+from typing import Any, Iterable, Iterator, Mapping, MutableSequence, Optional, Sequence, Sized, Type, Union
 from unittest import TestCase
 from . import errors, lexer, parser, tokens
 
@@ -1763,3 +1767,1155 @@ class RuleTest(TestCase):
                     rule.with_lexer(lexer_).lexer_,
                     expected
                 )
+
+    def test_adapter_types(self):
+        def _val(val: Optional[Val] | Sequence[Val]) -> Val:
+            return Int(0)
+
+        for name, adapt in list[tuple[str, Any]]([
+            ('no_result.optional', lambda: parser.LexRule[Val].load('a').optional()),
+            ('no_result.multiple', lambda: parser.LexRule[Val].load('a').multiple()),
+            ('single.multiple', lambda: Val.ref().multiple()),
+            ('single.convert', lambda: Val.ref().convert(_val)),
+            ('single.convert_type', lambda: Val.ref().convert_type(_val)),
+            ('single.with_lexer', lambda: Val.ref().with_lexer(lexer.Lexer())),
+            ('single.with_scope', lambda: Val.ref().with_scope(parser.Scope[Val]())),
+            ('optional.single', lambda: Val.ref().zero_or_one().single()),
+            ('optional.single_or', lambda: Val.ref().zero_or_one().single_or(Int(0))),
+            ('optional.multiple', lambda: Val.ref().zero_or_one().multiple()),
+            ('multiple.single', lambda: Val.ref().zero_or_more().single()),
+            ('multiple.optional', lambda: Val.ref().zero_or_more().optional()),
+            ('multiple.convert', lambda: Val.ref().zero_or_more().convert(_val)),
+        ]):
+            with self.subTest(name=name):
+                self.assertIs(type(adapt()), type(adapt()))
+                self.assertEqual(adapt(), adapt())
+
+
+class ScopeTest(TestCase):
+    def test_or(self):
+        a = Int._parse_rule()
+        b = Str._parse_rule()
+        c = List._parse_rule()
+        for scope, expected in list[tuple[parser.Scope[Val], dict[str, parser.SingleResultRule[Val]]]]([
+            (parser.Scope[Val]() | parser.Scope[Val](), {}),
+            (parser.Scope[Val]({'a': a}) | parser.Scope[Val](), {'a': a}),
+            (parser.Scope[Val]() | parser.Scope[Val]({'a': a}), {'a': a}),
+            (
+                parser.Scope[Val]({'a': a}) | parser.Scope[Val]({'b': b}),
+                {'a': a, 'b': b},
+            ),
+            (
+                parser.Scope[Val]({'a': a, 'b': b}) |
+                parser.Scope[Val]({'b': c}),
+                {'a': a, 'b': c},
+            ),
+            (
+                parser.Scope[Val]({'a': a}) | (
+                    parser.Scope[Val]({'b': b}) | parser.Scope[Val]({'a': c})),
+                {'a': c, 'b': b},
+            ),
+            (
+                (parser.Scope[Val]({'a': a}) | parser.Scope[Val]({'b': b})) |
+                parser.Scope[Val]({'c': c}),
+                {'a': a, 'b': b, 'c': c},
+            ),
+        ]):
+            with self.subTest(scope=scope, expected=expected):
+                self.assertEqual(dict(scope.items()), expected)
+                self.assertEqual(len(scope), len(expected))
+                self.assertEqual(bool(scope), bool(expected))
+                self.assertEqual(set(scope), set(expected))
+                for name in ['a', 'b', 'c']:
+                    self.assertEqual(name in scope, name in expected)
+                    if name in expected:
+                        self.assertIs(scope[name], expected[name])
+                    else:
+                        with self.assertRaises(KeyError):
+                            scope[name]
+
+    def test_or_chained(self):
+        lhs = parser.Scope[Val]({'a': Int._parse_rule()})
+        rhs = parser.Scope[Val]({'b': Str._parse_rule()})
+        scope = lhs | rhs
+        self.assertIs(scope.parent, lhs)
+        self.assertIs(scope.rules, rhs.rules)
+        self.assertIs(lhs | parser.Scope[Val](), lhs)
+        self.assertIs(parser.Scope[Val]() | rhs, rhs)
+        self.assertIs(scope | rhs, scope)
+
+
+class ParserTest(TestCase):
+    def test_parser_cached(self):
+        self.assertIs(Val.parser_(), Val.parser_())
+        self.assertIs(Expr.parser_(), Expr.parser_())
+        self.assertIsNot(Val.parser_(), Expr.parser_())
+
+    def test_parser_with_context_cached(self):
+        class Context(parser.ParsableWithContext['Context', parser.Scope[Val]]):
+            @classmethod
+            def _types(cls) -> Sequence[Type['Context']]:
+                return []
+
+        lhs = parser.Scope[Val]()
+        rhs = parser.Scope[Val]()
+        self.assertIs(Context.parser_(lhs), Context.parser_(lhs))
+        self.assertIsNot(Context.parser_(lhs), Context.parser_(rhs))
+
+    def test_scope_cached(self):
+        scope = parser.Scope[Val]({'a': Int._parse_rule()})
+        parser_ = Val.parser_()
+        self.assertIs(parser_._scope(None), parser_._compiled)
+        self.assertIs(parser_._scope(scope), parser_._scope(scope))
+        self.assertEqual(set(parser_._scope(scope)),
+                         set(scope) | set(parser_.scope))
+
+    def test_lexer_cached(self):
+        for rule in list[parser.Rule[Val]]([
+            Val.parser_(),
+            List._parse_rule(),
+            Int._parse_rule().with_lexer(lexer.Lexer.whitespace()),
+            Val.ref().with_scope(Val.parser_().scope),
+            Val.ref() | Int._parse_rule(),
+        ]):
+            with self.subTest(rule=rule):
+                self.assertIs(rule.lexer_, rule.lexer_)
+
+    def test_packrat(self):
+        for packrat, state, expected_calls in list[tuple[bool, tokens.TokenStream, int]]([
+            (False, toks(tok('int', '1'), 'x'), 1),
+            (False, toks(tok('int', '1'), 'y'), 2),
+            (False, toks(tok('int', '1'), 'z'), 3),
+            (True, toks(tok('int', '1'), 'x'), 1),
+            (True, toks(tok('int', '1'), 'y'), 1),
+            (True, toks(tok('int', '1'), 'z'), 1),
+        ]):
+            with self.subTest(packrat=packrat, state=state, expected_calls=expected_calls):
+                calls: MutableSequence[tokens.Token] = []
+
+                def load(token: tokens.Token) -> Val:
+                    calls.append(token)
+                    return Int(int(token.val))
+
+                a = parser.Ref[Val]('a')
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+                        'b': a,
+                        's': (a & 'x') | (parser.Ref[Val]('b') & 'y') | (a & 'z'),
+                    }),
+                    packrat=packrat,
+                )
+                self.assertEqual(parser_(state), (tokens.TokenStream(), Int(1)))
+                self.assertEqual(len(calls), expected_calls)
+
+    def test_packrat_memo_size(self):
+        for memo_size, expected_calls in list[tuple[int, int]]([
+            (1, 2),
+            (2, 1),
+        ]):
+            with self.subTest(memo_size=memo_size, expected_calls=expected_calls):
+                calls: MutableSequence[tokens.Token] = []
+
+                def load(token: tokens.Token) -> Val:
+                    calls.append(token)
+                    return Int(int(token.val))
+
+                a = parser.Ref[Val]('a')
+                b = parser.Ref[Val]('b')
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+                        'b': a & 'x',
+                        's': (b & 'y') | (b & 'z') | a,
+                    }),
+                ).with_packrat(memo_size)
+                self.assertEqual(
+                    parser_(toks(tok('int', '1'), 'w')),
+                    (toks('w'), Int(1)),
+                )
+                self.assertEqual(len(calls), expected_calls)
+
+    def test_packrat_with_scope(self):
+        calls: MutableSequence[tokens.Token] = []
+
+        def load(token: tokens.Token) -> Val:
+            calls.append(token)
+            return Int(int(token.val))
+
+        inner = parser.Scope[Val]({
+            'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+            'b': parser.Ref[Val]('a'),
+        })
+        b = parser.Ref[Val]('b').with_scope(inner)
+        parser_ = parser.Parser[Val](
+            's',
+            parser.Scope[Val]({
+                's': (parser.Ref[Val]('c') & 'x') | (parser.Ref[Val]('d') & 'y'),
+                'c': b,
+                'd': b,
+            }),
+        ).with_packrat()
+        self.assertEqual(
+            parser_(toks(tok('int', '1'), 'y')),
+            (tokens.TokenStream(), Int(1)),
+        )
+        self.assertEqual(len(calls), 1)
+
+    def test_stream(self):
+        for input, expected in list[tuple[str, Sequence[Val]]]([
+            ('', []),
+            ('1', [Int(1)]),
+            ('1"a"[2]', [Int(1), Str('a'), List([Int(2)])]),
+        ]):
+            with self.subTest(input=input, expected=expected):
+                self.assertEqual(list(Val.parser_().stream(input)), expected)
+
+    def test_stream_error(self):
+        stream = Val.parser_().stream('1[')
+        self.assertEqual(next(stream), Int(1))
+        with self.assertRaises(parser.ParseError):
+            next(stream)
+
+
+class IncrementalTest(TestCase):
+    def test_edit(self):
+        for input, reused in list[tuple[str, Sequence[bool]]]([
+            ('[[1],[2],[3]]', [True, True, True]),
+            ('[[1],[2],[4]]', [True, True, False]),
+            ('[[5],[2],[3]]', [False, True, True]),
+            ('[[1],[2,7],[3]]', [True, False, True]),
+            ('[[1],[2]]', [True, False]),
+            ('[[1],[2],[3],[]]', [True, True, False, False]),
+        ]):
+            with self.subTest(input=input, reused=reused):
+                incremental = Val.parser_().incremental('[[1],[2],[3]]')
+                edited = incremental.edit(input)
+                self.assertEqual(edited.result, Val.parser_()(input))
+                _, prev_result = incremental.result
+                _, result = edited.result
+                assert isinstance(prev_result, List) and isinstance(result, List)
+                self.assertEqual(
+                    [prev_val is val for prev_val, val in zip(prev_result.vals, result.vals)],
+                    reused[:len(prev_result.vals)],
+                )
+
+    def test_edit_moved(self):
+        lexer_ = Val.parser_().lexer_ | lexer.Lexer.whitespace()
+        for input, reused in list[tuple[str, Sequence[bool]]]([
+            ('[[1],\n[2],\n[3]]', [True, True, True]),
+            ('[[1],\n\n[2],\n[3]]', [True, True, True]),
+            ('[[1],\n  [2],\n[3]]', [True, True, True]),
+            ('[[1],[2],\n[3]]', [True, True, True]),
+            ('[[5],\n\n[2],\n[3]]', [False, True, True]),
+            ('[[5],\n[2],[3]]', [False, False, True]),
+            ('[[1],\n[2,7],\n[3]]', [True, False, True]),
+        ]):
+            with self.subTest(input=input, reused=reused):
+                incremental = Val.parser_().incremental(lexer_('[[1],\n[2],\n[3]]'))
+                edited = incremental.edit(lexer_(input))
+                self.assertEqual(edited.state, lexer_(input))
+                self.assertEqual(edited.result, Val.parser_()(lexer_(input)))
+                _, prev_result = incremental.result
+                _, result = edited.result
+                assert isinstance(prev_result, List) and isinstance(result, List)
+                self.assertEqual(
+                    [prev_val is val for prev_val, val in zip(prev_result.vals, result.vals)],
+                    reused,
+                )
+
+    def test_edit_error(self):
+        incremental = Val.parser_().incremental('[[1],[2]]')
+        for input in ['[[1],[2]', '[[1],', '']:
+            with self.subTest(input=input):
+                with self.assertRaises(parser.ParseError) as expected:
+                    Val.parser_()(input)
+                with self.assertRaises(parser.ParseError) as context:
+                    incremental.edit(input)
+                self.assertEqual(context.exception.state, expected.exception.state)
+                self.assertEqual(context.exception.msg, expected.exception.msg)
+
+    def test_edit_custom(self):
+        class Peek(parser.SingleResultRule[Val]):
+            # Looks ahead without consuming through state.pop.
+            def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Val]) -> parser.StateAndSingleResult[Val]:
+                if [token.rule_name for token in state.tokens[:3]] != ['a', 'b', 'c']:
+                    raise errors.Error(msg='expected a b c')
+                return tokens.TokenStream(state.tokens[3:]), Str('a b c')
+
+            @property
+            def lexer_(self) -> lexer.Lexer:
+                return lexer.Lexer()
+
+        def load(token: tokens.Token) -> Val:
+            return Str(token.val)
+
+        for custom in list[parser.SingleResultRule[Val]]([_Pop('a', 'b', 'c'), Peek()]):
+            with self.subTest(custom=custom):
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'item': parser.Or[Val]([custom, *[
+                            parser.Literal[Val](lexer.Rule.load(rule_name), load)
+                            for rule_name in 'abcd'
+                        ]]),
+                        's': parser.Ref[Val]('item').one_or_more().convert(List),
+                    }),
+                )
+                self.assertEqual(
+                    parser_.incremental('abd').edit('abc').result,
+                    parser_('abc'),
+                )
+
+
+class FirstTest(TestCase):
+    def test_first(self):
+        int_id = tokens.rule_id('int')
+        a_id = tokens.rule_id('a')
+        b_id = tokens.rule_id('b')
+        scope = parser.Scope[Val]({'int': Int._parse_rule()})
+        for rule, expected in list[tuple[parser.Rule[Val], parser.First]]([
+            (
+                parser.LexRule.load('a'),
+                parser.First(frozenset({a_id})),
+            ),
+            (
+                Int._parse_rule(),
+                parser.First(frozenset({int_id})),
+            ),
+            (
+                parser.Ref[Val]('int'),
+                parser.First(frozenset({int_id})),
+            ),
+            (
+                parser.Ref[Val]('unknown'),
+                parser.First(unknown=True),
+            ),
+            (
+                parser.Ref[Val]('int').zero_or_one(),
+                parser.First(frozenset({int_id}), nullable=True),
+            ),
+            (
+                parser.Ref[Val]('int').zero_or_more() & 'a',
+                parser.First(frozenset({int_id, a_id})),
+            ),
+            (
+                'a' & parser.Ref[Val]('int'),
+                parser.First(frozenset({a_id})),
+            ),
+            (
+                parser.Ref[Val]('int') | ('b' & parser.Ref[Val]('int')),
+                parser.First(frozenset({int_id, b_id})),
+            ),
+            (
+                parser.Ref[Val]('int').convert_type(lambda val: val),
+                parser.First(unknown=True),
+            ),
+            (
+                parser.Ref[Val]('int').with_scope(scope).convert_type(
+                    lambda val: val),
+                parser.First(frozenset({int_id})),
+            ),
+            (
+                Val.parser_(),
+                parser.First(frozenset(
+                    {int_id, tokens.rule_id('str'), tokens.rule_id('[')})),
+            ),
+        ]):
+            with self.subTest(rule=rule, expected=expected):
+                self.assertEqual(rule.first(scope), expected)
+
+    def test_dispatch(self):
+        calls: MutableSequence[str] = []
+
+        def load(rule_name: str) -> parser.SingleResultRule[Val]:
+            def load(token: tokens.Token) -> Val:
+                calls.append(rule_name)
+                return Str(token.val)
+            return parser.Literal[Val](lexer.Rule.load(rule_name), load)
+
+        parser_ = parser.Parser[Val]('s', parser.Scope[Val]({
+            's': load('a') | load('b') | ('c' & load('d')) | load('c').zero_or_one().single_or(Str('')),
+        }))
+        for state, expected in list[tuple[tokens.TokenStream, Optional[tuple[tokens.TokenStream, Val]]]]([
+            (toks('a'), (toks(), Str('a'))),
+            (toks('b'), (toks(), Str('b'))),
+            (toks('c', 'd'), (toks(), Str('d'))),
+            (toks('c'), (toks(), Str('c'))),
+            (toks('e'), (toks('e'), Str(''))),
+            (toks(), (toks(), Str(''))),
+        ]):
+            with self.subTest(state=state, expected=expected):
+                self.assertEqual(parser_(state), expected)
+        self.assertIsNone(getattr(parser_.scope['s'], 'dispatch'))
+        root = parser_._compiled['s']
+        assert isinstance(root, parser.Or)
+        assert root.dispatch is not None
+        for state, expected_indices in list[tuple[tokens.TokenStream, Sequence[int]]]([
+            (toks('a'), [0, 3]),
+            (toks('b'), [1, 3]),
+            (toks('c'), [2, 3]),
+            (toks('e'), [3]),
+            (toks(), [3]),
+        ]):
+            with self.subTest(state=state, expected_indices=expected_indices):
+                self.assertEqual(root.dispatch(state), expected_indices)
+        self.assertEqual(calls, ['a', 'b', 'd', 'c'])
+
+
+class OperatorTableTest(TestCase):
+    def test_call(self):
+        def infix(op: str, precedence: int, associativity: parser.Associativity = parser.Associativity.LEFT) -> parser.InfixOperator[str]:
+            return parser.InfixOperator[str](
+                lexer.Rule.load(op),
+                precedence,
+                lambda lhs, rhs: f'({lhs}{op}{rhs})',
+                associativity,
+            )
+
+        rule = parser.OperatorTable[str](
+            parser.Literal[str](lexer.Rule.load(
+                'id', '[a-z]+'), lambda token: token.val),
+            prefix=[
+                parser.PrefixOperator[str](
+                    lexer.Rule.load('-'), 3, lambda val: f'(-{val})'),
+            ],
+            infix=[
+                infix('+', 1),
+                infix('*', 2),
+                infix('^', 4, parser.Associativity.RIGHT),
+            ],
+            postfix=[
+                parser.PostfixOperator[str](
+                    lexer.Rule.load('!'), 5, lambda val: f'({val}!)'),
+            ],
+        )
+        for state, expected in list[tuple[tokens.TokenStream, Optional[tuple[tokens.TokenStream, str]]]]([
+            (toks(tok('id', 'a')), (toks(), 'a')),
+            (toks(tok('id', 'a'), tok('id', 'b')), (toks(tok('id', 'b')), 'a')),
+            (
+                toks(tok('id', 'a'), '+', tok('id', 'b'), '*', tok('id', 'c')),
+                (toks(), '(a+(b*c))'),
+            ),
+            (
+                toks(tok('id', 'a'), '*', tok('id', 'b'), '+', tok('id', 'c')),
+                (toks(), '((a*b)+c)'),
+            ),
+            (
+                toks(tok('id', 'a'), '+', tok('id', 'b'), '+', tok('id', 'c')),
+                (toks(), '((a+b)+c)'),
+            ),
+            (
+                toks(tok('id', 'a'), '^', tok('id', 'b'), '^', tok('id', 'c')),
+                (toks(), '(a^(b^c))'),
+            ),
+            (
+                toks('-', tok('id', 'a'), '+', tok('id', 'b')),
+                (toks(), '((-a)+b)'),
+            ),
+            (
+                toks('-', tok('id', 'a'), '^', tok('id', 'b')),
+                (toks(), '(-(a^b))'),
+            ),
+            (
+                toks(tok('id', 'a'), '!', '+', tok('id', 'b'), '!'),
+                (toks(), '((a!)+(b!))'),
+            ),
+            (toks(tok('id', 'a'), '+'), None),
+            (toks('+'), None),
+            (toks(), None),
+        ]):
+            with self.subTest(state=state, expected=expected):
+                if expected is None:
+                    with self.assertRaises(errors.Error):
+                        rule(state, parser.Scope[str]())
+                else:
+                    self.assertEqual(
+                        rule(state, parser.Scope[str]()), expected)
+        self.assertEqual(
+            rule.first(parser.Scope[str]()),
+            parser.First(frozenset(
+                {tokens.rule_id('id'), tokens.rule_id('-')})),
+        )
+        self.assertEqual(
+            rule.lexer_,
+            lexer.Lexer([
+                lexer.Rule.load('id', '[a-z]+'),
+                lexer.Rule.load('-'),
+                lexer.Rule.load('+'),
+                lexer.Rule.load('*'),
+                lexer.Rule.load('^'),
+                lexer.Rule.load('!'),
+            ]),
+        )
+
+
+class ErrorTest(TestCase):
+    def test_farthest(self):
+        for state, expected_state, expected_msg in list[tuple[tokens.TokenStream, tokens.TokenStream, str]]([
+            (
+                toks(),
+                toks(),
+                "expected one of [, int, str got end of stream",
+            ),
+            (
+                toks('[', tok('int', '1'), ',', ']'),
+                toks(']'),
+                "expected one of [, int, str got ']' at (0,0)",
+            ),
+            (
+                toks('[', tok('int', '1'), tok('int', '2')),
+                toks(tok('int', '2')),
+                "expected one of ,, ] got int('2') at (0,0)",
+            ),
+        ]):
+            with self.subTest(state=state, expected_state=expected_state, expected_msg=expected_msg):
+                with self.assertRaises(parser.ParseError) as context:
+                    Val.parser_()(state)
+                self.assertEqual(context.exception.rule_name, 'Val')
+                self.assertEqual(context.exception.state, expected_state)
+                self.assertEqual(context.exception.msg, expected_msg)
+                self.assertEqual(context.exception.children, [])
+
+    def test_custom(self):
+        for rule, state, expected_msg in list[tuple[parser.SingleResultRule[Val], tokens.TokenStream, str]]([
+            (
+                _Pop('a', 'b') | _Pop('c'),
+                toks('a'),
+                "expected one of b got end of stream",
+            ),
+            (
+                _Pop('a', 'b') | _Pop('c'),
+                toks('x'),
+                "expected one of a, c got 'x' at (0,0)",
+            ),
+            (
+                _Pop() & 'a',
+                toks('x'),
+                "expected one of a got 'x' at (0,0)",
+            ),
+        ]):
+            with self.subTest(rule=rule, state=state, expected_msg=expected_msg):
+                with self.assertRaises(parser.ParseError) as context:
+                    parser.Parser[Val]('s', parser.Scope[Val]({'s': rule}))(state)
+                self.assertEqual(context.exception.msg, expected_msg)
+
+    def test_rule(self):
+        def literal(val: str) -> parser.Literal[str]:
+            return parser.Literal[str](lexer.Rule.load(val), lambda token: token.val)
+
+        a, b = literal('a'), literal('b')
+        for rule, state, expected_state, expected_msg in list[tuple[parser.Rule[str], tokens.TokenStream, tokens.TokenStream, str]]([
+            (
+                (a | b) & 'c',
+                toks('a', 'a'),
+                toks('a'),
+                "expected one of c got 'a' at (0,0)",
+            ),
+            (
+                a | b,
+                toks('c'),
+                toks('c'),
+                "expected one of a, b got 'c' at (0,0)",
+            ),
+            (
+                (a & 'b').single() | (a & 'c').single(),
+                toks('a', 'a'),
+                toks('a'),
+                "expected one of b, c got 'a' at (0,0)",
+            ),
+        ]):
+            with self.subTest(rule=rule, state=state):
+                with self.assertRaises(parser.ParseError) as context:
+                    rule(state, parser.Scope[str]())
+                self.assertEqual(context.exception.rule_name, str(rule))
+                self.assertEqual(context.exception.state, expected_state)
+                self.assertEqual(context.exception.msg, expected_msg)
+
+    def test_debug(self):
+        with parser.debug():
+            with self.assertRaises(parser.ParseError) as context:
+                Val.parser_()(toks('[', tok('int', '1'), ',', ']'))
+        self.assertEqual(context.exception.state, toks(
+            '[', tok('int', '1'), ',', ']'))
+        self.assertIsInstance(context.exception.children[0], parser.RuleError)
+
+
+class _Pop(parser.SingleResultRule[Val]):
+    def __init__(self, *rule_names: str):
+        self.rule_names = rule_names
+
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Val]) -> parser.StateAndSingleResult[Val]:
+        for rule_name in self.rule_names:
+            state, _ = state.pop(rule_name)
+        return state, Str(' '.join(self.rule_names))
+
+    @property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer()
+
+
+class _Gate(parser.NoResultRule[Val]):
+    def __init__(self, barrier: threading.Barrier):
+        self.barrier = barrier
+
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Val]) -> tokens.TokenStream:
+        self.barrier.wait(timeout=10)
+        return state
+
+    @property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer()
+
+
+def _gated_parser(barrier: threading.Barrier) -> parser.Parser[Val]:
+    int_ = Int._parse_rule()
+    return parser.Parser[Val](
+        's',
+        parser.Scope[Val]({
+            's': (
+                (int_ & '+' & _Gate(barrier) & ';') |
+                (int_ & '-' & _Gate(barrier) & ',')
+            ),
+        }),
+    )
+
+
+class ContextTest(TestCase):
+    def test_threads(self):
+        inputs = [
+            toks(tok('int', '1'), '+', tok('int', '2')),
+            toks(tok('int', '1'), '-', tok('int', '2')),
+        ]
+        expected: MutableSequence[str] = []
+        for state in inputs:
+            with self.assertRaises(parser.ParseError) as context:
+                _gated_parser(threading.Barrier(1))(state)
+            expected.append(context.exception.msg)
+        parser_ = _gated_parser(threading.Barrier(len(inputs)))
+        actual: MutableSequence[Optional[str]] = [None] * len(inputs)
+
+        def parse(index: int) -> None:
+            try:
+                parser_(inputs[index])
+            except parser.ParseError as error:
+                actual[index] = error.msg
+
+        threads = [threading.Thread(target=parse, args=(index,))
+                   for index in range(len(inputs))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(actual, expected)
+
+
+def _left_recursive_scopes() -> Sequence[parser.Scope[Val]]:
+    int_ = parser.Literal[Val](
+        lexer.Rule.load('int', '\\d+'),
+        lambda token: Int(int(token.val)),
+    )
+    return [
+        parser.Scope[Val]({
+            'e': (parser.Ref[Val]('e') & '+' & parser.Ref[Val]('int')).convert(List) | parser.Ref[Val]('int'),
+            'int': int_,
+        }),
+        parser.Scope[Val]({
+            'e': (parser.Ref[Val]('s') & '+' & parser.Ref[Val]('int')).convert(List) | parser.Ref[Val]('int'),
+            's': parser.Ref[Val]('e'),
+            'int': int_,
+        }),
+    ]
+
+
+class IterativeTest(TestCase):
+    def test_deep(self):
+        depth = sys.getrecursionlimit() * 2
+        input = '[' * depth + ']' * depth
+        state, result = Val.parser_()(input)
+        self.assertEqual(state, tokens.TokenStream())
+        for _ in range(depth - 1):
+            assert isinstance(result, List)
+            self.assertEqual(len(result.vals), 1)
+            result = result.vals[0]
+        self.assertEqual(result, List([]))
+
+    def test_left_recursion(self):
+        # Parsers reject left recursion when they're compiled, so run the rules directly.
+        for scope in _left_recursive_scopes():
+            with self.subTest(scope=scope):
+                with self.assertRaises(parser.RuleError) as context:
+                    scope['e'](toks(tok('int', '1'), '+', tok('int', '2')), scope)
+                self.assertIn('left recursion in rule', context.exception.msg)
+
+
+class ProfileTest(TestCase):
+    def test_profile(self):
+        x = parser.Literal[str](lexer.Rule.load('x'), lambda token: token.val)
+        parser_ = parser.Parser[str](
+            'a',
+            parser.Scope[str]({
+                'a': parser.Or[str]([parser.Ref[str]('b'), parser.Ref[str]('c')]),
+                'b': (x & 'y').single(),
+                'c': x,
+            }),
+        )
+        with parser.profile() as profile:
+            self.assertEqual(parser_('x'), (tokens.TokenStream(), 'x'))
+        for name, calls, successes, failures, tokens_, backtracks in list[tuple[str, int, int, int, int, int]]([
+            ('Or', 1, 1, 0, 1, 1),
+            ('b', 1, 0, 1, 0, 0),
+            ('c', 1, 1, 0, 1, 0),
+            ('Literal', 2, 2, 0, 2, 0),
+        ]):
+            with self.subTest(name=name):
+                rule_profile = profile.rules[name]
+                self.assertEqual(
+                    (rule_profile.calls, rule_profile.successes, rule_profile.failures,
+                     rule_profile.tokens, rule_profile.backtracks),
+                    (calls, successes, failures, tokens_, backtracks),
+                )
+                self.assertLessEqual(
+                    rule_profile.exclusive, rule_profile.inclusive)
+        self.assertIn(('Parser(a)', 'Or', 'c', 'Literal'), profile.stacks)
+        self.assertIn('\nb ', profile.report())
+        for line in profile.collapsed().splitlines():
+            with self.subTest(line=line):
+                path, time = line.rsplit(' ', 1)
+                self.assertIn(tuple(path.split(';')), profile.stacks)
+                self.assertTrue(time.isdigit())
+
+    def test_recursion(self):
+        with parser.profile() as profile:
+            Val.parser_()('[[1]]')
+        list_ = profile.rules['List']
+        self.assertEqual(list_.calls, 2)
+        self.assertLessEqual(list_.exclusive, list_.inclusive)
+
+
+class CutTest(TestCase):
+    def test_cut(self):
+        def load(token: tokens.Token) -> Val:
+            return Int(int(token.val))
+
+        int_ = parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load)
+        for cut, state, expected in list[tuple[bool, tokens.TokenStream, Optional[parser.StateAndSingleResult[Val]]]]([
+            (False, toks('a', tok('int', '1'), 'b'), (tokens.TokenStream(), Int(1))),
+            (False, toks('a', tok('int', '1'), 'c'), (tokens.TokenStream(), Int(1))),
+            (True, toks('a', tok('int', '1'), 'b'), (tokens.TokenStream(), Int(1))),
+            (True, toks('a', tok('int', '1'), 'c'), None),
+            (True, toks('c', 'a'), (tokens.TokenStream(), Int(0))),
+        ]):
+            alternative = (
+                'a' & parser.Cut[Val]() & int_ & 'b'
+                if cut else 'a' & int_ & 'b'
+            )
+            parser_ = parser.Parser[Val](
+                's',
+                parser.Scope[Val]({
+                    's': (
+                        alternative |
+                        ('a' & int_ & 'c') |
+                        (
+                            'c' &
+                            ('a' & parser.Cut[Val]() & int_).zero_or_one() &
+                            'a'
+                        ).single_or(Int(0))
+                    ),
+                }),
+            )
+            with self.subTest(cut=cut, state=state, expected=expected):
+                if expected is None:
+                    with self.assertRaises(parser.ParseError):
+                        parser_(state)
+                else:
+                    self.assertEqual(parser_(state), expected)
+
+    def test_release(self):
+        for cut, expected_calls in list[tuple[bool, int]]([
+            (False, 1),
+            (True, 2),
+        ]):
+            with self.subTest(cut=cut, expected_calls=expected_calls):
+                calls: MutableSequence[tokens.Token] = []
+
+                def load(token: tokens.Token) -> Val:
+                    calls.append(token)
+                    return Int(int(token.val))
+
+                a = parser.Ref[Val]('a')
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+                        'inner': (
+                            (a & parser.Cut[Val]() & 'x' if cut else a & 'x') |
+                            (a & 'z')
+                        ),
+                        's': parser.Ref[Val]('inner') | (a & 'y'),
+                    }),
+                ).with_packrat()
+                self.assertEqual(
+                    parser_(toks(tok('int', '1'), 'y')),
+                    (tokens.TokenStream(), Int(1)),
+                )
+                self.assertEqual(len(calls), expected_calls)
+
+    def test_release_bounded(self):
+        sizes: MutableSequence[int] = []
+
+        class Probe(parser.NoResultRule[Val]):
+            def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Val]) -> tokens.TokenStream:
+                memo = parser._context.get().memo
+                assert memo is not None
+                sizes.append(len(memo))
+                return state
+
+            @property
+            def lexer_(self) -> lexer.Lexer:
+                return lexer.Lexer()
+
+        a = parser.Ref[Val]('a')
+        parser_ = parser.Parser[Val](
+            's',
+            parser.Scope[Val]({
+                'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), lambda token: Int(int(token.val))),
+                'stmt': (a & Probe() & parser.Cut[Val]() & ';') | (a & 'x'),
+                's': parser.Ref[Val]('stmt').one_or_more().convert(List),
+            }),
+        ).with_packrat()
+        for count in [1, 10, 100]:
+            with self.subTest(count=count):
+                sizes.clear()
+                parser_(toks(*[token for _ in range(count) for token in (tok('int', '1'), ';')]))
+                self.assertEqual(len(sizes), count)
+                self.assertLessEqual(max(sizes), 4)
+
+
+class AnalyzeTest(TestCase):
+    def test_analyze(self):
+        def load(token: tokens.Token) -> Val:
+            return Int(int(token.val))
+
+        parser_ = parser.Parser[Val](
+            's',
+            parser.Scope[Val]({
+                's': parser.Ref[Val]('e') | parser.Ref[Val]('list'),
+                'e': (
+                    (parser.Ref[Val]('e') & '+' & parser.Ref[Val]('int')).convert(List) |
+                    parser.Ref[Val]('int')
+                ),
+                'int': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+                'list': ('[' & parser.Ref[Val]('opt').until_token(']') & ']').convert(List),
+                'opt': parser.Ref[Val]('int').zero_or_one().single_or(Int(0)),
+                'dead': parser.Ref[Val]('missing'),
+            }),
+        )
+        analysis = parser_.analyze()
+        self.assertEqual(
+            analysis,
+            parser.Analysis(
+                nullable=frozenset({'opt'}),
+                left_recursive=frozenset({'e'}),
+                unreachable=frozenset({'dead'}),
+                unresolved=frozenset({'missing'}),
+                nullable_loops=["(opt!']')"],
+            ),
+        )
+        self.assertFalse(analysis.ok)
+        self.assertIn('left recursive: e', analysis.report())
+
+    def test_left_recursive(self):
+        for scope, expected in zip(_left_recursive_scopes(), ['e', 'e, s']):
+            for parser_ in list[parser.Parser[Val]]([
+                parser.Parser[Val]('e', scope),
+                parser.Parser[Val]('e', scope).with_packrat(),
+            ]):
+                with self.subTest(parser_=parser_):
+                    with self.assertRaises(errors.Error) as context:
+                        parser_('1+2')
+                    self.assertIn(f'left recursive rules {expected} in ', context.exception.msg)
+
+    def test_nullable(self):
+        def load(token: tokens.Token) -> Val:
+            return Int(int(token.val))
+
+        int_ = parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load)
+        parser_ = parser.Parser[Val](
+            'a',
+            parser.Scope[Val]({
+                'a': (parser.Ref[Val]('missing').zero_or_one() & 'y').single_or(Int(0)),
+                'b': (parser.Ref[Val]('missing').zero_or_one() & int_.zero_or_one()).convert(List),
+                'c': (parser.Ref[Val]('c') & int_).convert(List) | int_,
+            }),
+        )
+        self.assertEqual(parser_.analyze().nullable, frozenset({'b'}))
+        self.assertEqual(parser_.analyze().left_recursive, frozenset({'c'}))
+
+    def test_analyze_ok(self):
+        for parser_ in list[parser.Parser[Any]]([Val.parser_(), Expr.parser_()]):
+            with self.subTest(parser_=parser_):
+                self.assertTrue(parser_.analyze().ok)
+
+    def test_no_progress(self):
+        opt = parser.Literal[Val](
+            lexer.Rule.load('int', '\\d+'),
+            lambda token: Int(int(token.val)),
+        ).zero_or_one().single_or(Int(0))
+        for rule, state, expected in list[tuple[parser.MultipleResultRule[Val], tokens.TokenStream, Optional[parser.StateAndMultipleResult[Val]]]]([
+            (opt.zero_or_more(), toks(tok('int', '1'), 'x'), (toks('x'), [Int(1)])),
+            (opt.one_or_more(), toks('x'), (toks('x'), [Int(0)])),
+            (opt.until_token('x'), toks(tok('int', '1'), 'x'), (toks('x'), [Int(1)])),
+            (opt.until_token('x'), toks(tok('int', '1'), 'y'), None),
+            (opt.until_empty(), toks('y'), None),
+        ]):
+            with self.subTest(rule=rule, state=state, expected=expected):
+                parser_ = parser.Parser[Val](
+                    's', parser.Scope[Val]({'s': rule.convert(List)}))
+                if expected is None:
+                    with self.assertRaises(parser.ParseError):
+                        parser_(state)
+                else:
+                    expected_state, expected_results = expected
+                    self.assertEqual(
+                        parser_(state), (expected_state, List(expected_results)))
+
+
+class ContextualTest(TestCase):
+    def test_follows(self):
+        contextual_lexer = Val.parser_().contextual_lexer
+        int_, str_, lbracket, rbracket, comma = map(
+            tokens.rule_id, ['int', 'str', '[', ']', ','])
+        self.assertEqual(contextual_lexer.start,
+                         frozenset({int_, str_, lbracket}))
+        for rule_id, expected in list[tuple[int, frozenset[int]]]([
+            (int_, frozenset({comma, rbracket})),
+            (lbracket, frozenset({int_, str_, lbracket, rbracket})),
+            (comma, frozenset({int_, str_, lbracket})),
+            (rbracket, frozenset({comma, rbracket})),
+        ]):
+            with self.subTest(rule_id=rule_id):
+                self.assertEqual(contextual_lexer.follows[rule_id], expected)
+
+    def test_call(self):
+        for parser_, input in list[tuple[parser.Parser[Any], str]]([
+            (Val.parser_(), '1'),
+            (Val.parser_(), '[1,"a",[]]'),
+            (Val.parser_(), '[1,]'),
+            (Val.parser_(), '$'),
+            (Expr.parser_(), 'f(1, [2])'),
+        ]):
+            with self.subTest(parser_=parser_, input=input):
+                contextual = parser_.with_contextual()
+                try:
+                    expected = parser_(input)
+                except errors.Error:
+                    with self.assertRaises(errors.Error):
+                        contextual(input)
+                else:
+                    self.assertEqual(contextual(input), expected)
+
+    def test_conflict(self):
+        parser_ = parser.Parser[str](
+            'assign',
+            parser.Scope[str]({
+                'assign': (
+                    parser.Literal[str](lexer.Rule.load('name', '[a-z]+'), lambda token: token.val) &
+                    '=' &
+                    parser.Literal[str](lexer.Rule.load('val', '(\\d|[a-z])+'), lambda token: token.val)
+                ).convert('='.join).with_lexer(lexer.Lexer.whitespace()),
+            }),
+        )
+        for input, expected, contextual_expected in list[tuple[str, Optional[str], Optional[str]]]([
+            ('a = 1b', 'a=1b', 'a=1b'),
+            ('a = b', None, 'a=b'),
+            ('a b', None, None),
+            ('1 = b', None, None),
+        ]):
+            for parser__, expected_ in [
+                (parser_, expected),
+                (parser_.with_contextual(), contextual_expected),
+            ]:
+                with self.subTest(input=input, contextual=parser__.contextual):
+                    if expected_ is None:
+                        with self.assertRaises(errors.Error):
+                            parser__(input)
+                    else:
+                        self.assertEqual(
+                            parser__(input), (tokens.TokenStream(), expected_))
+
+    def test_attempts(self):
+        parser_ = Val.parser_()
+        attempts: MutableSequence[int] = []
+        for lexer_ in [parser_.lexer_, parser_.contextual_lexer]:
+            with lexer.instrument() as stats:
+                lexer_('["a",1,["b",2]]')
+            attempts.append(sum(
+                rule_stats.attempts for rule_stats in stats.rules.values()))
+        self.assertLess(attempts[1], attempts[0])
+
+
+class FactorTest(TestCase):
+    def test_factor(self):
+        for state, expected, expected_calls in list[tuple[tokens.TokenStream, Optional[parser.StateAndSingleResult[Val]], int]]([
+            (toks(tok('int', '1'), 'x'), (tokens.TokenStream(), Int(1)), 1),
+            (toks(tok('int', '1'), 'y'), (tokens.TokenStream(), List([Int(1)])), 1),
+            (toks(tok('int', '1'), 'z', 'w'), None, 1),
+            (toks(tok('int', '1'), 'z', 'v'), (tokens.TokenStream(), Int(1)), 1),
+            (toks(tok('int', '1'), 'w'), (toks('w'), Int(1)), 2),
+            (toks('w'), None, 0),
+        ]):
+            with self.subTest(state=state, expected=expected):
+                calls: MutableSequence[tokens.Token] = []
+
+                def load(token: tokens.Token) -> Val:
+                    calls.append(token)
+                    return Int(int(token.val))
+
+                a = parser.Ref[Val]('a')
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'a': parser.Literal[Val](lexer.Rule.load('int', '\\d+'), load),
+                        's': (
+                            (a & 'x') |
+                            (a & 'y').convert(lambda val: List([val])) |
+                            (a & 'z' & parser.Cut[Val]() & 'v') |
+                            (parser.Ref[Val]('a') & 'z') |
+                            a
+                        ),
+                    }),
+                )
+                if expected is None:
+                    with self.assertRaises(parser.ParseError):
+                        parser_(state)
+                else:
+                    self.assertEqual(parser_(state), expected)
+                self.assertEqual(len(calls), expected_calls)
+
+    def test_shared(self):
+        def load(token: tokens.Token) -> Val:
+            return Str(token.val)
+
+        a = parser.Ref[Val]('a')
+        rule = (a & 'x') | (a & 'y') | parser.Ref[Val]('b')
+        children = list(rule.children)
+        for a_rule, b_rule, input, expected in list[tuple[str, str, str, Val]]([
+            ('x', 'y', 'xx', Str('x')),
+            ('y', 'x', 'x', Str('x')),
+        ]):
+            with self.subTest(a_rule=a_rule, b_rule=b_rule, input=input):
+                parser_ = parser.Parser[Val](
+                    's',
+                    parser.Scope[Val]({
+                        'a': parser.Literal[Val](lexer.Rule.load(a_rule), load),
+                        'b': parser.Literal[Val](lexer.Rule.load(b_rule), load),
+                        's': rule,
+                    }),
+                )
+                self.assertEqual(parser_(input), (tokens.TokenStream(), expected))
+                self.assertEqual(rule.children, children)
+                self.assertIsNone(rule.dispatch)
+
+
+class ChoicesTest(TestCase):
+    def test_choices(self):
+        def literal(val: str) -> parser.Literal[str]:
+            return parser.Literal[str](lexer.Rule.load(val), lambda token: token.val)
+
+        for other, attempts, expected in list[tuple[Mapping[str, parser.SingleResultRule[str]], Sequence[int], Sequence[int]]]([
+            ({'x': literal('b'), 'y': literal('c'), 'z': literal('a')}, [3, 3, 2], [2, 1, 0]),
+            ({'x': literal('a'), 'y': (literal('a') & 'b').single(), 'z': literal('c')}, [3, 3, 2], [0, 2, 1]),
+            ({}, [0, 1, 2], [0, 1, 2]),
+        ]):
+            def load() -> tuple[parser.Or[str], parser.Parser[str]]:
+                rule = parser.Or[str]([parser.Ref[str]('x'), parser.Ref[str]('y'), parser.Ref[str]('z')])
+                rules: dict[str, parser.SingleResultRule[str]] = {
+                    's': rule, 'x': literal('a'), 'y': literal('b'), 'z': literal('c')}
+                if other:
+                    # The same rule reached from another scope.
+                    rules['w'] = rule.with_scope(parser.Scope[str](other))
+                return rule, parser.Parser[str]('s', parser.Scope[str](rules))
+
+            with self.subTest(other=other):
+                rule, parser_ = load()
+                with parser.choices() as choices:
+                    for input in ['c', 'b', 'c']:
+                        self.assertEqual(parser_(input), (tokens.TokenStream(), input))
+                # Only an Or whose dispatch fell back to trying every alternative is recorded.
+                self.assertEqual(choices.attempts, {'s': attempts} if other else {})
+                self.assertEqual(choices.successes, {'s': [0, 1, 2]} if other else {})
+                parser_ = choices.apply(parser_)
+                compiled = parser_._compiled['s']
+                assert isinstance(compiled, parser.Or) and compiled.dispatch is not None
+                self.assertEqual(compiled.dispatch.default, expected if other else [])
+                self.assertIsNone(rule.dispatch)
+                with parser.profile() as profile:
+                    self.assertEqual(parser_('c'), (tokens.TokenStream(), 'c'))
+                self.assertEqual('x' in profile.rules, bool(other) and expected[0] == 0)
+                _, replayed_parser = load()
+                with tempfile.TemporaryDirectory() as directory:
+                    filename = os.path.join(directory, 'choices.json')
+                    choices.save(filename)
+                    loaded = parser.Choices.load(filename)
+                self.assertEqual(loaded, choices)
+                replayed = loaded.apply(replayed_parser)._compiled['s']
+                assert isinstance(replayed, parser.Or)
+                self.assertEqual(replayed.dispatch, compiled.dispatch)
+
+    def test_rates(self):
+        def literal(val: str) -> parser.Literal[str]:
+            return parser.Literal[str](lexer.Rule.load(val), lambda token: token.val)
+
+        rule = parser.Or[str]([parser.Ref[str]('x'), parser.Ref[str]('y'), parser.Ref[str]('z')])
+        parser_ = parser.Parser[str]('s', parser.Scope[str]({
+            's': rule,
+            'w': rule.with_scope(parser.Scope[str]({'x': literal('b'), 'y': literal('c'), 'z': literal('a')})),
+            'x': literal('a'),
+            'y': literal('b'),
+            'z': literal('c'),
+        }))
+        for attempts, successes, expected in list[tuple[Sequence[int], Sequence[int], Sequence[int]]]([
+            ([10, 2, 0], [5, 2, 0], [1, 0, 2]),
+            ([10, 10, 10], [1, 3, 2], [1, 2, 0]),
+            ([0, 0, 0], [0, 0, 0], [0, 1, 2]),
+        ]):
+            with self.subTest(attempts=attempts, successes=successes):
+                choices = parser.Choices({'s': list(attempts)}, {'s': list(successes)})
+                compiled = choices.apply(parser_)._compiled['s']
+                assert isinstance(compiled, parser.Or) and compiled.dispatch is not None
+                self.assertEqual(compiled.dispatch.default, expected)
+
+    def test_paths(self):
+        def literal(val: str) -> parser.Literal[str]:
+            return parser.Literal[str](lexer.Rule.load(val), lambda token: token.val)
+
+        def ab() -> parser.Or[str]:
+            return parser.Or[str]([parser.Ref[str]('x'), parser.Ref[str]('y')])
+
+        t, u = ab(), ab()
+        parser_ = parser.Parser[str](
+            's',
+            parser.Scope[str]({
+                's': parser.Ref[str]('t') | parser.Ref[str]('u'),
+                't': '(' & t & ')',
+                'u': u,
+                # Disagrees with the parser's scope on dispatching t and u.
+                'v': (t & u).with_scope(parser.Scope[str]({'x': literal('b'), 'y': literal('a')})),
+                'x': literal('a'),
+                'y': literal('b'),
+            }),
+        )
+        with parser.choices() as choices:
+            for input in ['(a)', '(b)', 'b']:
+                self.assertEqual(parser_(input), (tokens.TokenStream(), input.strip('()')))
+        self.assertEqual(choices.attempts, {
+            't.1': [2, 1],
+            'u': [1, 1],
+        })
+        self.assertEqual(choices.successes, {
+            't.1': [1, 1],
+            'u': [0, 1],
+        })
@@ -1,5 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+from functools import cache, cached_property
 import string
 from typing import Callable, Iterable, Iterator, MutableSequence, Sequence, Sized, Type
 from . import chars, errors, tokens
@@ -38,8 +39,8 @@ class Result(Sized, Iterable[chars.Char]):
     def val(self) -> str:
         return ''.join([char.val for char in self.chars_])
 
-    def token(self, rule_name: str) -> tokens.Token:
-        return tokens.Token(rule_name, self.val(), self.position())
+    def token(self, rule_name: str, rule_id: int = -1) -> tokens.Token:
+        return tokens.Token(rule_name, self.val(), self.position(), rule_id)
 
 
 StateAndResult = tuple[chars.CharStream, Result]
@@ -50,6 +51,13 @@ class Regex(ABC):
     def __call__(self, state: chars.CharStream) -> StateAndResult:
         ...
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        try:
+            state, _ = self(chars.CharStream(chars_[index:]))
+        except errors.Error:
+            return -1
+        return len(chars_) - len(state)
+
 
 @dataclass(frozen=True)
 class Any(Regex):
@@ -59,6 +67,9 @@ class Any(Regex):
     def __call__(self, state: chars.CharStream) -> StateAndResult:
         return state.tail(), Result([state.head()])
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        return index + 1 if index < len(chars_) else -1
+
 
 @dataclass(frozen=True)
 class Literal(Regex):
@@ -77,6 +88,9 @@ class Literal(Regex):
                              msg=f'expected regex literal {self.val} got {state.head()}')
         return state.tail(), Result([state.head()])
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        return index + 1 if index < len(chars_) and chars_[index].val == self.val else -1
+
 
 def literal(val: str) -> Regex:
     if len(val) == 1:
@@ -101,6 +115,9 @@ class Range(Regex):
             raise RegexError(regex=self, state=state)
         return state.tail(), Result([state.head()])
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        return index + 1 if index < len(chars_) and self.start <= chars_[index].val <= self.end else -1
+
 
 @dataclass(frozen=True)
 class _NaryRegex(Regex):
@@ -122,6 +139,13 @@ class And(_NaryRegex):
                 raise RegexError(regex=self, state=state, children=[error])
         return state, result
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        for child in self.children:
+            index = child.advance(chars_, index)
+            if index < 0:
+                return -1
+        return index
+
 
 @dataclass(frozen=True)
 class Or(_NaryRegex):
@@ -137,6 +161,13 @@ class Or(_NaryRegex):
                 child_errors.append(error)
         raise RegexError(regex=self, state=state, children=child_errors)
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        for child in self.children:
+            child_index = child.advance(chars_, index)
+            if child_index >= 0:
+                return child_index
+        return -1
+
 
 @dataclass(frozen=True)
 class _UnaryRegex(Regex):
@@ -157,6 +188,11 @@ class ZeroOrMore(_UnaryRegex):
             except errors.Error:
                 return state, result
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        while (child_index := self.child.advance(chars_, index)) >= 0:
+            index = child_index
+        return index
+
 
 @dataclass(frozen=True)
 class OneOrMore(_UnaryRegex):
@@ -175,6 +211,14 @@ class OneOrMore(_UnaryRegex):
             except errors.Error:
                 return state, result
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        index = self.child.advance(chars_, index)
+        if index < 0:
+            return -1
+        while (child_index := self.child.advance(chars_, index)) >= 0:
+            index = child_index
+        return index
+
 
 @dataclass(frozen=True)
 class ZeroOrOne(_UnaryRegex):
@@ -187,6 +231,10 @@ class ZeroOrOne(_UnaryRegex):
         except errors.Error:
             return state, Result()
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        child_index = self.child.advance(chars_, index)
+        return child_index if child_index >= 0 else index
+
 
 @dataclass(frozen=True)
 class UntilEmpty(_UnaryRegex):
@@ -203,6 +251,13 @@ class UntilEmpty(_UnaryRegex):
                 raise RegexError(regex=self, state=state, children=[error])
         return state, result
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        while index < len(chars_):
+            index = self.child.advance(chars_, index)
+            if index < 0:
+                return -1
+        return index
+
 
 @dataclass(frozen=True)
 class Not(_UnaryRegex):
@@ -216,6 +271,11 @@ class Not(_UnaryRegex):
             return state.tail(), Result([state.head()])
         raise RegexError(regex=self, state=state)
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        if index < len(chars_) and self.child.advance(chars_, index) < 0:
+            return index + 1
+        return -1
+
 
 @dataclass(frozen=True)
 class Skip(_UnaryRegex):
@@ -229,6 +289,9 @@ class Skip(_UnaryRegex):
         except errors.Error as error:
             raise RegexError(regex=self, state=state, children=[error])
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        return self.child.advance(chars_, index)
+
 
 @dataclass(frozen=True)
 class Whitespace(Regex):
@@ -238,7 +301,11 @@ class Whitespace(Regex):
     def __call__(self, state: chars.CharStream) -> StateAndResult:
         return Or([literal(c) for c in string.whitespace])(state)
 
+    def advance(self, chars_: Sequence[chars.Char], index: int) -> int:
+        return index + 1 if index < len(chars_) and chars_[index].val in string.whitespace else -1
+
 
+@cache
 def load(input: str) -> Regex:
     from . import lexer as lexer_lib, parser
 
@@ -269,7 +336,7 @@ def load(input: str) -> Regex:
             state, _ = state.pop(']')
             return state, Range(start_token.val, end_token.val)
 
-        @property
+        @cached_property
         def lexer_(self) -> lexer_lib.Lexer:
             return lexer_lib.Lexer.literal('[', '-', ']') | literal_lex_rule
 
@@ -283,7 +350,7 @@ def load(input: str) -> Regex:
                 return state, Range('0', '9')
             return state, literal(token.val)
 
-        @property
+        @cached_property
         def lexer_(self) -> lexer_lib.Lexer:
             return lexer_lib.Lexer.literal('\\')
 
@@ -532,6 +532,31 @@ class RegexTest(TestCase):
                 else:
                     self.assertEqual(regex_(state), expected)
 
+    def test_advance(self):
+        for regex_, inputs in list[tuple[regex.Regex, list[str]]]([
+            (regex.Any(), ['', 'a']),
+            (regex.Literal('a'), ['', 'a', 'b']),
+            (regex.Range('a', 'c'), ['', 'b', 'd']),
+            (regex.literal('ab'), ['', 'a', 'ab', 'abc', 'b']),
+            (regex.Or([regex.literal('ab'), regex.Literal('a')]), ['a', 'ab', 'b']),
+            (regex.ZeroOrMore(regex.Literal('a')), ['', 'aab']),
+            (regex.OneOrMore(regex.Literal('a')), ['', 'b', 'aab']),
+            (regex.ZeroOrOne(regex.Literal('a')), ['', 'aa']),
+            (regex.UntilEmpty(regex.Literal('a')), ['', 'aa', 'ab']),
+            (regex.Not(regex.Literal('a')), ['', 'a', 'b']),
+            (regex.Skip(regex.literal('ab')), ['ab', 'ac']),
+            (regex.Whitespace(), ['', ' ', '\n', 'a']),
+            (regex.load('~(\\w+)'), [' \n a', 'a']),
+        ]):
+            for input in inputs:
+                with self.subTest(regex_=regex_, input=input):
+                    state = chars.CharStream.load(input)
+                    try:
+                        expected = len(state) - len(regex_(state)[0])
+                    except errors.Error:
+                        expected = -1
+                    self.assertEqual(regex_.advance(state.chars, 0), expected)
+
     def test_loadliteral(self):
         for val, expected in list[tuple[str, regex.Regex]]([
             (
@@ -648,3 +673,19 @@ class RegexTest(TestCase):
                         regex.load(input)
                 else:
                     self.assertEqual(regex.load(input), expected)
+
+    def test_load_error(self):
+        for input, expected_msg in list[tuple[str, str]]([
+            (
+                '[a-b',
+                'expected one of ] got end of stream',
+            ),
+            (
+                '[a-',
+                'expected one of literal got end of stream',
+            ),
+        ]):
+            with self.subTest(input=input, expected_msg=expected_msg):
+                with self.assertRaises(errors.Error) as context:
+                    regex.load(input)
+                self.assertEqual(context.exception.msg, expected_msg)
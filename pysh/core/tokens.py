@@ -1,13 +1,35 @@
 from dataclasses import dataclass, field
-from typing import Iterable, Iterator, Optional, Sequence, Sized
+from itertools import islice
+from typing import Any, Iterable, Iterator, Optional, Sequence, Sized, overload
 from . import chars, errors
 
+_rule_ids: dict[str, int] = {}
+_rule_names: list[str] = []
 
-@dataclass(frozen=True)
+
+def rule_id(rule_name: str) -> int:
+    try:
+        return _rule_ids[rule_name]
+    except KeyError:
+        _rule_ids[rule_name] = len(_rule_names)
+        _rule_names.append(rule_name)
+        return _rule_ids[rule_name]
+
+
+def rule_name(rule_id: int) -> str:
+    return _rule_names[rule_id]
+
+
+@dataclass(frozen=True, slots=True)
 class Token:
     rule_name: str
     val: str
     position: chars.Position = field(default_factory=chars.Position)
+    rule_id: int = field(default=-1, compare=False, repr=False)
+
+    def __post_init__(self):
+        if self.rule_id < 0:
+            object.__setattr__(self, 'rule_id', rule_id(self.rule_name))
 
     def __str__(self) -> str:
         if self.rule_name == self.val:
@@ -24,6 +46,56 @@ class Token:
         return Token(rule_name, ''.join(char.val for char in val), val[0].position)
 
 
+class _Slice(Sequence[Token]):
+    # A suffix of a token list that is shared rather than copied. The list must not change.
+    __slots__ = ('tokens', 'start')
+
+    def __init__(self, tokens: Sequence[Token], start: int):
+        self.tokens = tokens
+        self.start = start
+
+    def __len__(self) -> int:
+        return len(self.tokens) - self.start
+
+    def __iter__(self) -> Iterator[Token]:
+        return islice(self.tokens, self.start, None)
+
+    @overload
+    def __getitem__(self, index: int) -> Token:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[Token]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> Token | Sequence[Token]:
+        if isinstance(index, slice):
+            if index.stop is None and index.step is None and (index.start or 0) >= 0:
+                return _suffix(self, min(index.start or 0, len(self)))
+            return list(self)[index]
+        if index < 0:
+            if -index > len(self):
+                raise IndexError(index)
+            return self.tokens[index]
+        return self.tokens[self.start + index]
+
+    def __eq__(self, rhs: Any) -> bool:
+        if not isinstance(rhs, Sequence):
+            return NotImplemented
+        return len(self) == len(rhs) and all(a == b for a, b in zip(self, rhs))
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+
+def _suffix(tokens: Sequence[Token], start: int) -> _Slice:
+    if isinstance(tokens, _Slice):
+        return _Slice(tokens.tokens, tokens.start + start)
+    return _Slice(tokens, start)
+
+
 @dataclass(frozen=True)
 class TokenStream(Sized, Iterable[Token]):
     tokens: Sequence[Token] = field(default_factory=list[Token])
@@ -53,18 +125,26 @@ class TokenStream(Sized, Iterable[Token]):
         stream, _ = self.pop()
         return stream
 
-    def pop(self, rule_name: Optional[str] = None) -> tuple['TokenStream', Token]:
+    def pop(self, rule: Optional[str | int] = None) -> tuple['TokenStream', Token]:
+        if isinstance(rule, str):
+            rule = rule_id(rule)
         if not self:
-            raise TokenStreamError(state=self, msg='unexpected end of stream')
-        if rule_name is not None and self.head().rule_name != rule_name:
+            raise TokenStreamError(state=self, msg='unexpected end of stream', expected=rule)
+        head = self.tokens[0]
+        if rule is not None and head.rule_id != rule:
+            # Ids that were never interned have no name to report.
+            name = rule_name(rule) if 0 <= rule < len(_rule_names) else str(rule)
             raise TokenStreamError(state=self,
-                                   msg=f'got {self.head()} expected {rule_name}')
-        return TokenStream(self.tokens[1:]), self.head()
+                                   msg=f'got {head} expected {name}',
+                                   expected=rule)
+        return TokenStream(_suffix(self.tokens, 1)), head
 
 
 @dataclass(frozen=True, kw_only=True, repr=False)
 class TokenStreamError(errors.Error):
     state: TokenStream
+    # Id of the rule that was expected at state, if any.
+    expected: Optional[int] = None
 
     def _repr_line(self) -> str:
         return f'TokenStreamError(state={self.state},msg={repr(self.msg)})'
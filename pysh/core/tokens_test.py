@@ -3,6 +3,16 @@ from unittest import TestCase
 from . import chars, errors, tokens
 
 
+class RuleIdTest(TestCase):
+    def test_rule_id(self):
+        self.assertEqual(tokens.rule_id('r'), tokens.rule_id('r'))
+        self.assertNotEqual(tokens.rule_id('r'), tokens.rule_id('s'))
+        self.assertEqual(tokens.rule_name(tokens.rule_id('r')), 'r')
+
+    def test_token_rule_id(self):
+        self.assertEqual(tokens.Token('r', 'a').rule_id, tokens.rule_id('r'))
+
+
 class TokenTest(TestCase):
     def test_load(self):
         for rule_name, val, expected in list[tuple[str, Sequence[chars.Char] | chars.CharStream, tokens.Token]]([
@@ -159,6 +169,19 @@ class TokensTest(TestCase):
             with self.subTest(stream=stream, expected=expected):
                 self.assertEqual(stream.tail(), expected)
 
+    def test_tail_shared(self):
+        a, b, c = tokens.Token('r', 'a'), tokens.Token('s', 'b'), tokens.Token('t', 'c')
+        tokens_ = [a, b, c]
+        tail = tokens.TokenStream(tokens_).tail().tail()
+        assert isinstance(tail.tokens, tokens._Slice)
+        self.assertIs(tail.tokens.tokens, tokens_)
+        self.assertEqual(tail, tokens.TokenStream([c]))
+        self.assertEqual(repr(tail), repr(tokens.TokenStream([c])))
+        self.assertEqual(list(tokens.TokenStream(tokens_).tail().tokens[:-1]), [b])
+        self.assertEqual(tokens.TokenStream(tokens_).tail().tokens[-2], b)
+        with self.assertRaises(IndexError):
+            tail.tokens[-2]
+
     def test_tail_fail(self):
         with self.assertRaises(errors.Error):
             tokens.TokenStream().tail()
@@ -214,6 +237,9 @@ class TokensTest(TestCase):
         ]):
             with self.subTest(stream=stream, rule_name=rule_name, expected=expected):
                 self.assertEqual(stream.pop(rule_name), expected)
+                if rule_name is not None:
+                    self.assertEqual(
+                        stream.pop(tokens.rule_id(rule_name)), expected)
 
     def test_pop_fail(self):
         for stream, rule_name in list[tuple[tokens.TokenStream, Optional[str]]]([
@@ -233,5 +259,22 @@ class TokensTest(TestCase):
             ),
         ]):
             with self.subTest(stream=stream, rule_name=rule_name):
-                with self.assertRaises(errors.Error):
+                with self.assertRaises(tokens.TokenStreamError) as context:
                     stream.pop(rule_name)
+                self.assertEqual(
+                    context.exception.expected,
+                    tokens.rule_id(rule_name) if rule_name is not None else None,
+                )
+                if rule_name is not None:
+                    with self.assertRaises(errors.Error):
+                        stream.pop(tokens.rule_id(rule_name))
+
+    def test_pop_unknown_rule_id(self):
+        stream = tokens.TokenStream([tokens.Token('s', 'a')])
+        for rule in [len(tokens._rule_names) + 100, -1]:
+            with self.subTest(rule=rule):
+                with self.assertRaises(tokens.TokenStreamError) as context:
+                    stream.pop(rule)
+                self.assertEqual(context.exception.expected, rule)
+                self.assertEqual(context.exception.msg,
+                                 f'got {stream.head()} expected {rule}')
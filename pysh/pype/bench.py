@@ -0,0 +1,41 @@
+# Times pype grammar construction, parsing and evaluation: python -m pysh.pype.bench
+
+import time
+from typing import Callable
+from . import exprs, pype, statements
+from ..core import parser
+
+
+def _time(func: Callable[[], object], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count
+
+
+def build_grammar() -> None:
+    parser._parsers.clear()
+    parser._context_parsers.clear()
+    statements.Statement.parser_()
+    exprs.Expr.parser_()
+
+
+def parse_assignments() -> None:
+    statement_parser = statements.Statement.parser_()
+    state = statement_parser.lexer_('a = b; c = a.d + 1; e = c(a, b);' * 10)
+    while state:
+        state, _ = statement_parser(state)
+
+
+def main(count: int = 200) -> None:
+    pype.eval('a = 1; a;')
+    for name, func in list[tuple[str, Callable[[], object]]]([
+        ('build grammar', build_grammar),
+        ('parse 30 assignments', parse_assignments),
+        ('eval 30 assignments', lambda: pype.eval('a = 1; b = a; c = a + b;' * 10)),
+    ]):
+        print(f'{name}: {_time(func, count) * 1000:.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 from abc import abstractmethod
 from dataclasses import dataclass, field
-from typing import Iterable, Iterator, MutableSequence, Sequence, Sized, Type
+from functools import cached_property
+from typing import Iterable, Iterator, Mapping, MutableSequence, Sequence, Sized, Type
 from . import builtins_, vals
 from ..core import errors, lexer, parser, tokens
 
@@ -16,6 +17,15 @@ class Expr(parser.Parsable['Expr']):
             Ref,
         ]
 
+    @classmethod
+    def _parse_rule(cls) -> parser.SingleResultRule['Expr']:
+        return parser.OperatorTable['Expr'](
+            parser.Or['Expr']([type.ref() for type in cls._types()]),
+            infix=[
+                BinaryOperation.infix_operator('+', 1),
+            ],
+        )
+
 
 @dataclass(frozen=True)
 class Arg:
@@ -63,7 +73,8 @@ class Args(Sized, Iterable[Arg]):
         ).with_lexer(lexer.Lexer.whitespace())
 
 
-id_lex_rule = lexer.Rule.load('id', '(_|[a-z]|[A-Z])+')
+id_lex_rule = lexer.Rule.load(
+    'id', '(_|[a-z]|[A-Z])+').with_keywords('none', 'return')
 
 
 @dataclass(frozen=True)
@@ -186,18 +197,49 @@ class Ref(Expr):
 
     @classmethod
     def _parse_rule(cls) -> parser.SingleResultRule[Expr]:
-        class Adapter(parser.SingleResultRule[Expr]):
-            def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Expr]) -> parser.StateAndSingleResult[Expr]:
-                state, head = Ref.Head.parser_()(state)
-                state, tails = Ref.Tail.parser_(scope).zero_or_more()(
-                    state, Ref.Tail.parser_(scope).scope)
-                return state, Ref(head, tails)
-
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return Ref.Head.parser_().lexer_ | Ref.Tail.parser_(parser.Scope()).lexer_
-
-        return Adapter()
+        return _RefRule()
+
+
+class _RefRule(parser.SingleResultRule[Expr]):
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Expr]) -> parser.StateAndSingleResult[Expr]:
+        state, head = Ref.Head.parser_()(state)
+        state, tails = Ref.Tail.parser_(scope).zero_or_more()(
+            state, Ref.Tail.parser_(scope).scope)
+        return state, Ref(head, tails)
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return Ref.Head.parser_().lexer_ | Ref.Tail.parser_(parser.Scope()).lexer_
+
+    def first(self, scope: parser.Scope[Expr], refs: frozenset[str] = frozenset()) -> parser.First:
+        return Ref.Head.parser_().first(parser.Scope(), refs)
+
+
+_binary_operation_funcs: Mapping[str, str] = {
+    '+': '__add__',
+}
+
+
+@dataclass(frozen=True)
+class BinaryOperation(Expr):
+    operator: str
+    lhs: Expr
+    rhs: Expr
+
+    def __str__(self) -> str:
+        return f'({self.lhs} {self.operator} {self.rhs})'
+
+    def eval(self, scope: vals.Scope) -> vals.Val:
+        lhs = self.lhs.eval(scope)
+        return lhs[_binary_operation_funcs[self.operator]](scope, vals.Args([vals.Arg(self.rhs.eval(scope))]))
+
+    @staticmethod
+    def infix_operator(operator: str, precedence: int) -> parser.InfixOperator[Expr]:
+        return parser.InfixOperator[Expr](
+            lexer.Rule.load(operator),
+            precedence,
+            lambda lhs, rhs: BinaryOperation(operator, lhs, rhs),
+        )
 
 
 def ref(head_val: str | vals.Val, *tail_vals: str | Args) -> Ref:
@@ -67,6 +67,27 @@ class ExprTest(TestCase):
                 'a(b, c).d',
                 _ref('a', _args('b', 'c'), 'd'),
             ),
+            (
+                'a + 1',
+                exprs.BinaryOperation('+', _ref('a'), _ref(_int(1))),
+            ),
+            (
+                'a + b(c + d) + e',
+                exprs.BinaryOperation(
+                    '+',
+                    exprs.BinaryOperation(
+                        '+',
+                        _ref('a'),
+                        _ref('b', _args(exprs.BinaryOperation(
+                            '+', _ref('c'), _ref('d')))),
+                    ),
+                    _ref('e'),
+                ),
+            ),
+            (
+                'a +',
+                None,
+            ),
         ]):
             with self.subTest(input=input, expected=expected):
                 if expected is None:
@@ -380,3 +401,15 @@ class ArgsTest(TestCase):
                     self.assertEqual(state, tokens.TokenStream())
                     self.assertEqual(actual, expected,
                                      f'{actual} != {expected}')
+
+
+class BinaryOperationTest(TestCase):
+    def test_eval(self):
+        self.assertEqual(
+            exprs.BinaryOperation(
+                '+',
+                _ref('a'),
+                _ref(_int(2)),
+            ).eval(vals.Scope({'a': _int(1)})),
+            _int(3),
+        )
@@ -1,5 +1,6 @@
-from typing import Optional, Sequence
+from typing import Iterator, Optional, Sequence
 from . import builtins_, statements, vals
+from ..core import lexer_gen, parser_gen
 
 
 def load(input: str) -> statements.Statement:
@@ -9,11 +10,18 @@ def load(input: str) -> statements.Statement:
         else:
             return statements.Block(statements_)
 
-    _, statements_ = statements.Statement.parser_(
-    ).until_empty().convert(load).eval(input)
+    rule = parser_gen.cached(statements.Statement.parser_(), reparse_deep=True).until_empty().convert(load)
+    _, statements_ = rule.eval(lexer_gen.cached(rule.lexer_)(input))
     return statements_
 
 
+def load_stream(input: str) -> Iterator[statements.Statement]:
+    # Statements are parsed one at a time, so each can be evaluated before the next is
+    # parsed, but the whole input is lexed up front and its tokens are held until the end.
+    rule = parser_gen.cached(statements.Statement.parser_(), reparse_deep=True)
+    return rule.stream(lexer_gen.cached(rule.lexer_)(input))
+
+
 def eval(input: str, scope: Optional[vals.Scope] = None) -> vals.Val:
     statement = load(input)
     scope = scope or vals.Scope()
@@ -28,3 +36,13 @@ def eval(input: str, scope: Optional[vals.Scope] = None) -> vals.Val:
     else:
         last_statement.eval(scope)
         return builtins_.none
+
+
+def eval_stream(input: str, scope: Optional[vals.Scope] = None) -> Iterator[vals.Val]:
+    scope = scope or vals.Scope()
+    for statement in load_stream(input):
+        if isinstance(statement, statements.ExprStatement):
+            yield statement.val.eval(scope)
+        else:
+            statement.eval(scope)
+            yield builtins_.none
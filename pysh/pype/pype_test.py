@@ -1,7 +1,10 @@
-from typing import Optional
+import os
+import sys
+import tempfile
+from typing import Optional, Sequence
 from unittest import TestCase
-from . import builtins_, pype, vals
-from ..core import errors
+from . import builtins_, pype, statements, vals
+from ..core import errors, parser, parser_gen
 
 
 class PypeTest(TestCase):
@@ -31,6 +34,18 @@ class PypeTest(TestCase):
                 'a = 1; { a = 2; } a;',
                 builtins_.int_(1),
             ),
+            (
+                'none;',
+                builtins_.none,
+            ),
+            (
+                'returnx = 1; returnx;',
+                builtins_.int_(1),
+            ),
+            (
+                'a = 1; b = a + 2; a + b + 3;',
+                builtins_.int_(7),
+            ),
         ]):
             with self.subTest(input=input, expected=expected):
                 if expected is None:
@@ -38,3 +53,93 @@ class PypeTest(TestCase):
                         pype.eval(input)
                 else:
                     self.assertEqual(pype.eval(input), expected)
+
+    def test_eval_stream(self):
+        for input, expected in list[tuple[str, Sequence[vals.Val]]]([
+            (
+                '',
+                [],
+            ),
+            (
+                'a = 1; a + 1; {} a;',
+                [builtins_.none, builtins_.int_(2),
+                 builtins_.none, builtins_.int_(1)],
+            ),
+        ]):
+            with self.subTest(input=input, expected=expected):
+                self.assertEqual(list(pype.eval_stream(input)), expected)
+
+    def test_eval_stream_error(self):
+        stream = pype.eval_stream('1; 2 +;')
+        self.assertEqual(next(stream), builtins_.int_(1))
+        with self.assertRaises(errors.Error):
+            next(stream)
+
+    def test_load_deep(self):
+        depth = sys.getrecursionlimit() * 2
+        statement = pype.load('{' * depth + 'a = 1;' + '}' * depth + ' 1;')
+        assert isinstance(statement, statements.Block)
+        self.assertEqual(len(statement), 2)
+        block = statement.statements[0]
+        for _ in range(depth):
+            assert isinstance(block, statements.Block)
+            self.assertEqual(len(block), 1)
+            block = block.statements[0]
+        self.assertIsInstance(block, statements.Assignment)
+        self.assertEqual(pype.eval('{' * 100 + 'a = 1;' + '}' * 100 + ' 1;'), builtins_.int_(1))
+
+    def test_load_error(self):
+        for input, expected_msg in list[tuple[str, str]]([
+            (
+                'a = 1',
+                'expected one of (, +, ., ; got end of stream',
+            ),
+            (
+                'a =',
+                'expected one of id, int, none got end of stream',
+            ),
+        ]):
+            with self.subTest(input=input, expected_msg=expected_msg):
+                with self.assertRaises(errors.Error) as context:
+                    pype.load(input)
+                self.assertEqual(context.exception.msg, expected_msg)
+
+    def test_save_load_file(self):
+        input = 'a = b.c(1, d) + 2;'
+        statement_parser = statements.Statement.parser_()
+        with tempfile.TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'statements.py')
+            parser_gen.GeneratedParser.load(statement_parser).save(
+                path, statements.Statement.parser_)
+            self.assertEqual(
+                parser_gen.GeneratedParser.load_file(path)(input),
+                statement_parser(input),
+            )
+
+    def test_eval_defines_no_types(self):
+        # Covers both the core parser's rules and pype's own, which the pype grammar builds on.
+        def types(type_: type) -> set[type]:
+            subclasses = set[type](type_.__subclasses__())
+            for subclass in list(subclasses):
+                subclasses |= types(subclass)
+            return subclasses
+
+        input = 'a = 1; b = a; c = b + a; d = c; e = d + 1; e;'
+        parsers = dict(parser._parsers)
+        context_parsers = dict(parser._context_parsers)
+        try:
+            self.assertEqual(pype.eval(input), builtins_.int_(3))
+            expected = types(parser.Rule)
+            for _ in range(5):
+                parser._parsers.clear()
+                parser._context_parsers.clear()
+                statement_parser = statements.Statement.parser_()
+                _, statement = statement_parser(statement_parser.lexer_('a = b.c + 1;'))
+                self.assertIsInstance(statement, statements.Assignment)
+                self.assertEqual(pype.eval(input), builtins_.int_(3))
+            self.assertEqual(types(parser.Rule), expected)
+        finally:
+            parser._parsers.clear()
+            parser._parsers.update(parsers)
+            parser._context_parsers.clear()
+            parser._context_parsers.update(context_parsers)
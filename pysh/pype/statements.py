@@ -1,5 +1,6 @@
 from abc import abstractmethod
 from dataclasses import dataclass, field
+from functools import cached_property
 from typing import Iterable, Iterator, Optional, Sequence, Sized, Type
 from . import exprs,  vals
 from ..core import errors, lexer, parser, tokens
@@ -73,6 +74,7 @@ class Block(Statement, Sized, Iterable[Statement]):
         close_brace_lex_rule = lexer.Rule.load('}')
         return (
             '{' &
+            parser.Cut[Statement]() &
             Statement.ref().until_token(close_brace_lex_rule) &
             close_brace_lex_rule
         ).convert(Block).with_lexer(lexer.Lexer.whitespace())
@@ -104,20 +106,26 @@ class Assignment(Statement):
 
     @classmethod
     def _parse_rule(cls) -> parser.SingleResultRule[Statement]:
-        class Adapter(parser.SingleResultRule[Statement]):
-            def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Statement]) -> parser.StateAndSingleResult[Statement]:
-                state, name = exprs.Ref._parse_rule()(state, exprs.Expr.parser_().scope)
-                assert isinstance(name, exprs.Ref)
-                state, _ = state.pop('=')
-                state, val = exprs.Expr.parser_()(state)
-                state, _ = state.pop(';')
-                return state, Assignment(name, val)
+        return _AssignmentRule()
 
-            @property
-            def lexer_(self) -> lexer.Lexer:
-                return lexer.Lexer.literal('=', ';') | exprs.Expr.parser_().lexer_ | lexer.Lexer.whitespace()
 
-        return Adapter()
+class _AssignmentRule(parser.SingleResultRule[Statement]):
+    def __call__(self, state: tokens.TokenStream, scope: parser.Scope[Statement]) -> parser.StateAndSingleResult[Statement]:
+        expr_parser = exprs.Expr.parser_()
+        state, name = expr_parser.scope[exprs.Ref._name()](state, expr_parser.scope)
+        assert isinstance(name, exprs.Ref)
+        state, _ = state.pop('=')
+        state, val = expr_parser(state)
+        state, _ = state.pop(';')
+        return state, Assignment(name, val)
+
+    @cached_property
+    def lexer_(self) -> lexer.Lexer:
+        return lexer.Lexer.literal('=', ';') | exprs.Expr.parser_().lexer_ | lexer.Lexer.whitespace()
+
+    def first(self, scope: parser.Scope[Statement], refs: frozenset[str] = frozenset()) -> parser.First:
+        expr_parser = exprs.Expr.parser_()
+        return expr_parser.scope[exprs.Ref._name()].first(expr_parser.scope, refs)
 
 
 @dataclass(frozen=True)
@@ -133,6 +141,7 @@ class Return(Statement):
             return Return(val)
         return (
             'return' &
+            parser.Cut[exprs.Expr]() &
             exprs.Expr.parser_().zero_or_one() &
             ';'
         ).convert_type(load).with_lexer(lexer.Lexer.whitespace())